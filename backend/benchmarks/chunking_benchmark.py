@@ -0,0 +1,102 @@
+"""
+Micro-benchmark for pdf_service.chunk_text_by_tokens.
+
+Generates synthetic insurance policies of 10-500 pages and reports chunks/sec,
+throughput and peak memory for single-pass and batched encoding.
+
+Run from the backend directory:
+    python -m benchmarks.chunking_benchmark [--pages 10 50 100 250 500] [--json results.json]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from typing import Dict, List
+
+from pdf_service import chunk_text_by_tokens, MAX_CHUNK_TOKENS
+
+SECTION_TITLES = [
+    "DEFINITIONS", "COVERAGE", "EXCLUSIONS", "CONDITIONS", "CLAIMS PROCEDURE",
+    "PREMIUM", "CANCELLATION", "GENERAL PROVISIONS", "SCHEDULE OF BENEFITS"
+]
+VOCABULARY = (
+    "the insured policyholder shall coverage premium deductible claim benefit "
+    "exclusion liability accident hospital treatment period notice insurer "
+    "amount payable subject to conditions endorsement schedule limit sum assured "
+    "pre-existing waiting renewal nominee grace reimbursement cashless network"
+).split()
+
+def synthetic_policy(pages: int, seed: int = 42, lines_per_page: int = 45) -> str:
+    """Build policy-like text: headings, numbered clauses, sentences and page breaks"""
+    rng = random.Random(seed)
+    page_texts = []
+    clause = 1
+    for page in range(pages):
+        lines = [f"Page {page + 1} of {pages}"]
+        while len(lines) < lines_per_page:
+            if rng.random() < 0.08:
+                lines.append("")
+                lines.append(rng.choice(SECTION_TITLES))
+            sentences = []
+            for _ in range(rng.randint(1, 4)):
+                words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 30))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            lines.append(f"{clause}. " + " ".join(sentences))
+            lines.append("")
+            clause += 1
+        page_texts.append("\n".join(lines))
+    return "\n".join(page_texts)
+
+def run_case(text: str, max_tokens: int, batch_encode: bool, repeats: int) -> Dict[str, float]:
+    # Timing runs without tracemalloc, which slows allocation-heavy code considerably
+    durations = []
+    chunks: List[str] = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        chunks = chunk_text_by_tokens(text, max_tokens, batch_encode=batch_encode)
+        durations.append(time.perf_counter() - started)
+
+    if "".join(chunks) != text:
+        raise AssertionError("Chunks do not reassemble into the original text")
+
+    tracemalloc.start()
+    chunk_text_by_tokens(text, max_tokens, batch_encode=batch_encode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(durations)
+    return {
+        "chunks": len(chunks),
+        "seconds": round(best, 6),
+        "chunks_per_sec": round(len(chunks) / best, 1) if best else None,
+        "mb_per_sec": round(len(text.encode("utf-8")) / best / 1e6, 2) if best else None,
+        "peak_memory_mb": round(peak / 1e6, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark token-based text chunking")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    parser.add_argument("--max-tokens", type=int, default=MAX_CHUNK_TOKENS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", dest="json_path", help="Write results to this file as JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'pages':>6} {'chars':>10} {'mode':>8} {'chunks':>7} {'seconds':>9} {'chunks/s':>10} {'MB/s':>7} {'peak MB':>8}")
+    for pages in args.pages:
+        text = synthetic_policy(pages)
+        for batch_encode in (False, True):
+            result = run_case(text, args.max_tokens, batch_encode, args.repeats)
+            result.update({"pages": pages, "characters": len(text), "batch_encode": batch_encode})
+            results.append(result)
+            mode = "batched" if batch_encode else "single"
+            print(f"{pages:>6} {len(text):>10} {mode:>8} {result['chunks']:>7} {result['seconds']:>9.4f} "
+                  f"{result['chunks_per_sec']:>10} {result['mb_per_sec']:>7} {result['peak_memory_mb']:>8}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as out:
+            json.dump({"max_tokens": args.max_tokens, "results": results}, out, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+"""
+End-to-end load benchmark for /upload, /feedback and /translate.
+
+Starts local stand-ins for the Azure OpenAI chat completions API (including
+streaming) and the Azure Translator v3 API, with configurable latency,
+token-proportional delays, a tokens-per-minute quota and random 429 injection.
+The app runs through run.py in a subprocess pointed at the stubs; a synthetic PDF
+corpus of varied size is uploaded at the target concurrency. Reports per-endpoint
+p50/p95/p99 latency, throughput, the app's peak RSS and the number of upstream
+calls, optionally as JSON for comparing commits.
+
+Run from the backend directory:
+    python -m benchmarks.load_benchmark [--requests 60] [--concurrency 8] [--json load.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.chunking_benchmark import synthetic_policy
+
+LINES_PER_PAGE = 45
+PAGE_BREAK = re.compile(r"\n(?=Page \d+ of \d+\n)")
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Minimal PDF with one Helvetica text line per entry, readable by PyPDF2"""
+    objects: List[bytes] = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", b""]
+    kids = []
+    for lines in pages:
+        operations = ["BT /F1 9 Tf 12 TL 30 810 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            operations.append(f"({escaped}) Tj T*")
+        operations.append("ET")
+        stream = "\n".join(operations).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    return bytes(out)
+
+def build_corpus(page_counts: List[int], documents: int, seed: int) -> List[Tuple[str, bytes]]:
+    """Distinct synthetic policies cycling through the given page counts"""
+    corpus = []
+    for index in range(documents):
+        pages = page_counts[index % len(page_counts)]
+        # Split on the page headers; a page can run a few lines over LINES_PER_PAGE
+        text = synthetic_policy(pages, seed=seed + index, lines_per_page=LINES_PER_PAGE)
+        page_lines = [page.split("\n") for page in PAGE_BREAK.split(text)]
+        corpus.append((f"policy-{index}-{pages}p.pdf", make_pdf(page_lines)))
+    return corpus
+
+def approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class StubServers:
+    """
+    Azure OpenAI and Translator stand-ins on one aiohttp server. Chat completion
+    latency is base latency plus per-token delays for the prompt and the generated
+    completion; requests beyond the tokens-per-minute quota, and a random share of
+    the rest, get 429 with Retry-After headers.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.counts = {
+            "chat_completions": 0,
+            "chat_completions_streamed": 0,
+            "chat_rate_limited": 0,
+            "chat_peak_concurrency": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "translator_requests": 0,
+            "translator_characters": 0
+        }
+        self.active_chats = 0
+        self.quota_tokens = float(args.tpm)
+        self.quota_updated = time.monotonic()
+        self.runner: Optional[web.AppRunner] = None
+
+    def _take_quota(self, tokens: int) -> Optional[float]:
+        """Charge the TPM quota; returns seconds until it allows the request if exhausted"""
+        if not self.args.tpm:
+            return None
+        now = time.monotonic()
+        self.quota_tokens = min(self.args.tpm, self.quota_tokens + (now - self.quota_updated) * self.args.tpm / 60)
+        self.quota_updated = now
+        if tokens > self.quota_tokens:
+            return (min(tokens, self.args.tpm) - self.quota_tokens) * 60 / self.args.tpm
+        self.quota_tokens -= tokens
+        return None
+
+    def _rate_limited(self, retry_after: float) -> web.Response:
+        self.counts["chat_rate_limited"] += 1
+        return web.json_response(
+            {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+            status=429,
+            headers={"retry-after": str(max(1, round(retry_after))), "retry-after-ms": str(int(retry_after * 1000))}
+        )
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt_tokens = sum(approximate_tokens(message["content"]) for message in body["messages"])
+        completion_tokens = min(body.get("max_tokens") or 1000, self.args.completion_tokens)
+
+        retry_after = self._take_quota(prompt_tokens + (body.get("max_tokens") or 1000))
+        if retry_after is not None:
+            return self._rate_limited(retry_after)
+        if self.rng.random() < self.args.error_rate:
+            return self._rate_limited(self.args.retry_after)
+
+        self.counts["chat_completions"] += 1
+        self.counts["prompt_tokens"] += prompt_tokens
+        self.counts["completion_tokens"] += completion_tokens
+        self.active_chats += 1
+        self.counts["chat_peak_concurrency"] = max(self.counts["chat_peak_concurrency"], self.active_chats)
+        try:
+            return await self._complete(request, body, prompt_tokens, completion_tokens)
+        finally:
+            self.active_chats -= 1
+
+    async def _complete(self, request: web.Request, body: Dict[str, Any], prompt_tokens: int, completion_tokens: int) -> web.StreamResponse:
+        await asyncio.sleep(self.args.latency + prompt_tokens * self.args.prompt_token_latency)
+
+        words = ["Summary", "of", f"{prompt_tokens}", "prompt", "tokens."]
+        words += [self.rng.choice(("coverage", "premium", "exclusion", "claim", "benefit")) for _ in range(completion_tokens - len(words))]
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(completion_tokens * self.args.completion_token_latency)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model") or request.match_info["deployment"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        self.counts["chat_completions_streamed"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, word in enumerate(words):
+            await asyncio.sleep(self.args.completion_token_latency)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model") or request.match_info["deployment"],
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if index == 0 else " " + word},
+                    "finish_reason": None
+                }]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def translate(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        languages = request.query.getall("to")
+        characters = sum(len(item["text"]) for item in body) * len(languages)
+        self.counts["translator_requests"] += 1
+        self.counts["translator_characters"] += characters
+        await asyncio.sleep(self.args.translator_latency + characters * self.args.translator_character_latency)
+        return web.json_response([
+            {"translations": [{"text": f"[{language}] {item['text']}", "to": language} for language in languages]}
+            for item in body
+        ])
+
+    async def start(self, port: int) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completions)
+        app.router.add_post("/translate", self.translate)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(port: int, stub_url: str, workdir: str, args: argparse.Namespace) -> subprocess.Popen:
+    """Run the API through run.py with Azure endpoints pointed at the stubs and cold caches"""
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="benchmark",
+        OPENAI_API_BASE=stub_url,
+        OPENAI_MODEL_NAME=args.model,
+        AZURE_TRANSLATOR_KEY="benchmark",
+        AZURE_TRANSLATOR_ENDPOINT=stub_url,
+        AZURE_TRANSLATOR_REGION="local",
+        CACHE_DB_PATH=os.path.join(workdir, "cache.db") if args.persistent_cache else "",
+        JOB_DB_PATH=os.path.join(workdir, "jobs.db"),
+        JOB_STORAGE_DIR=os.path.join(workdir, "jobs"),
+        PROFILING_ENABLED="false",
+        SERVER_PORT=str(port),
+        SERVER_WORKERS=str(args.workers)
+    )
+    if args.app_tpm:
+        env["OPENAI_TOKENS_PER_MINUTE"] = str(args.app_tpm)
+    log = open(args.app_log, "ab") if args.app_log else subprocess.DEVNULL
+    return subprocess.Popen(
+        [sys.executable, "run.py"],
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+
+async def wait_until_ready(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    process: subprocess.Popen,
+    timeout: float = 60
+) -> Dict[str, Any]:
+    """Poll GET /ready until the app has warmed up and return the startup timings it reports"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} during startup")
+        try:
+            async with session.get(f"{base_url}/ready") as response:
+                if response.status == 200:
+                    return (await response.json())["startup_seconds"]
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("App did not become ready in time")
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and its descendants (Linux only)"""
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                for child in children.read().split():
+                    pids.extend(_process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Summed peak resident set size of a process and its workers (Linux only)"""
+    total_kb = 0
+    for process in _process_tree(pid):
+        try:
+            with open(f"/proc/{process}/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1) if total_kb else None
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def choose_operations(args: argparse.Namespace) -> List[str]:
+    rng = random.Random(args.seed)
+    weights = {"upload": args.upload_weight, "feedback": args.feedback_weight, "translate": args.translate_weight}
+    names = [name for name, weight in weights.items() if weight > 0]
+    return rng.choices(names, weights=[weights[name] for name in names], k=args.requests)
+
+async def drive(base_url: str, corpus: List[Tuple[str, bytes]], args: argparse.Namespace) -> Tuple[Dict[str, Any], float]:
+    """Send the request mix with at most args.concurrency requests outstanding"""
+    operations = choose_operations(args)
+    rng = random.Random(args.seed)
+    latencies: Dict[str, List[float]] = {"upload": [], "feedback": [], "translate": []}
+    errors: Dict[str, int] = {"upload": 0, "feedback": 0, "translate": 0}
+    documents: List[Tuple[str, str]] = []
+    next_document = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for operation in operations:
+        queue.put_nowait(operation)
+
+    async def upload(session: aiohttp.ClientSession) -> bool:
+        nonlocal next_document
+        filename, content = corpus[next_document % len(corpus)]
+        next_document += 1
+        form = aiohttp.FormData()
+        form.add_field("files", content, filename=filename, content_type="application/pdf")
+        if args.target_language:
+            form.add_field("target_language", args.target_language)
+        async with session.post(f"{base_url}/upload", data=form) as response:
+            if response.status != 200:
+                return False
+            result = (await response.json())["results"][0]
+            if "error" in result:
+                return False
+            documents.append((result["documentId"], result["summaries"]["original"]))
+            return True
+
+    async def feedback(session: aiohttp.ClientSession) -> bool:
+        document_id, _ = rng.choice(documents)
+        form = aiohttp.FormData()
+        form.add_field("summary_id", document_id)
+        form.add_field("feedback_type", "unclear")
+        form.add_field("feedback_text", "Explain the exclusions and the claim procedure in plain words")
+        form.add_field("document_id", document_id)
+        async with session.post(f"{base_url}/feedback", data=form) as response:
+            await response.read()
+            return response.status == 200
+
+    async def translate(session: aiohttp.ClientSession) -> bool:
+        _, summary = rng.choice(documents)
+        form = aiohttp.FormData()
+        form.add_field("text", summary)
+        form.add_field("target_language", args.target_language or "hi")
+        async with session.post(f"{base_url}/translate", data=form) as response:
+            await response.read()
+            return response.status == 200
+
+    handlers = {"upload": upload, "feedback": feedback, "translate": translate}
+
+    async def worker(session: aiohttp.ClientSession):
+        while not queue.empty():
+            operation = queue.get_nowait()
+            # Feedback and translation need a summary; upload one first if none exists yet
+            if operation != "upload" and not documents:
+                operation = "upload"
+            started = time.perf_counter()
+            try:
+                succeeded = await handlers[operation](session)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                succeeded = False
+            latencies[operation].append(time.perf_counter() - started)
+            if not succeeded:
+                errors[operation] += 1
+
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+
+    endpoints = {
+        name: {
+            "requests": len(values),
+            "errors": errors[name],
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1) if values else None,
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1) if values else None,
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1) if values else None,
+            "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else None
+        }
+        for name, values in latencies.items()
+    }
+    return endpoints, wall
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    corpus = build_corpus(args.pages, args.documents, args.seed)
+    stubs = StubServers(args)
+    stub_url = await stubs.start(args.stub_port or free_port())
+    app_port = args.app_port or free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    with tempfile.TemporaryDirectory() as workdir:
+        launched = time.perf_counter()
+        process = start_app(app_port, stub_url, workdir, args)
+        try:
+            async with aiohttp.ClientSession() as session:
+                startup = await wait_until_ready(session, base_url, process)
+            # Launch of run.py until /ready answers 200, interpreter start included
+            cold_start = time.perf_counter() - launched
+            endpoints, wall = await drive(base_url, corpus, args)
+            rss = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            await stubs.stop()
+
+    total_requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key != "json_path"},
+        "corpus": [{"filename": filename, "bytes": len(content)} for filename, content in corpus],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total_requests / wall, 3) if wall else None,
+        "peak_rss_mb": rss,
+        "cold_start_seconds": round(cold_start, 3),
+        "startup_seconds": startup,
+        "endpoints": endpoints,
+        "upstream": stubs.counts
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark against local Azure stand-ins")
+    parser.add_argument("--requests", type=int, default=60, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests outstanding at once")
+    parser.add_argument("--upload-weight", type=float, default=0.5)
+    parser.add_argument("--feedback-weight", type=float, default=0.25)
+    parser.add_argument("--translate-weight", type=float, default=0.25)
+    parser.add_argument("--pages", type=int, nargs="+", default=[2, 10, 40, 120], help="Page counts of the corpus")
+    parser.add_argument("--documents", type=int, default=12, help="Distinct PDFs; uploads cycle through them")
+    parser.add_argument("--target-language", default=None, help="Also translate each uploaded summary")
+    parser.add_argument("--model", default="gpt-4o", help="Deployment name the app is configured with")
+    parser.add_argument("--latency", type=float, default=0.2, help="Base chat completion latency in seconds")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.00002, help="Seconds per prompt token")
+    parser.add_argument("--completion-token-latency", type=float, default=0.002, help="Seconds per generated token")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="Tokens generated per completion (capped by max_tokens)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute quota enforced by the stub (0 disables)")
+    parser.add_argument("--workers", type=int, default=1, help="SERVER_WORKERS given to run.py")
+    parser.add_argument("--app-tpm", type=int, default=0, help="OPENAI_TOKENS_PER_MINUTE given to the app (0 leaves it unset)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of chat completions answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--translator-latency", type=float, default=0.05, help="Base Translator latency in seconds")
+    parser.add_argument("--translator-character-latency", type=float, default=0.000005, help="Seconds per translated character")
+    parser.add_argument("--persistent-cache", action="store_true", help="Enable the SQLite cache tier (in a temp dir)")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--app-log", help="Append the app's output to this file instead of discarding it")
+    parser.add_argument("--app-port", type=int, default=0)
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", help="Write results to this file as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(f"{'endpoint':>10} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, endpoint in results["endpoints"].items():
+        print(f"{name:>10} {endpoint['requests']:>9} {endpoint['errors']:>7} {str(endpoint['p50_ms']):>9} "
+              f"{str(endpoint['p95_ms']):>9} {str(endpoint['p99_ms']):>9}")
+    print(f"throughput: {results['throughput_rps']} req/s over {results['wall_seconds']}s, peak RSS: {results['peak_rss_mb']} MB")
+    print(f"cold start: {results['cold_start_seconds']}s to ready ("
+          + ", ".join(f"{phase}={seconds}s" for phase, seconds in results["startup_seconds"].items()) + ")")
+    print("upstream: " + ", ".join(f"{name}={count}" for name, count in results["upstream"].items()))
+
+    if args.json_path:
+        with open(args.json_path, "w") as out:
+            json.dump(results, out, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import CACHE_CONFIG
+from metrics_service import COALESCED_CALLS
+
+logger = logging.getLogger(__name__)
+
+def make_cache_key(*parts: Any) -> str:
+    """Create a content-addressed cache key from all parts that affect the cached value"""
+    key_string = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+class MemoryLRUCache:
+    """In-memory LRU cache with entry-count, size and TTL based eviction"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._size = 0
+        # key -> (stored at, value, UTF-8 size of the value)
+        self._data: "OrderedDict[str, tuple[float, str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            stored_at, value, _ = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._remove(key)
+            size = len(value.encode("utf-8"))
+            self._data[key] = (time.time(), value, size)
+            self._size += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._size > self.max_bytes)
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        """Size of the cached values in bytes, UTF-8 encoded"""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SQLiteCache:
+    """On-disk cache tier stored in a SQLite table, evicted by entry count and TTL"""
+
+    def __init__(self, path: str, table: str, max_entries: int = 10000, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_idx ON {table} (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.evictions += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        cursor = self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class TieredCache:
+    """
+    Two-tier cache: a fast in-memory LRU in front of an optional persistent tier.
+    Disk hits are promoted into memory; writes go to both tiers. Without a memory
+    tier every lookup reads the persistent tier, so processes sharing it always see
+    each other's latest writes.
+    """
+
+    def __init__(self, memory: Optional[MemoryLRUCache], disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                if self.memory is not None:
+                    self.memory.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def delete(self, key: str):
+        if self.memory is not None:
+            self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters plus current occupancy, for sizing the cache"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        stats = {
+            "hits": self.memory_hits + self.disk_hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory) if self.memory is not None else 0,
+            "memory_size": self.memory.size if self.memory is not None else 0,
+            "memory_evictions": self.memory.evictions if self.memory is not None else 0
+        }
+        if self.disk is not None:
+            try:
+                stats["disk_entries"] = len(self.disk)
+            except sqlite3.Error:
+                stats["disk_entries"] = None
+            stats["disk_evictions"] = self.disk.evictions
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+def create_cache(name: str, memory_tier: bool = True) -> TieredCache:
+    """
+    Build a tiered cache from the CACHE_CONFIG section with the given name. With
+    memory_tier=False the cache reads and writes the persistent tier only (for
+    mutable entries shared by several processes), unless there is no persistent tier.
+    """
+    settings = CACHE_CONFIG[name]
+
+    disk = None
+    if settings["persistent"] and CACHE_CONFIG["db_path"]:
+        try:
+            disk = SQLiteCache(
+                CACHE_CONFIG["db_path"],
+                table=f"{name}_cache",
+                max_entries=settings["disk_max_entries"],
+                ttl_seconds=settings["ttl_seconds"]
+            )
+        except sqlite3.Error as e:
+            # Fall back to memory only rather than failing startup
+            logger.error(f"Could not open persistent {name} cache at {CACHE_CONFIG['db_path']}: {e}")
+
+    memory = None
+    if memory_tier or disk is None:
+        if not memory_tier:
+            logger.warning(f"The {name} cache has no persistent tier; entries are not shared between processes")
+        memory = MemoryLRUCache(
+            max_entries=settings["memory_max_entries"],
+            ttl_seconds=settings["ttl_seconds"],
+            max_bytes=settings.get("memory_max_bytes")
+        )
+
+    return TieredCache(memory, disk)
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    De-duplicates concurrent calls: callers of do() with a key that is already in
+    flight await the same task instead of starting their own. The result or exception
+    goes to every caller; nothing is remembered once the call finishes, so caching
+    stays with the caches. A caller that is cancelled only stops waiting; the call is
+    cancelled when its last caller goes away. The task runs in the context of the
+    caller that started it, so its stage timings are attributed to that request.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            COALESCED_CALLS.labels(self.name).inc()
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                # This caller was cancelled, not the call
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    self._forget(key, flight)
+                    flight.task.cancel()
+            raise
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -8,19 +8,202 @@ load_dotenv()
 OPENAI_CONFIG = {
     "api_key": os.getenv("OPENAI_API_KEY"),
     "api_version": "2024-02-15-preview",
-    "azure_endpoint": os.getenv("OPENAI_API_BASE")
+    "azure_endpoint": os.getenv("OPENAI_API_BASE"),
+    # Upstream concurrency (per host in multi-worker mode) and HTTP connection pool for the async client
+    "max_concurrent_calls": int(os.getenv("OPENAI_MAX_CONCURRENT_CALLS", "5")),
+    "max_connections": int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),
+    "max_keepalive_connections": int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50")),
+    "keepalive_expiry": float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+    "timeout": float(os.getenv("OPENAI_TIMEOUT", "120")),
+    # Deployment quota the scheduler meters against (0 disables a limit), and retries
+    # of rate-limited or failed connections, honoring Retry-After
+    "tokens_per_minute": int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0")),
+    "requests_per_minute": int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0")),
+    "max_retries": int(os.getenv("OPENAI_MAX_RETRIES", "5")),
+    "retry_base_delay": float(os.getenv("OPENAI_RETRY_BASE_DELAY", "1")),
+    "retry_max_delay": float(os.getenv("OPENAI_RETRY_MAX_DELAY", "60")),
+    # Azure deployment name, and the model it serves when the name differs (see MODEL_REGISTRY)
+    "deployment": os.getenv("OPENAI_MODEL_NAME"),
+    "model": os.getenv("OPENAI_MODEL") or os.getenv("OPENAI_MODEL_NAME"),
+    # Optional cap on document tokens per request (default: whatever fits the context window)
+    "max_chunk_tokens": int(os.getenv("OPENAI_MAX_CHUNK_TOKENS")) if os.getenv("OPENAI_MAX_CHUNK_TOKENS") else None,
+    # Optional overrides of the model profile, for deployments whose limits differ from MODEL_REGISTRY
+    "context_window": int(os.getenv("OPENAI_CONTEXT_WINDOW")) if os.getenv("OPENAI_CONTEXT_WINDOW") else None,
+    "max_output_tokens": int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS")) if os.getenv("OPENAI_MAX_OUTPUT_TOKENS") else None
+}
+
+# Context window, output limit and tokenizer per model. Deployment/model names are
+# matched exactly first, then by longest prefix (e.g. "gpt-4o-2024-08-06" -> "gpt-4o").
+# Unversioned names get the smallest window of their versions: gpt-35-turbo 0301 and
+# 0613 have 4k, 1106 and 0125 have 16k.
+MODEL_REGISTRY = {
+    "gpt-35-turbo": {"context_window": 4096, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-35-turbo-1106": {"context_window": 16385, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-35-turbo-0125": {"context_window": 16385, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-35-turbo-16k": {"context_window": 16385, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4": {"context_window": 8192, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4-32k": {"context_window": 32768, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4-turbo": {"context_window": 128000, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4o": {"context_window": 128000, "max_output_tokens": 16384, "encoding": "o200k_base"},
+    "gpt-4o-mini": {"context_window": 128000, "max_output_tokens": 16384, "encoding": "o200k_base"},
+    "gpt-4.1": {"context_window": 1047576, "max_output_tokens": 32768, "encoding": "o200k_base"},
+    "gpt-4.1-mini": {"context_window": 1047576, "max_output_tokens": 32768, "encoding": "o200k_base"}
+}
+
+# Used for models missing from the registry (see OPENAI_CONFIG for overrides)
+DEFAULT_MODEL_PROFILE = {
+    "context_window": 8192,
+    "max_output_tokens": 4096,
+    "encoding": os.getenv("OPENAI_TOKENIZER", "cl100k_base")
+}
+
+# Tokenizer files. tiktoken downloads each encoding on first use unless it is in its
+# cache directory; <name>.tiktoken files placed in encoding_dir are copied into the
+# cache instead, so workers start without network access.
+TOKENIZER_CONFIG = {
+    "encoding_dir": os.getenv("TIKTOKEN_ENCODING_DIR", "encodings"),
+    "cache_dir": os.getenv("TIKTOKEN_CACHE_DIR", "cache/tiktoken")
 }
 
 # Azure Translator Configuration
 TRANSLATOR_CONFIG = {
     "subscription_key": os.getenv("AZURE_TRANSLATOR_KEY"),
     "endpoint": os.getenv("AZURE_TRANSLATOR_ENDPOINT"),
-    "location": os.getenv("AZURE_TRANSLATOR_REGION")
+    "location": os.getenv("AZURE_TRANSLATOR_REGION"),
+    # Long texts are split into segments of at most this many characters
+    "max_segment_characters": int(os.getenv("TRANSLATOR_MAX_SEGMENT_CHARACTERS", "5000")),
+    # Connection pool size shared by concurrent segment requests
+    "max_connections": int(os.getenv("TRANSLATOR_MAX_CONNECTIONS", "20"))
+}
+
+# Upload processing configuration
+PROCESSING_CONFIG = {
+    # Maximum number of files from a single upload processed at the same time
+    "max_concurrent_files": int(os.getenv("MAX_CONCURRENT_FILES", "4")),
+    # Overlap PDF parsing with map-phase LLM calls for documents that are not cached
+    "pipeline_summarization": os.getenv("PIPELINE_SUMMARIZATION", "true").lower() == "true",
+    # Documents that fit the model's context window with the summary prompt are summarized
+    # in one direct call. Larger ones go through the cached map pass, in chunks of this
+    # many tokens (at least 5500, capped by the model's budget)
+    "map_chunk_max_tokens": int(os.getenv("MAP_CHUNK_MAX_TOKENS", "5500"))
+}
+
+# PDF extraction configuration. "thread" keeps parsing in a thread pool; "process"
+# uses a process pool and splits large PDFs into page ranges across workers.
+PDF_CONFIG = {
+    "executor": os.getenv("PDF_EXECUTOR", "thread"),
+    "max_workers": int(os.getenv("PDF_MAX_WORKERS", str(os.cpu_count() or 4))),
+    "pages_per_task": int(os.getenv("PDF_PAGES_PER_TASK", "25")),
+    # Uploads are streamed to temp files in blocks of this size (None = system temp dir)
+    "spool_dir": os.getenv("PDF_SPOOL_DIR") or None,
+    "read_block_size": 1024 * 1024,
+    # Extracted text cache keyed by file digest, bounded by entries and UTF-8 bytes
+    "extraction_cache_entries": int(os.getenv("EXTRACTION_CACHE_ENTRIES", "200")),
+    "extraction_cache_bytes": int(os.getenv("EXTRACTION_CACHE_BYTES", str(64 * 1024 * 1024)))
+}
+
+# Background job configuration for POST /jobs
+JOB_CONFIG = {
+    "db_path": os.getenv("JOB_DB_PATH", "jobs/jobs.db"),
+    "storage_dir": os.getenv("JOB_STORAGE_DIR", "jobs/files"),
+    "workers": int(os.getenv("JOB_WORKERS", "2")),
+    # Files of one job processed at the same time
+    "max_concurrent_files": int(os.getenv("JOB_MAX_CONCURRENT_FILES", "4")),
+    # Finished jobs are purged after this many seconds
+    "retention_seconds": float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600))),
+    "read_block_size": 1024 * 1024
+}
+
+# Server launch settings used by run.py. With more than one worker, run.py starts a
+# coordinator process that enforces the Azure OpenAI concurrency and rate limits
+# (OPENAI_MAX_CONCURRENT_CALLS, OPENAI_TOKENS_PER_MINUTE, OPENAI_REQUESTS_PER_MINUTE)
+# across all workers on the host.
+SERVER_CONFIG = {
+    "host": os.getenv("SERVER_HOST", "127.0.0.1"),
+    "port": int(os.getenv("SERVER_PORT", "8002")),
+    "workers": int(os.getenv("SERVER_WORKERS", "1")),
+    "coordinator_host": os.getenv("BUDGET_COORDINATOR_HOST", "127.0.0.1"),
+    # With several workers, metric values are kept in files here so /metrics reports all workers
+    "metrics_dir": os.getenv("PROMETHEUS_MULTIPROC_DIR", "cache/prometheus")
+}
+
+# Startup warm-up: load the tokenizer and create the upstream clients in the
+# background after startup; GET /ready reports 503 until it has finished.
+WARMUP_CONFIG = {
+    "enabled": os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+}
+
+# Opt-in request profiling. When enabled, a sample of timed requests (or any
+# request sent with an "X-Profile: 1" header) is profiled with cProfile and the
+# stats are written to output_dir.
+PROFILING_CONFIG = {
+    "enabled": os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+    "sample_rate": float(os.getenv("PROFILING_SAMPLE_RATE", "0.01")),
+    "output_dir": os.getenv("PROFILING_OUTPUT_DIR", "profiles"),
+    # Oldest profiles are deleted beyond this many files
+    "max_files": int(os.getenv("PROFILING_MAX_FILES", "100"))
+}
+
+# Cache configuration. Each named cache has an in-memory LRU tier and an
+# optional persistent SQLite tier shared through CACHE_DB_PATH.
+CACHE_CONFIG = {
+    "db_path": os.getenv("CACHE_DB_PATH", "cache/policygpt_cache.db"),
+    "summary": {
+        "memory_max_entries": int(os.getenv("SUMMARY_CACHE_MEMORY_ENTRIES", "500")),
+        "disk_max_entries": int(os.getenv("SUMMARY_CACHE_DISK_ENTRIES", "20000")),
+        "ttl_seconds": float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        "persistent": os.getenv("SUMMARY_CACHE_PERSISTENT", "true").lower() == "true"
+    },
+    "translation": {
+        "memory_max_entries": int(os.getenv("TRANSLATION_CACHE_MEMORY_ENTRIES", "2000")),
+        # Upper bound on cached translated text held in memory (UTF-8 bytes)
+        "memory_max_bytes": int(os.getenv("TRANSLATION_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024))),
+        "disk_max_entries": int(os.getenv("TRANSLATION_CACHE_DISK_ENTRIES", "50000")),
+        "ttl_seconds": float(os.getenv("TRANSLATION_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        "persistent": os.getenv("TRANSLATION_CACHE_PERSISTENT", "true").lower() == "true"
+    },
+    # Personalization-independent map-phase outputs (chunk summaries) per document
+    "map": {
+        "memory_max_entries": int(os.getenv("MAP_CACHE_MEMORY_ENTRIES", "500")),
+        "memory_max_bytes": int(os.getenv("MAP_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024))),
+        "disk_max_entries": int(os.getenv("MAP_CACHE_DISK_ENTRIES", "20000")),
+        "ttl_seconds": float(os.getenv("MAP_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        "persistent": os.getenv("MAP_CACHE_PERSISTENT", "true").lower() == "true"
+    },
+    # Map-phase summaries per chunk, keyed on normalized chunk text, shared across documents
+    "chunk": {
+        "memory_max_entries": int(os.getenv("CHUNK_CACHE_MEMORY_ENTRIES", "5000")),
+        "memory_max_bytes": int(os.getenv("CHUNK_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024))),
+        "disk_max_entries": int(os.getenv("CHUNK_CACHE_DISK_ENTRIES", "200000")),
+        "ttl_seconds": float(os.getenv("CHUNK_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        "persistent": os.getenv("CHUNK_CACHE_PERSISTENT", "true").lower() == "true"
+    },
+    # Server-side document store used by /feedback (extracted text, chunks, summaries)
+    "document": {
+        "memory_max_entries": int(os.getenv("DOCUMENT_STORE_MEMORY_ENTRIES", "200")),
+        "memory_max_bytes": int(os.getenv("DOCUMENT_STORE_MEMORY_BYTES", str(128 * 1024 * 1024))),
+        "disk_max_entries": int(os.getenv("DOCUMENT_STORE_DISK_ENTRIES", "5000")),
+        "ttl_seconds": float(os.getenv("DOCUMENT_STORE_TTL_SECONDS", str(7 * 24 * 3600))),
+        "persistent": os.getenv("DOCUMENT_STORE_PERSISTENT", "true").lower() == "true"
+    }
 }
 
 # Standard prompt for document summarization
 STANDARD_PROMPT = "Analyze this document and provide a clear, comprehensive summary that highlights the main points, key findings, and important details. Structure the summary in a well-organized format using markdown."
 
+# Map-phase prompt for each chunk of a large document. It is independent of the
+# reader, so its output is cached per document and shared by every personalized
+# variant; the reading level, interests and age group apply in the reduce step.
+MAP_PROMPT = """You are an insurance expert extracting the key information from one section of a larger policy document.
+
+List every fact a summary of the whole document might need from this section, for any reader:
+- Coverage, benefits and what is insured
+- Exclusions, limitations and conditions
+- Limits, deductibles, premiums, fees, dates and other figures (keep exact values)
+- Claims procedures, obligations, rights and definitions of important terms
+
+Be complete and precise. Do not simplify, do not tailor the wording to any audience and do not add information that is not in the section."""
+
 # Personalized prompts based on reading level
 PERSONALIZED_PROMPTS = {
     "basic": """You are an insurance expert creating a PERSONALIZED summary for someone with BASIC insurance knowledge.
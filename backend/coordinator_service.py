@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+from multiprocessing.managers import BaseManager
+from typing import Dict, Optional
+from config import OPENAI_CONFIG, SERVER_CONFIG
+from rate_limit_service import LocalBudget, scheduler, set_budget
+
+logger = logging.getLogger(__name__)
+
+# How long a worker waits before asking again when every host-wide slot is taken
+SLOT_POLL_SECONDS = 0.05
+
+class SharedBudget:
+    """
+    Azure OpenAI budget of all worker processes on a host, living in the coordinator
+    process: the tokens/requests-per-minute buckets, a 429 pause, and in-flight slots
+    leased per worker pid. Slots held by workers that died are reclaimed.
+    """
+
+    def __init__(self, max_concurrent: int, tokens_per_minute: int, requests_per_minute: int):
+        self.max_concurrent = max_concurrent
+        self.rates = LocalBudget(tokens_per_minute, requests_per_minute)
+        self.leases: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, pid: int, tokens: int) -> float:
+        """Lease a slot and take tokens for worker pid and return 0, or return seconds to wait"""
+        with self._lock:
+            if sum(self.leases.values()) >= self.max_concurrent:
+                self._reap()
+                if sum(self.leases.values()) >= self.max_concurrent:
+                    return SLOT_POLL_SECONDS
+            wait = self.rates.try_reserve(tokens)
+            if wait > 0:
+                return wait
+            self.leases[pid] = self.leases.get(pid, 0) + 1
+            return 0.0
+
+    def release(self, pid: int):
+        with self._lock:
+            if self.leases.get(pid, 0) > 1:
+                self.leases[pid] -= 1
+            else:
+                self.leases.pop(pid, None)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.rates.hold(seconds)
+
+    def _reap(self):
+        for pid in list(self.leases):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                logger.warning(f"Reclaiming {self.leases.pop(pid)} Azure OpenAI slots of exited worker {pid}")
+            except PermissionError:
+                pass
+
+_shared_budget: Optional[SharedBudget] = None
+
+def _get_shared_budget() -> SharedBudget:
+    global _shared_budget
+    if _shared_budget is None:
+        _shared_budget = SharedBudget(
+            OPENAI_CONFIG["max_concurrent_calls"],
+            OPENAI_CONFIG["tokens_per_minute"],
+            OPENAI_CONFIG["requests_per_minute"]
+        )
+    return _shared_budget
+
+class CoordinatorManager(BaseManager):
+    """Serves the SharedBudget to the worker processes over a local socket"""
+
+CoordinatorManager.register("get_budget", callable=_get_shared_budget)
+
+def _ignore_interrupts():
+    # Ctrl+C reaches the whole process group; run.py shuts the coordinator down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def start_coordinator() -> CoordinatorManager:
+    """
+    Start the coordinator process and export its address and key through the
+    environment, so uvicorn worker processes started afterwards connect to it
+    """
+    authkey = os.urandom(16)
+    manager = CoordinatorManager(address=(SERVER_CONFIG["coordinator_host"], 0), authkey=authkey)
+    manager.start(initializer=_ignore_interrupts)
+    host, port = manager.address
+    os.environ["BUDGET_COORDINATOR_ADDRESS"] = f"{host}:{port}"
+    os.environ["BUDGET_COORDINATOR_AUTHKEY"] = authkey.hex()
+    logger.info(f"Budget coordinator listening on {host}:{port}")
+    return manager
+
+class RemoteBudget:
+    """
+    Scheduler budget backed by the coordinator's SharedBudget. Calls are blocking
+    socket round trips, so they run in a thread. If the coordinator goes away the
+    worker falls back to an equal share of the limits and of the concurrency.
+    """
+
+    def __init__(self, proxy, fallback: LocalBudget, fallback_concurrent: int):
+        self.proxy = proxy
+        self.fallback = fallback
+        self.fallback_concurrent = fallback_concurrent
+        self.pid = os.getpid()
+        self.connected = True
+
+    async def _call(self, method: str, *args):
+        try:
+            return await asyncio.to_thread(getattr(self.proxy, method), *args)
+        except (OSError, EOFError) as e:
+            if self.connected:
+                logger.error(f"Lost the budget coordinator ({e}); using this worker's share of the limits")
+                self.connected = False
+                scheduler.max_concurrent = self.fallback_concurrent
+            raise
+
+    async def reserve(self, tokens: int) -> float:
+        if self.connected:
+            try:
+                return await self._call("reserve", self.pid, tokens)
+            except (OSError, EOFError):
+                pass
+        return await self.fallback.reserve(tokens)
+
+    async def release(self):
+        if self.connected:
+            try:
+                await self._call("release", self.pid)
+            except (OSError, EOFError):
+                pass
+
+    async def pause(self, seconds: float):
+        if self.connected:
+            try:
+                await self._call("pause", seconds)
+                return
+            except (OSError, EOFError):
+                pass
+        await self.fallback.pause(seconds)
+
+remote_budget: Optional[RemoteBudget] = None
+
+def connect_budget() -> Optional[RemoteBudget]:
+    """
+    In a worker started by run.py in multi-worker mode, replace the scheduler's
+    per-process budget with the host-wide one. Returns None in single-process mode.
+    """
+    global remote_budget
+    address = os.getenv("BUDGET_COORDINATOR_ADDRESS")
+    if not address:
+        return None
+
+    host, port = address.rsplit(":", 1)
+    manager = CoordinatorManager(address=(host, int(port)), authkey=bytes.fromhex(os.environ["BUDGET_COORDINATOR_AUTHKEY"]))
+    manager.connect()
+
+    workers = max(1, SERVER_CONFIG["workers"])
+    fallback = LocalBudget(OPENAI_CONFIG["tokens_per_minute"] // workers, OPENAI_CONFIG["requests_per_minute"] // workers)
+    fallback_concurrent = max(1, OPENAI_CONFIG["max_concurrent_calls"] // workers)
+    remote_budget = RemoteBudget(manager.get_budget(), fallback, fallback_concurrent)
+    set_budget(remote_budget)
+    logger.info(f"Worker {os.getpid()} uses the host-wide Azure OpenAI budget at {address}")
+    return remote_budget
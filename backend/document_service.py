@@ -0,0 +1,62 @@
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from cache_service import create_cache
+from config import SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Server-side store for extracted text, chunk metadata and summaries, so clients
+# only pass a document id back to /feedback. Bounded and evicted like the caches.
+# Documents change when feedback refines their summary; with several workers a
+# per-process memory tier would serve stale copies, so only SQLite is used.
+document_store = create_cache("document", memory_tier=SERVER_CONFIG["workers"] <= 1)
+
+def save_document(
+    filename: str,
+    text: str,
+    summary: str,
+    chunk_spans: Optional[List[Tuple[int, int]]] = None,
+    chunk_summaries: Optional[List[str]] = None,
+    custom_prompt: Optional[str] = None
+) -> str:
+    """Store an uploaded document and its summary; returns the new document id"""
+    document_id = uuid.uuid4().hex
+    document = {
+        "document_id": document_id,
+        "filename": filename,
+        "text": text,
+        # Character offsets of the chunks used for summarization, when known
+        "chunks": [{"start": start, "end": end} for start, end in chunk_spans] if chunk_spans else None,
+        # Map-phase summaries of those chunks, reused to ground refinement
+        "chunk_summaries": chunk_summaries or None,
+        "custom_prompt": custom_prompt,
+        "summaries": {"original": summary},
+        "created_at": time.time()
+    }
+    document_store.set(document_id, json.dumps(document))
+    return document_id
+
+def get_document(document_id: str) -> Optional[Dict[str, Any]]:
+    """Load a stored document, or None if it is unknown or has been evicted"""
+    stored = document_store.get(document_id)
+    if stored is None:
+        return None
+    return json.loads(stored)
+
+def get_document_chunks(document: Dict[str, Any]) -> Optional[List[str]]:
+    """Texts of the chunks a stored document was summarized in, if they were recorded"""
+    if not document.get("chunks"):
+        return None
+    return [document["text"][chunk["start"]:chunk["end"]] for chunk in document["chunks"]]
+
+def update_document(document_id: str, **fields: Any) -> bool:
+    """Update fields of a stored document; returns False if it no longer exists"""
+    document = get_document(document_id)
+    if document is None:
+        return False
+    document.update(fields)
+    document_store.set(document_id, json.dumps(document))
+    return True
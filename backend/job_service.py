@@ -0,0 +1,274 @@
+import aiofiles
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import JOB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Processes one stored file of a job: (params, file path, filename) -> per-file result
+FileProcessor = Callable[[Dict[str, Any], str, str], Awaitable[Dict[str, Any]]]
+
+class JobStore:
+    """SQLite-backed job state, so queued and running jobs survive a restart"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # owner is the pid of the worker process whose queue holds the job
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, "
+            "files TEXT NOT NULL, results TEXT NOT NULL, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, owner INTEGER)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+
+    def create(self, job_id: str, params: Dict[str, Any], files: List[Dict[str, str]]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, params, files, results, created_at, updated_at, owner) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), json.dumps(files), json.dumps([None] * len(files)), now, now, os.getpid())
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, params, files, results, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "params": json.loads(row[2]),
+            "files": json.loads(row[3]),
+            "results": json.loads(row[4]),
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7]
+        }
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def set_file_result(self, job_id: str, index: int, result: Dict[str, Any]):
+        """Record the result of one file; results are kept so a resumed job skips finished files"""
+        with self._lock:
+            row = self._conn.execute("SELECT results FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            results = json.loads(row[0])
+            results[index] = result
+            self._conn.execute(
+                "UPDATE jobs SET results = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(results), time.time(), job_id)
+            )
+
+    def claim_unfinished(self, pid: int) -> List[str]:
+        """
+        Take over queued or running jobs whose owner process has exited (or that
+        already belong to pid) and return their ids, oldest first. Jobs of live
+        workers are left alone; each orphaned job is claimed by one process only.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+            claimed = []
+            for job_id, owner in rows:
+                if owner is not None and owner != pid and _process_alive(owner):
+                    continue
+                # Compare-and-set, so workers starting together do not both claim a job
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET owner = ? WHERE id = ? AND owner IS ?", (pid, job_id, owner)
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(job_id)
+        return claimed
+
+    def purge(self, older_than: float) -> List[str]:
+        """Delete finished jobs last updated before the given timestamp; returns their ids"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (COMPLETED, FAILED, older_than)
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (COMPLETED, FAILED, older_than)
+            )
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+job_store: Optional[JobStore] = None
+job_queue: Optional[asyncio.Queue] = None
+worker_tasks: List[asyncio.Task] = []
+
+def _job_dir(job_id: str) -> str:
+    return os.path.join(JOB_CONFIG["storage_dir"], job_id)
+
+async def _save_upload(file, path: str):
+    """Copy an upload to disk in blocks without loading it fully into memory"""
+    async with aiofiles.open(path, "wb") as out:
+        while True:
+            block = await file.read(JOB_CONFIG["read_block_size"])
+            if not block:
+                break
+            await out.write(block)
+
+async def submit_job(files: list, params: Dict[str, Any]) -> str:
+    """Persist the uploaded files and job parameters, enqueue the job and return its id"""
+    job_id = uuid.uuid4().hex
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    stored_files = []
+    try:
+        for index, file in enumerate(files):
+            path = os.path.join(job_dir, f"{index}.upload")
+            await _save_upload(file, path)
+            stored_files.append({"filename": file.filename, "path": path})
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    job_store.create(job_id, params, stored_files)
+    await job_queue.put(job_id)
+    logger.info(f"Queued job {job_id} with {len(stored_files)} files")
+    return job_id
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Return the public view of a job: status, progress and per-file results"""
+    job = job_store.get(job_id)
+    if job is None:
+        return None
+
+    completed = sum(1 for result in job["results"] if result is not None)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": {
+            "completed_files": completed,
+            "total_files": len(job["files"])
+        },
+        "results": job["results"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+async def _run_job(job_id: str, processor: FileProcessor):
+    job = job_store.get(job_id)
+    if job is None or job["status"] in (COMPLETED, FAILED):
+        return
+
+    job_store.set_status(job_id, RUNNING)
+    file_semaphore = asyncio.Semaphore(JOB_CONFIG["max_concurrent_files"])
+
+    async def run_file(index: int, stored_file: Dict[str, str]):
+        # Files finished before a restart already have a result
+        if job["results"][index] is not None:
+            return
+        async with file_semaphore:
+            result = await processor(job["params"], stored_file["path"], stored_file["filename"])
+        job_store.set_file_result(job_id, index, result)
+
+    try:
+        await asyncio.gather(*(run_file(index, stored_file) for index, stored_file in enumerate(job["files"])))
+        job_store.set_status(job_id, COMPLETED)
+        logger.info(f"Job {job_id} completed")
+    except asyncio.CancelledError:
+        # Leave the job as running; it is requeued on the next startup
+        raise
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        job_store.set_status(job_id, FAILED, str(e))
+
+    shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+
+async def _worker(worker_id: int, processor: FileProcessor):
+    while True:
+        job_id = await job_queue.get()
+        try:
+            logger.info(f"Worker {worker_id} picked up job {job_id}")
+            await _run_job(job_id, processor)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Worker {worker_id} error on job {job_id}: {e}")
+        finally:
+            job_queue.task_done()
+
+async def start_workers(processor: FileProcessor):
+    """
+    Open the job store, requeue unfinished jobs and start the background workers.
+    In multi-worker mode a process only takes over jobs whose worker has exited, so
+    jobs still queued in a live worker do not run twice.
+    """
+    global job_store, job_queue, worker_tasks
+    job_store = JobStore(JOB_CONFIG["db_path"])
+    job_queue = asyncio.Queue()
+
+    # Drop old finished jobs, then resume anything interrupted by a shutdown or crash
+    for job_id in job_store.purge(time.time() - JOB_CONFIG["retention_seconds"]):
+        shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+    unfinished = job_store.claim_unfinished(os.getpid())
+    for job_id in unfinished:
+        job_queue.put_nowait(job_id)
+    if unfinished:
+        logger.info(f"Requeued {len(unfinished)} unfinished jobs")
+
+    worker_tasks = [
+        asyncio.create_task(_worker(worker_id, processor))
+        for worker_id in range(JOB_CONFIG["workers"])
+    ]
+
+async def stop_workers():
+    """Cancel the background workers and close the job store"""
+    for task in worker_tasks:
+        task.cancel()
+    await asyncio.gather(*worker_tasks, return_exceptions=True)
+    worker_tasks.clear()
+    if job_store is not None:
+        job_store.close()
@@ -1,13 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Form, Depends, Body
-from fastapi.responses import JSONResponse
+import time
+# Taken before the app modules load, for the cold-start timings reported by /ready
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Form, Depends, Body, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from typing import List, Optional
 import asyncio
-from config import SUPPORTED_LANGUAGES
-from pdf_service import extract_text_from_pdf
-from translator_service import translate_text, cleanup
-from openai_service import summarize_text, refine_summary_with_feedback, generate_personalized_summary
+import tempfile
+from config import SUPPORTED_LANGUAGES, PROCESSING_CONFIG
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pdf_service import shutdown_executor, extraction_cache
+from translator_service import translate_text, translate_texts, cleanup, translation_cache
+from openai_service import refine_summary_with_feedback, build_personalized_prompt, close_client, summary_cache, map_cache, chunk_cache, EventCallback
+from pipeline_service import extract_and_summarize
+from document_service import save_document, get_document, get_document_chunks, update_document, document_store
+import job_service
+import coordinator_service
+import metrics_service
+import warmup_service
+from rate_limit_service import llm_lane
+from timing_service import (
+    RequestTimings, current_timings, timing_labels, stage_timer,
+    should_profile, start_profile, finish_profile
+)
 import json
 from datetime import datetime
 
@@ -15,6 +33,19 @@ from datetime import datetime
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Streaming uploads are copied to spooled temp files read in blocks of this size;
+# anything above UPLOAD_SPOOL_MAX_MEMORY spills to disk
+UPLOAD_READ_BLOCK_SIZE = 1024 * 1024
+UPLOAD_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Cache hit ratios and occupancy are read from the caches on each /metrics scrape
+metrics_service.register_cache("summary", summary_cache)
+metrics_service.register_cache("map", map_cache)
+metrics_service.register_cache("chunk", chunk_cache)
+metrics_service.register_cache("translation", translation_cache)
+metrics_service.register_cache("extraction", extraction_cache)
+metrics_service.register_cache("document", document_store)
+
 # Initialize FastAPI app
 app = FastAPI(title="Multiple PDF Processing API")
 app.add_middleware(
@@ -23,60 +54,197 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
 
+# Endpoints that report a per-stage timing breakdown and can be profiled
+TIMED_PATHS = {"/upload", "/feedback", "/translate"}
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """Collect stage timings for the request into a Server-Timing header, optionally profiling it"""
+    if request.url.path not in TIMED_PATHS:
+        return await call_next(request)
+
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    profiler = start_profile() if should_profile(request.headers.get("X-Profile") == "1") else None
+    profile_id = None
+    try:
+        response = await call_next(request)
+    finally:
+        current_timings.reset(token)
+        if profiler is not None:
+            profile_id = finish_profile(profiler, request.url.path)
+
+    response.headers["Server-Timing"] = timings.server_timing()
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def request_timings() -> Optional[dict]:
+    """Timing breakdown of the current request for response metadata"""
+    timings = current_timings.get()
+    return timings.summary() if timings is not None else None
+
+@app.on_event("startup")
+async def startup_event():
+    """
+    Join the host-wide Azure OpenAI budget in multi-worker mode, start the background
+    job workers and start warming up the tokenizer and clients (see GET /ready)
+    """
+    warmup_service.record_import(IMPORT_STARTED)
+    coordinator_service.connect_budget()
+    await job_service.start_workers(process_job_file)
+    warmup_service.start_warm_up()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup resources on shutdown"""
+    await job_service.stop_workers()
     await cleanup()
+    await close_client()
+    shutdown_executor()
+    metrics_service.mark_process_dead()
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness check: 503 while the startup warm-up runs or after it failed (a failed
+    warm-up is retried), 200 with the cold-start timings once the process is ready
+    """
+    if warmup_service.state == warmup_service.FAILED:
+        warmup_service.start_warm_up()
+    status = warmup_service.readiness()
+    return JSONResponse(status_code=200 if status["status"] == warmup_service.READY else 503, content=status)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss/eviction counters for the summary, map, chunk, translation and extraction caches and the document store"""
+    return {
+        "summary_cache": summary_cache.stats(),
+        "map_cache": map_cache.stats(),
+        "chunk_cache": chunk_cache.stats(),
+        "translation_cache": translation_cache.stats(),
+        "extraction_cache": extraction_cache.stats(),
+        "document_store": document_store.stats()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, Azure OpenAI requests and tokens, semaphore depth, caches"""
+    return Response(generate_latest(metrics_service.metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/languages")
 async def get_supported_languages():
     """Get list of supported languages for translation"""
     return {"supported_languages": SUPPORTED_LANGUAGES}
 
+def parse_target_languages(target_language: Optional[str], target_languages: Optional[str]) -> List[str]:
+    """Combine the single and comma-separated language parameters into a list of supported codes"""
+    requested = []
+    if target_language:
+        requested.append(target_language)
+    if target_languages:
+        requested.extend(language.strip() for language in target_languages.split(','))
+
+    languages = []
+    for language in requested:
+        if language in SUPPORTED_LANGUAGES and language not in languages:
+            languages.append(language)
+    return languages
+
+def is_extraction_error(error: Exception) -> bool:
+    """Whether an upload failed before summarization, so no other prompt can succeed"""
+    return isinstance(error, HTTPException) and str(error.detail).startswith("Failed to extract text")
+
 async def process_single_file(
     file: UploadFile,
-    target_language: Optional[str],
-    custom_prompt: Optional[str]
+    target_languages: List[str],
+    custom_prompt: Optional[str],
+    reading_level: Optional[str] = None,
+    interests: Optional[List[str]] = None,
+    age_group: Optional[str] = None,
+    on_event: Optional[EventCallback] = None,
+    lane: str = "interactive"
 ):
-    """Process a single PDF file"""
-    try:
-        # Extract text from PDF
-        pdf_text = await extract_text_from_pdf(file)
+    """
+    Process a single PDF file: extract, summarize and optionally translate.
+    When on_event is given, progress events are emitted as each stage completes.
+    lane is the scheduler priority of the file's Azure OpenAI calls.
+    """
+    # Stages timed while processing this file are labelled with its name
+    with timing_labels(file=file.filename), stage_timer("file"), llm_lane(lane):
+        try:
+            if not file.filename.lower().endswith('.pdf'):
+                return {
+                    "filename": file.filename,
+                    "error": "Only PDF files are supported"
+                }
 
-        # Generate summary using standard prompt
-        summary = await summarize_text(pdf_text, custom_prompt)
+            # Check if personalization is requested
+            personalization_requested = any([reading_level, interests])
 
-        result = {
-            "filename": file.filename,
-            "summaries": {
-                "original": summary
-            }
-        }
+            # Personalization is expressed as the summary prompt; otherwise use the custom prompt
+            prompt = build_personalized_prompt(reading_level, interests, age_group) if personalization_requested else custom_prompt
 
-        # Translate if target language is specified
-        if target_language and target_language in SUPPORTED_LANGUAGES:
-            translated_summary = await translate_text(summary, target_language)
-            result["summaries"][target_language] = translated_summary
+            # Extract the text and summarize it
+            try:
+                file_content, summary, chunk_spans, chunk_summaries = await extract_and_summarize(file, prompt, on_event=on_event)
+            except Exception as e:
+                if not personalization_requested or is_extraction_error(e):
+                    raise
+                # Fall back to a standard summary rather than failing the upload
+                logger.error(f"Error generating personalized summary for {file.filename}: {e}")
+                personalization_requested = False
+                prompt = None
+                await file.seek(0)
+                file_content, summary, chunk_spans, chunk_summaries = await extract_and_summarize(file, prompt, on_event=on_event)
+
+            # Keep the text and chunk summaries server-side for refinement; clients only get the document id back
+            document_id = save_document(file.filename, file_content, summary, chunk_spans, chunk_summaries, prompt)
+            if on_event:
+                await on_event({"event": "summary_done", "document_id": document_id})
+
+            # Log the complete summary and its length for debugging
+            logger.info(f"Generated summary for {file.filename} - Length: {len(summary)} characters")
+            logger.debug(f"Complete summary: {summary}")
+
+            result = {
+                "filename": file.filename,
+                "summaries": {
+                    "original": summary
+                },
+                "documentId": document_id,  # Pass back to /feedback for refinement
+                "personalized": personalization_requested  # Flag to indicate if this is a personalized summary
+            }
 
-        return result
-    except Exception as e:
-        logger.error(f"Error processing file {file.filename}: {str(e)}")
-        return {
-            "filename": file.filename,
-            "error": str(e)
-        }
+            # Translate into every requested language in a single batched round trip
+            if target_languages:
+                translations = await translate_texts([summary], target_languages)
+                for language in target_languages:
+                    result["summaries"][language] = translations[language][0]
+                if on_event:
+                    await on_event({"event": "translation_done", "languages": target_languages})
+
+            return result
+        except Exception as e:
+            logger.error(f"Error processing {file.filename}: {str(e)}")
+            return {
+                "filename": file.filename,
+                "error": str(e)
+            }
 
 @app.post("/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
     target_language: Optional[str] = Form(None),
+    target_languages: Optional[str] = Form(None),
     custom_prompt: Optional[str] = Form(None),
     # Optional personalization parameters
     reading_level: Optional[str] = Form(None),
@@ -85,71 +253,36 @@ async def upload_files(
 ):
     """Process multiple PDF files with optional on-the-fly personalization"""
     try:
-        results = []
-
         # Parse list parameters if provided
         interests_list = interests.split(',') if interests else None
-
-        # Check if personalization is requested
-        personalization_requested = any([reading_level, interests])
-
-        for file in files:
-            try:
-                if not file.filename.lower().endswith('.pdf'):
-                    results.append({
-                        "filename": file.filename,
-                        "error": "Only PDF files are supported"
-                    })
-                    continue
-
-                # Get the text content and store it for potential refinement
-                file_content = await extract_text_from_pdf(file)
-
-                # Generate summary based on personalization parameters or standard prompt
-                if personalization_requested:
-                    # Generate personalized summary with on-the-fly parameters
-                    summary = await generate_personalized_summary(
-                        file_content,
-                        reading_level=reading_level,
-                        interests=interests_list,
-                        age_group=age_group
-                    )
-                else:
-                    # Generate standard summary
-                    summary = await summarize_text(file_content, custom_prompt)
-
-                # Log the complete summary and its length for debugging
-                logger.info(f"Generated summary for {file.filename} - Length: {len(summary)} characters")
-                logger.info(f"Complete summary: {summary}")
-
-                result = {
-                    "filename": file.filename,
-                    "summaries": {
-                        "original": summary
-                    },
-                    "originalText": file_content,  # Store original text for refinement
-                    "personalized": personalization_requested  # Flag to indicate if this is a personalized summary
-                }
-
-                # Translate if target language is specified
-                if target_language and target_language in SUPPORTED_LANGUAGES:
-                    translated_summary = await translate_text(summary, target_language)
-                    result["summaries"][target_language] = translated_summary
-
-                results.append(result)
-
-            except Exception as e:
-                logger.error(f"Error processing {file.filename}: {str(e)}")
-                results.append({
-                    "filename": file.filename,
-                    "error": str(e)
-                })
+        languages = parse_target_languages(target_language, target_languages)
+
+        # Bound how many files of this upload run through the pipeline at once.
+        # Upstream API calls are additionally throttled inside openai_service.
+        file_semaphore = asyncio.Semaphore(PROCESSING_CONFIG["max_concurrent_files"])
+        lane = upload_lane(files)
+
+        async def process_with_limit(file: UploadFile):
+            async with file_semaphore:
+                return await process_single_file(
+                    file,
+                    languages,
+                    custom_prompt,
+                    reading_level=reading_level,
+                    interests=interests_list,
+                    age_group=age_group,
+                    lane=lane
+                )
+
+        # gather keeps results in upload order; errors are isolated per file
+        results = await asyncio.gather(*(process_with_limit(file) for file in files))
 
         return {
             "results": results,
             "metadata": {
                 "processing_timestamp": datetime.now().isoformat(),
-                "total_files_processed": len(files)
+                "total_files_processed": len(files),
+                "timings": request_timings()
             }
         }
 
@@ -160,14 +293,156 @@ async def upload_files(
             detail=str(e)
         )
 
+def upload_lane(files: List[UploadFile]) -> str:
+    """Single-file uploads are interactive; batch uploads queue behind them as bulk work"""
+    return "interactive" if len(files) == 1 else "bulk"
+
+async def _detach_upload(file: UploadFile) -> UploadFile:
+    """
+    Copy an upload into a spooled temp file owned by the caller, so it stays
+    readable after the endpoint returns a streaming response.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+    while True:
+        block = await file.read(UPLOAD_READ_BLOCK_SIZE)
+        if not block:
+            break
+        spool.write(block)
+    spool.seek(0)
+    return UploadFile(file=spool, filename=file.filename)
+
+@app.post("/upload/stream")
+async def upload_files_stream(
+    files: List[UploadFile] = File(...),
+    target_language: Optional[str] = Form(None),
+    target_languages: Optional[str] = Form(None),
+    custom_prompt: Optional[str] = Form(None),
+    # Optional personalization parameters
+    reading_level: Optional[str] = Form(None),
+    interests: Optional[str] = Form(None),
+    age_group: Optional[str] = Form(None)
+):
+    """
+    Streaming variant of /upload. Emits newline-delimited JSON events as work completes:
+    extraction_done, chunking_done, chunk_done, reduce_level, summary_token, summary_done,
+    translation_done and file_done per file (each tagged with file_index and filename),
+    followed by a final complete event.
+    """
+    interests_list = interests.split(',') if interests else None
+    languages = parse_target_languages(target_language, target_languages)
+    detached_files = [await _detach_upload(file) for file in files]
+
+    async def event_stream():
+        queue: asyncio.Queue = asyncio.Queue()
+        file_semaphore = asyncio.Semaphore(PROCESSING_CONFIG["max_concurrent_files"])
+        lane = upload_lane(files)
+
+        async def process_with_events(file_index: int, file: UploadFile):
+            async def emit(event: dict):
+                await queue.put({"file_index": file_index, "filename": file.filename, **event})
+
+            async with file_semaphore:
+                result = await process_single_file(
+                    file,
+                    languages,
+                    custom_prompt,
+                    reading_level=reading_level,
+                    interests=interests_list,
+                    age_group=age_group,
+                    on_event=emit,
+                    lane=lane
+                )
+            await emit({"event": "file_done", "result": result})
+
+        tasks = [
+            asyncio.create_task(process_with_events(file_index, file))
+            for file_index, file in enumerate(detached_files)
+        ]
+        all_done = asyncio.gather(*tasks, return_exceptions=True)
+        all_done.add_done_callback(lambda _: queue.put_nowait(None))
+
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+
+            yield json.dumps({
+                "event": "complete",
+                "metadata": {
+                    "processing_timestamp": datetime.now().isoformat(),
+                    "total_files_processed": len(files)
+                }
+            }) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects mid-stream, and let it
+            # unwind before the spooled files it reads from are closed
+            for task in tasks:
+                task.cancel()
+            await all_done
+            for file in detached_files:
+                await file.close()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+async def process_job_file(params: dict, path: str, filename: str) -> dict:
+    """Run the upload pipeline for one file stored by a background job"""
+    with open(path, "rb") as stored:
+        return await process_single_file(
+            StarletteUploadFile(file=stored, filename=filename),
+            params["target_languages"],
+            params["custom_prompt"],
+            reading_level=params["reading_level"],
+            interests=params["interests"],
+            age_group=params["age_group"],
+            lane="bulk"
+        )
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    files: List[UploadFile] = File(...),
+    target_language: Optional[str] = Form(None),
+    target_languages: Optional[str] = Form(None),
+    custom_prompt: Optional[str] = Form(None),
+    # Optional personalization parameters
+    reading_level: Optional[str] = Form(None),
+    interests: Optional[str] = Form(None),
+    age_group: Optional[str] = Form(None)
+):
+    """Queue PDF files for background processing and return a job id immediately"""
+    try:
+        job_id = await job_service.submit_job(files, {
+            "target_languages": parse_target_languages(target_language, target_languages),
+            "custom_prompt": custom_prompt,
+            "reading_level": reading_level,
+            "interests": interests.split(',') if interests else None,
+            "age_group": age_group
+        })
+        return {"job_id": job_id, "status": job_service.QUEUED}
+    except Exception as e:
+        logger.error(f"Error creating job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status, progress and results of a background job"""
+    job = job_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
 @app.post("/feedback")
 async def submit_feedback(
     summary_id: str = Form(...),
     feedback_type: str = Form(...),
     feedback_text: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None),
+    # Deprecated: send document_id instead of round-tripping the full text
     original_text: Optional[str] = Form(None),
     original_summary: Optional[str] = Form(None),
-    target_language: Optional[str] = Form(None)
+    target_language: Optional[str] = Form(None),
+    target_languages: Optional[str] = Form(None)
 ):
     """Submit feedback for a summary and get refined version if needed"""
     try:
@@ -180,6 +455,21 @@ async def submit_feedback(
 
         logger.info(f"Received feedback: {json.dumps(feedback, indent=2)}")
 
+        # Load the text, chunks and latest summary from the document store
+        chunks = None
+        chunk_summaries = None
+        if document_id:
+            document = get_document(document_id)
+            if document is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Document {document_id} not found or expired; please upload it again"
+                )
+            original_text = document["text"]
+            original_summary = original_summary or document["summaries"]["original"]
+            chunks = get_document_chunks(document)
+            chunk_summaries = document.get("chunk_summaries")
+
         # Only refine if we have the original text and feedback type is unclear or inaccurate
         if original_text and feedback_type in ["unclear", "inaccurate"]:
             # Log the feedback text if provided
@@ -190,12 +480,18 @@ async def submit_feedback(
                 original_text,
                 original_summary,
                 feedback_type,
-                feedback_text
+                feedback_text,
+                chunks=chunks,
+                chunk_summaries=chunk_summaries
             )
 
             # Log the complete refined summary and its length for debugging
             logger.info(f"Generated refined summary - Length: {len(refined_summary)} characters")
-            logger.info(f"Complete refined summary: {refined_summary}")
+            logger.debug(f"Complete refined summary: {refined_summary}")
+
+            # Later feedback on this document refines the latest summary
+            if document_id:
+                update_document(document_id, summaries={"original": refined_summary})
 
             # Prepare response with the refined summary
             response = {
@@ -203,27 +499,34 @@ async def submit_feedback(
                 "message": "Summary has been refined based on your feedback",
                 "summaries": {
                     "original": refined_summary  # Override original with refined
-                }
+                },
+                "metadata": {}
             }
 
-            # If target language is specified, translate the refined summary
-            if target_language and target_language in SUPPORTED_LANGUAGES:
-                logger.info(f"Translating refined summary to {target_language}")
+            # If target languages are specified, translate the refined summary
+            languages = parse_target_languages(target_language, target_languages)
+            if languages:
+                logger.info(f"Translating refined summary to {', '.join(languages)}")
                 try:
-                    translated_summary = await translate_text(refined_summary, target_language)
-                    response["summaries"][target_language] = translated_summary
+                    translations = await translate_texts([refined_summary], languages)
+                    for language in languages:
+                        response["summaries"][language] = translations[language][0]
                     logger.info(f"Translation successful for refined summary")
                 except Exception as e:
                     logger.error(f"Error translating refined summary: {str(e)}")
                     # Continue even if translation fails, just without the translation
 
+            response["metadata"]["timings"] = request_timings()
             return response
 
         return {
             "status": "success",
-            "message": "Feedback submitted successfully"
+            "message": "Feedback submitted successfully",
+            "metadata": {"timings": request_timings()}
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing feedback: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -242,7 +545,7 @@ async def translate_text_endpoint(
             )
 
         translated_text = await translate_text(text, target_language)
-        return {"translated_text": translated_text}
+        return {"translated_text": translated_text, "metadata": {"timings": request_timings()}}
 
     except Exception as e:
         logger.error(f"Translation error: {str(e)}")
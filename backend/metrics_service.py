@@ -0,0 +1,139 @@
+import logging
+import os
+from typing import Dict, Iterator, Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+logger = logging.getLogger(__name__)
+
+# Latency per pipeline stage: extraction, chunking, llm_map, llm_reduce,
+# llm_summary, llm_refine, translation and translator_request
+STAGE_LATENCY = Histogram(
+    "policygpt_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+)
+
+# Azure OpenAI calls by kind (map, reduce, summary, refine) and outcome
+# (success, error, or rate_limited/failed attempts that were retried)
+LLM_REQUESTS = Counter(
+    "policygpt_llm_requests_total",
+    "Azure OpenAI chat completion requests",
+    ["kind", "outcome"]
+)
+LLM_TOKENS = Counter(
+    "policygpt_llm_tokens_total",
+    "Azure OpenAI tokens from the usage field (estimated locally for streamed calls)",
+    ["kind", "type"]
+)
+
+# Calls queued in the scheduler and holding a concurrency slot, and the time spent
+# queued for a slot and budget (metric names predate the scheduler)
+LLM_SEMAPHORE_WAITING = Gauge(
+    "policygpt_llm_semaphore_waiting",
+    "Azure OpenAI calls waiting in the scheduler for a slot or rate budget",
+    multiprocess_mode="livesum"
+)
+LLM_IN_FLIGHT = Gauge(
+    "policygpt_llm_in_flight",
+    "Azure OpenAI calls currently in flight",
+    multiprocess_mode="livesum"
+)
+LLM_SEMAPHORE_WAIT = Histogram(
+    "policygpt_llm_semaphore_wait_seconds",
+    "Time Azure OpenAI calls spent waiting in the scheduler",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+TRANSLATOR_REQUESTS = Counter(
+    "policygpt_translator_requests_total",
+    "Azure Translator requests",
+    ["outcome"]
+)
+TRANSLATOR_CHARACTERS = Counter(
+    "policygpt_translator_characters_total",
+    "Characters sent to Azure Translator, counted once per target language"
+)
+
+# Callers that joined an identical call already in flight instead of making their own
+COALESCED_CALLS = Counter(
+    "policygpt_coalesced_calls_total",
+    "Calls served by an identical call already in flight",
+    ["call"]
+)
+
+# Cold start of this process: "import" (loading the app modules), the warm-up phases
+# (tokenizer, openai_client, translator_session) and "ready" (import start to ready)
+STARTUP_SECONDS = Gauge(
+    "policygpt_startup_seconds",
+    "Time taken by each startup phase of this process",
+    ["phase"],
+    multiprocess_mode="liveall"
+)
+
+class CacheCollector(Collector):
+    """Reads hit, miss, occupancy and eviction counters from the caches at scrape time"""
+
+    def __init__(self):
+        self.caches: Dict[str, object] = {}
+
+    def collect(self) -> Iterator:
+        hits = CounterMetricFamily("policygpt_cache_hits", "Cache hits", labels=["cache", "tier"])
+        misses = CounterMetricFamily("policygpt_cache_misses", "Cache misses", labels=["cache"])
+        hit_ratio = GaugeMetricFamily("policygpt_cache_hit_ratio", "Cache hit ratio since startup", labels=["cache"])
+        entries = GaugeMetricFamily("policygpt_cache_entries", "Cached entries", labels=["cache", "tier"])
+        size = GaugeMetricFamily("policygpt_cache_memory_size", "Bytes (UTF-8) held by the in-memory tier", labels=["cache"])
+        evictions = CounterMetricFamily("policygpt_cache_evictions", "Cache evictions", labels=["cache", "tier"])
+
+        for name, cache in self.caches.items():
+            try:
+                stats = cache.stats()
+            except Exception as e:
+                logger.warning(f"Could not read stats of {name} cache: {e}")
+                continue
+            hits.add_metric([name, "memory"], stats["memory_hits"])
+            hits.add_metric([name, "disk"], stats["disk_hits"])
+            misses.add_metric([name], stats["misses"])
+            hit_ratio.add_metric([name], stats["hit_ratio"])
+            entries.add_metric([name, "memory"], stats["memory_entries"])
+            size.add_metric([name], stats["memory_size"])
+            evictions.add_metric([name, "memory"], stats["memory_evictions"])
+            if stats.get("disk_entries") is not None:
+                entries.add_metric([name, "disk"], stats["disk_entries"])
+            if "disk_evictions" in stats:
+                evictions.add_metric([name, "disk"], stats["disk_evictions"])
+
+        yield from (hits, misses, hit_ratio, entries, size, evictions)
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+def register_cache(name: str, cache):
+    """Expose a TieredCache's stats() under the given cache label"""
+    cache_collector.caches[name] = cache
+
+# Set by run.py when it starts several workers: metric values are then written to
+# files in this directory and /metrics aggregates the files of every worker
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+_multiprocess_registry: Optional[CollectorRegistry] = None
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    Registry to expose on /metrics: the process registry, or with several workers one
+    that sums their metrics. Cache metrics are those of the worker serving the scrape.
+    """
+    global _multiprocess_registry
+    if not MULTIPROCESS_DIR:
+        return REGISTRY
+    if _multiprocess_registry is None:
+        _multiprocess_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(_multiprocess_registry, path=MULTIPROCESS_DIR)
+        _multiprocess_registry.register(cache_collector)
+    return _multiprocess_registry
+
+def mark_process_dead():
+    """Drop this worker's live gauges from the aggregated metrics when it exits"""
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(os.getpid(), MULTIPROCESS_DIR)
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import shutil
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import tiktoken
+from config import OPENAI_CONFIG, MODEL_REGISTRY, DEFAULT_MODEL_PROFILE, TOKENIZER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds per message and to prime the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Headroom for tokenizer differences between the local count and the service
+SAFETY_MARGIN_TOKENS = 64
+
+# Where tiktoken downloads the BPE file of an encoding from; its cache entry is named
+# after the SHA-1 of this URL
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken"
+
+def _seed_encoding_cache(name: str):
+    """Point tiktoken at TOKENIZER_CONFIG["cache_dir"] and copy a vendored encoding file into it"""
+    cache_dir = os.path.abspath(TOKENIZER_CONFIG["cache_dir"])
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", cache_dir)
+    cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+
+    vendored = os.path.join(TOKENIZER_CONFIG["encoding_dir"], f"{name}.tiktoken")
+    cached = os.path.join(cache_dir, hashlib.sha1(ENCODING_URL.format(name=name).encode()).hexdigest())
+    if os.path.exists(vendored) and not os.path.exists(cached):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Copy under a temporary name so a concurrent worker never reads a partial file
+        partial = f"{cached}.{os.getpid()}.tmp"
+        shutil.copyfile(vendored, partial)
+        os.replace(partial, cached)
+        logger.info(f"Using vendored tokenizer file {vendored}")
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str) -> tiktoken.Encoding:
+    """
+    Load a tiktoken encoding once per process, on first use. Vendored or cached
+    encoding files are used when present; otherwise tiktoken downloads the file.
+    """
+    _seed_encoding_cache(name)
+    return tiktoken.get_encoding(name)
+
+def get_model_profile(model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Context window, output limit and encoding for a model (the configured one by
+    default), looked up in MODEL_REGISTRY by exact name, then by longest matching
+    prefix, else DEFAULT_MODEL_PROFILE. The configured context window and output
+    limit, when set, take precedence.
+    """
+    profile = _lookup_model_profile(model or OPENAI_CONFIG["model"] or "")
+    overrides = {
+        key: OPENAI_CONFIG[key] for key in ("context_window", "max_output_tokens") if OPENAI_CONFIG.get(key)
+    }
+    return {**profile, **overrides} if overrides else profile
+
+@lru_cache(maxsize=None)
+def _lookup_model_profile(model: str) -> Dict[str, Any]:
+    if model in MODEL_REGISTRY:
+        return MODEL_REGISTRY[model]
+
+    prefixes = [name for name in MODEL_REGISTRY if model.startswith(name)]
+    if prefixes:
+        return MODEL_REGISTRY[max(prefixes, key=len)]
+
+    logger.warning(f"Model {model or '(unset)'} is not in MODEL_REGISTRY; using the default profile")
+    return DEFAULT_MODEL_PROFILE
+
+def get_tokenizer(model: Optional[str] = None) -> tiktoken.Encoding:
+    """Tokenizer of the configured (or given) model"""
+    return get_encoding(get_model_profile(model)["encoding"])
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text for the configured model"""
+    return len(get_tokenizer().encode_ordinary(text))
+
+def count_prompt_tokens(system_prompt: str, user_content: str) -> int:
+    """Tokens a system + user message pair takes in the context window"""
+    return (
+        count_tokens(system_prompt) + count_tokens(user_content)
+        + 2 * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+    )
+
+def output_token_limit(max_tokens: int) -> int:
+    """Requested completion size clamped to what the model can generate"""
+    return min(max_tokens, get_model_profile()["max_output_tokens"])
+
+def input_token_budget(system_prompt: str, user_template: str, max_tokens: int) -> int:
+    """
+    Tokens left for document text in a request with this system prompt, user message
+    template (without the text) and completion size, measured with the model's tokenizer
+    and capped by OPENAI_CONFIG["max_chunk_tokens"] when set
+    """
+    budget = (
+        get_model_profile()["context_window"]
+        - output_token_limit(max_tokens)
+        - count_prompt_tokens(system_prompt, user_template)
+        - SAFETY_MARGIN_TOKENS
+    )
+    if OPENAI_CONFIG["max_chunk_tokens"]:
+        budget = min(budget, OPENAI_CONFIG["max_chunk_tokens"])
+    if budget <= 0:
+        raise ValueError("Prompt does not leave room for document text in the model's context window")
+    return budget
@@ -1,162 +1,579 @@
 from fastapi import HTTPException
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+import httpx
 import logging
-import os
-from config import OPENAI_CONFIG, STANDARD_PROMPT, PERSONALIZED_PROMPTS, INTEREST_FOCUSED_PROMPTS
+from config import OPENAI_CONFIG, PROCESSING_CONFIG, STANDARD_PROMPT, MAP_PROMPT, PERSONALIZED_PROMPTS, INTEREST_FOCUSED_PROMPTS
 import asyncio
-from functools import lru_cache
-import hashlib
-from typing import Optional, Dict, Any, List
-import tiktoken
+import itertools
+import json
+import math
+import re
+import time
+from collections import Counter
+from typing import Optional, Dict, Any, List, Callable, Awaitable, AsyncIterator, Tuple
 from pdf_service import chunk_text_by_tokens
-
-# Initialize tokenizer for GPT models (same as in pdf_service.py)
-tokenizer = tiktoken.get_encoding("cl100k_base")
+from cache_service import create_cache, make_cache_key, SingleFlight
+from model_service import count_tokens, count_prompt_tokens, output_token_limit, input_token_budget
+from timing_service import stage_timer, timing_labels
+from metrics_service import LLM_REQUESTS, LLM_TOKENS
+from rate_limit_service import scheduler, retry_delay
 
 logger = logging.getLogger(__name__)
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=OPENAI_CONFIG["api_key"],
-    api_version=OPENAI_CONFIG["api_version"],
-    azure_endpoint=OPENAI_CONFIG["azure_endpoint"]
-)
+# Shared async Azure OpenAI client, created on first use (or by the startup warm-up)
+# so importing this module does no client setup. Requests are multiplexed over a
+# pooled keep-alive HTTP client instead of holding an executor thread each.
+client: Optional[AsyncAzureOpenAI] = None
+
+def get_client() -> AsyncAzureOpenAI:
+    """Get or create the shared Azure OpenAI client"""
+    global client
+    if client is None:
+        client = AsyncAzureOpenAI(
+            api_key=OPENAI_CONFIG["api_key"],
+            api_version=OPENAI_CONFIG["api_version"],
+            azure_endpoint=OPENAI_CONFIG["azure_endpoint"],
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_CONFIG["max_connections"],
+                    max_keepalive_connections=OPENAI_CONFIG["max_keepalive_connections"],
+                    keepalive_expiry=OPENAI_CONFIG["keepalive_expiry"]
+                ),
+                timeout=httpx.Timeout(OPENAI_CONFIG["timeout"], connect=10.0)
+            ),
+            # Retries are done by _create_completion (see _is_retryable) so rate limits
+            # go through the scheduler
+            max_retries=0
+        )
+    return client
+
+# Cache for summaries (in-memory LRU in front of a persistent SQLite tier)
+summary_cache = create_cache("summary")
+
+# Identical summaries requested concurrently are generated once
+summary_flight = SingleFlight("summary")
+
+# Map-phase outputs (chunk offsets and summaries) per document, shared by all prompts
+map_cache = create_cache("map")
+
+# Map summaries of individual chunks, shared by every document containing the same
+# section (e.g. a carrier's standard definitions and exclusions)
+chunk_cache = create_cache("chunk")
+chunk_flight = SingleFlight("chunk")
+
+# The map pass uses fixed settings so its output does not depend on the reader
+MAP_MAX_TOKENS = 1000
+MAP_TEMPERATURE = 0.3
+
+def _cache_key(text: str, custom_prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    """Create a cache key for summary covering every input that changes the output"""
+    return make_cache_key("summary", model, temperature, max_tokens, custom_prompt or "", text)
+
+# Message templates whose size is measured when computing chunk budgets
+MAP_USER_TEMPLATE = "Here's the document section to analyze:\n\n"
+DIRECT_USER_TEMPLATE = "Here's the document to analyze:\n\n"
+MERGE_USER_TEMPLATE = "Here are the section summaries to merge:\n\n"
+FINAL_USER_TEMPLATE = "Here are the section summaries to integrate:\n\n"
+
+# Allowance for the "Section N Summary:" header and separator around each summary
+SECTION_HEADER_TOKENS = 10
+
+# Async callback receiving progress events, used by the streaming endpoints
+EventCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Status codes retried besides 429 and 5xx, as the SDK's own retry policy does:
+# request timeouts and lock conflicts
+RETRYABLE_STATUS_CODES = {408, 409}
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed call is worth retrying: rate limits, connection errors and timeouts, 408, 409 and 5xx"""
+    if isinstance(error, (RateLimitError, APIConnectionError, InternalServerError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+async def _create_completion(
+    system_prompt: str,
+    user_content: str,
+    max_tokens: int,
+    temperature: float,
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+    kind: str = "summary"
+) -> str:
+    """
+    Run a single chat completion through the scheduler and return its text.
+    When on_token is given the completion is streamed and each delta is passed to it.
+    kind labels the call in the metrics (summary, map, reduce or refine).
+
+    The call is metered as its prompt tokens plus max_tokens, which is how Azure
+    counts a request against the deployment's tokens-per-minute quota. 429 responses
+    pause the scheduler for the Retry-After time and the call is retried; the other
+    errors the SDK would retry (see _is_retryable) are retried after a backoff, up to
+    OPENAI_CONFIG["max_retries"] times.
+    """
+    completion_tokens = output_token_limit(max_tokens)
+    estimated_tokens = count_prompt_tokens(system_prompt, user_content) + completion_tokens
+
+    for attempt in itertools.count():
+        parts: List[str] = []
+        backoff = 0.0
+        await scheduler.acquire(estimated_tokens)
+        try:
+            with stage_timer(f"llm_{kind}"):
+                response = await get_client().chat.completions.create(
+                    model=OPENAI_CONFIG["deployment"],
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_content}
+                    ],
+                    max_tokens=completion_tokens,
+                    temperature=temperature,
+                    stream=on_token is not None
+                )
+                if on_token is None:
+                    content = response.choices[0].message.content
+                    usage = response.usage
+                    if usage is not None:
+                        LLM_TOKENS.labels(kind, "prompt").inc(usage.prompt_tokens)
+                        LLM_TOKENS.labels(kind, "completion").inc(usage.completion_tokens)
+                    LLM_REQUESTS.labels(kind, "success").inc()
+                    return content
+
+                async for chunk in response:
+                    # Azure sends chunks without choices (e.g. content filter results)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        await on_token(delta)
+                content = "".join(parts)
+
+            # Streamed responses carry no usage with this API version; count locally
+            LLM_TOKENS.labels(kind, "prompt").inc(count_prompt_tokens(system_prompt, user_content))
+            LLM_TOKENS.labels(kind, "completion").inc(count_tokens(content))
+            LLM_REQUESTS.labels(kind, "success").inc()
+            return content
+        except Exception as e:
+            # A stream that already delivered tokens cannot be replayed
+            if not _is_retryable(e) or attempt >= OPENAI_CONFIG["max_retries"] or parts:
+                LLM_REQUESTS.labels(kind, "error").inc()
+                raise
+            delay = retry_delay(e, attempt)
+            if isinstance(e, RateLimitError):
+                # Every lane waits out the quota window, not just this call
+                LLM_REQUESTS.labels(kind, "rate_limited").inc()
+                logger.warning(f"Azure OpenAI rate limited a {kind} call; pausing {delay:.1f}s before retry {attempt + 1}")
+                await scheduler.throttle(delay)
+            else:
+                LLM_REQUESTS.labels(kind, "retried").inc()
+                logger.warning(f"Azure OpenAI {kind} call failed ({e}); retry {attempt + 1} in {delay:.1f}s")
+                backoff = delay
+        finally:
+            await scheduler.release()
+
+        if backoff:
+            await asyncio.sleep(backoff)
+
+async def close_client():
+    """Close the shared Azure OpenAI client and its connection pool"""
+    global client
+    if client is None:
+        return
+    try:
+        await client.close()
+        client = None
+        logger.info("Azure OpenAI client closed successfully")
+    except Exception as e:
+        logger.error(f"Error closing Azure OpenAI client: {e}")
+
+def _group_summaries_by_tokens(summaries: List[str], max_tokens: int) -> List[List[str]]:
+    """
+    Split summaries into consecutive groups whose combined size fits max_tokens.
+    Every group holds at least two summaries (when available) so each reduce level shrinks the list.
+    """
+    groups = []
+    current_group = []
+    current_tokens = 0
+
+    for summary in summaries:
+        summary_tokens = count_tokens(summary) + SECTION_HEADER_TOKENS
+        if current_group and len(current_group) >= 2 and current_tokens + summary_tokens > max_tokens:
+            groups.append(current_group)
+            current_group = []
+            current_tokens = 0
+        current_group.append(summary)
+        current_tokens += summary_tokens
+
+    if current_group:
+        # Avoid leaving a lone summary behind; fold it into the previous group
+        if len(current_group) == 1 and groups:
+            groups[-1].extend(current_group)
+        else:
+            groups.append(current_group)
+
+    return groups
 
-# Semaphore to limit concurrent API calls
-MAX_CONCURRENT_CALLS = 5
-api_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+def _merge_prompt(system_prompt: str) -> str:
+    """System prompt for merging summaries of consecutive sections"""
+    return f"{system_prompt}\n\nBelow are summaries of consecutive sections of a larger document. Merge them into a single section summary that keeps every key fact, figure, condition and exclusion."
 
-# Cache for summaries
-summary_cache = {}
+def _section_tokens(summaries: List[str]) -> int:
+    """Tokens the summaries take once formatted as sections"""
+    return sum(count_tokens(summary) + SECTION_HEADER_TOKENS for summary in summaries)
+
+def _format_sections(summaries: List[str]) -> str:
+    return "\n\n".join(f"Section {i+1} Summary:\n{summary}" for i, summary in enumerate(summaries))
+
+async def _merge_until_fits(
+    summaries: List[str],
+    system_prompt: str,
+    input_budget: int,
+    max_tokens: int,
+    temperature: float,
+    on_event: Optional[EventCallback] = None
+) -> List[str]:
+    """
+    Merge summaries level by level with a hierarchical reduce tree until they fit
+    input_budget together. Each level merges token-bounded groups concurrently.
+    """
+    merge_prompt = _merge_prompt(system_prompt)
+    # Merged groups must also fit a merge call
+    group_budget = min(input_budget, input_token_budget(merge_prompt, MERGE_USER_TEMPLATE, max_tokens))
+    level = 1
+
+    while True:
+        groups = _group_summaries_by_tokens(summaries, group_budget)
+        # A forced pair may still exceed the budget; a single summary cannot shrink further
+        if len(groups) == 1 and (len(summaries) == 1 or _section_tokens(summaries) <= input_budget):
+            return summaries
+
+        logger.info(f"Reduce level {level}: merging {len(summaries)} summaries in {len(groups)} groups")
+        if on_event:
+            await on_event({"event": "reduce_level", "level": level, "groups": len(groups)})
+        summaries = list(await asyncio.gather(*(
+            _create_completion(
+                merge_prompt,
+                MERGE_USER_TEMPLATE + _format_sections(group),
+                max_tokens,
+                temperature,
+                kind="reduce"
+            )
+            for group in groups
+        )))
+        level += 1
+
+async def _reduce_summaries(
+    chunk_summaries: List[str],
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    on_event: Optional[EventCallback] = None
+) -> str:
+    """
+    Merge chunk summaries with a hierarchical reduce tree.
+
+    Summaries are combined in token-bounded groups, each group merged concurrently,
+    until everything fits into a single final call.
+    """
+    final_prompt = f"{system_prompt}\n\nBelow are summaries of different sections of a document. Create a cohesive, complete summary that integrates all the information."
+    summaries = await _merge_until_fits(
+        chunk_summaries,
+        system_prompt,
+        input_token_budget(final_prompt, FINAL_USER_TEMPLATE, max_tokens),
+        max_tokens,
+        temperature,
+        on_event
+    )
+
+    # Create a final summary from the combined chunk summaries
+    return await _create_completion(
+        final_prompt,
+        FINAL_USER_TEMPLATE + _format_sections(summaries),
+        max_tokens,
+        temperature,
+        on_token=_token_forwarder(on_event),
+        kind="reduce"
+    )
+
+def _token_forwarder(on_event: Optional[EventCallback]) -> Optional[Callable[[str], Awaitable[None]]]:
+    """Wrap an event callback so generated summary tokens are emitted as events"""
+    if on_event is None:
+        return None
+
+    async def on_token(delta: str):
+        await on_event({"event": "summary_token", "text": delta})
+
+    return on_token
+
+def _summary_settings(custom_prompt: Optional[str]) -> Tuple[str, int, float]:
+    """Resolve the system prompt, max_tokens and temperature for a summary request"""
+    # Use custom prompt if provided, otherwise use standard prompt
+    system_prompt = custom_prompt if custom_prompt else STANDARD_PROMPT
+
+    # Determine if this is a personalized request by checking for specific markers
+    is_personalized = custom_prompt and "### IMPORTANT: This user is specifically interested in:" in custom_prompt
+
+    # Adjust parameters based on whether this is a personalized request
+    max_tokens = 1500 if is_personalized else 1000  # Allow more tokens for personalized summaries
+    temperature = 0.5 if is_personalized else 0.7   # Lower temperature for more focused responses
+    return system_prompt, max_tokens, temperature
+
+def summary_cache_key(text: str, custom_prompt: str = None) -> str:
+    """Cache key under which summarize_text stores the summary of text with this prompt"""
+    _, max_tokens, temperature = _summary_settings(custom_prompt)
+    return _cache_key(text, custom_prompt, OPENAI_CONFIG["deployment"], temperature, max_tokens)
+
+# System prompt of map calls. It does not mention the chunk's position, so a section's
+# summary can be reused wherever the section appears.
+MAP_SYSTEM_PROMPT = f"{MAP_PROMPT}\n\nThis is one section of a larger document. Focus on extracting the key information from this section."
+
+# Smallest map chunk: the original 6000-token chunk less its 500-token prompt
+# allowance. Smaller chunks only add map calls for the same document.
+MIN_MAP_CHUNK_TOKENS = 5500
+
+def chunk_token_budget() -> int:
+    """
+    Document tokens per map chunk, for documents too large for one direct call:
+    PROCESSING_CONFIG["map_chunk_max_tokens"] but at least MIN_MAP_CHUNK_TOKENS,
+    capped by the model's context window minus the map completion size and the
+    measured map prompt. The map prompt is the same for every summary prompt, so a
+    document is always split the same way, and sections shared by several
+    documents fall into identical chunks.
+    """
+    return min(
+        max(PROCESSING_CONFIG["map_chunk_max_tokens"], MIN_MAP_CHUNK_TOKENS),
+        input_token_budget(MAP_SYSTEM_PROMPT, MAP_USER_TEMPLATE, MAP_MAX_TOKENS)
+    )
+
+def map_cache_key(text: str) -> str:
+    """Cache key of the map-phase outputs for a document's text"""
+    return make_cache_key(
+        "map", OPENAI_CONFIG["deployment"], MAP_PROMPT, MAP_MAX_TOKENS, MAP_TEMPERATURE, chunk_token_budget(), text
+    )
+
+def chunk_cache_key(chunk: str) -> str:
+    """Cache key of a chunk's map summary; whitespace is normalized so re-flowed text still matches"""
+    return make_cache_key(
+        "chunk", OPENAI_CONFIG["deployment"], MAP_SYSTEM_PROMPT, MAP_MAX_TOKENS, MAP_TEMPERATURE, " ".join(chunk.split())
+    )
+
+async def _map_chunk(chunk: str) -> str:
+    """Map summary of one chunk, from the chunk cache or a map call"""
+    key = chunk_cache_key(chunk)
+    cached_summary = chunk_cache.get(key)
+    if cached_summary is not None:
+        return cached_summary
+
+    async def summarize() -> str:
+        chunk_summary = await _create_completion(
+            MAP_SYSTEM_PROMPT,
+            MAP_USER_TEMPLATE + chunk,
+            MAP_MAX_TOKENS,
+            MAP_TEMPERATURE,
+            kind="map"
+        )
+        chunk_cache.set(key, chunk_summary)
+        return chunk_summary
+
+    return await chunk_flight.do(key, summarize)
+
+def get_map_outputs(key: str) -> Optional[Dict[str, Any]]:
+    """Cached map-phase outputs: {"spans": [(start, end), ...], "summaries": [...]}, or None"""
+    stored = map_cache.get(key)
+    return json.loads(stored) if stored is not None else None
+
+def store_map_outputs(key: str, spans: List[Tuple[int, int]], summaries: List[str]):
+    """Cache the chunk offsets and chunk summaries of a document's map phase"""
+    map_cache.set(key, json.dumps({"spans": spans, "summaries": summaries}))
+
+def _fits_direct_call(text: str, system_prompt: str, max_tokens: int) -> bool:
+    """Whether a document fits one direct call with the summary prompt"""
+    return count_tokens(text) <= input_token_budget(system_prompt, DIRECT_USER_TEMPLATE, max_tokens)
+
+async def _iterate_chunks(chunks: List[str]) -> AsyncIterator[Tuple[str, bool]]:
+    """Adapt a list of chunks to the (chunk, is_last) stream used by _summarize_chunk_stream"""
+    for i, chunk in enumerate(chunks):
+        yield chunk, i == len(chunks) - 1
+
+async def _summarize_chunk_stream(
+    chunks: AsyncIterator[Tuple[str, bool]],
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    total_chunks: Optional[int] = None,
+    on_event: Optional[EventCallback] = None
+) -> Tuple[str, List[str]]:
+    """
+    Summarize a stream of (chunk, is_last) pairs. A map call starts as soon as each chunk
+    arrives, so chunk 1 can be in flight while later chunks are still being produced.
+    Map calls use the personalization-independent MAP_PROMPT and are cached per chunk;
+    system_prompt applies in the reduce step. Chunks are held back while the document
+    still fits one direct call with system_prompt; a document that does is summarized
+    with that call, and map calls start once it no longer can.
+    Returns the summary and the map-phase chunk summaries (empty after a direct call).
+    """
+    map_tasks: List[asyncio.Task] = []
+    completed_chunks = 0
+    direct_budget = input_token_budget(system_prompt, DIRECT_USER_TEMPLATE, max_tokens)
+    held_chunks: Optional[List[str]] = []
+    held_tokens = 0
+
+    async def summarize_chunk(i: int, chunk: str) -> str:
+        nonlocal completed_chunks
+        with timing_labels(chunk=i + 1):
+            chunk_summary = await _map_chunk(chunk)
+        completed_chunks += 1
+        if on_event:
+            await on_event({"event": "chunk_done", "chunk": i + 1, "completed": completed_chunks, "chunks": total_chunks})
+        return chunk_summary
 
-@lru_cache(maxsize=1000)
-def _cache_key(text: str, custom_prompt: str = None) -> str:
-    """Create a cache key for summary"""
-    components = [text]
-    if custom_prompt:
-        components.append(custom_prompt)
-    key_string = "_".join(components)
-    return hashlib.md5(key_string.encode()).hexdigest()
+    try:
+        async for chunk, is_last in chunks:
+            if held_chunks is not None:
+                held_chunks.append(chunk)
+                held_tokens += count_tokens(chunk)
+                if held_tokens <= direct_budget:
+                    if not is_last:
+                        continue
+                    # The whole document fits the summary prompt: one direct call
+                    summary = await _create_completion(
+                        system_prompt,
+                        DIRECT_USER_TEMPLATE + "".join(held_chunks),
+                        max_tokens,
+                        temperature,
+                        on_token=_token_forwarder(on_event)
+                    )
+                    return summary, []
+                # Too large for one call: map the held chunks, then each chunk as it arrives
+                pending, held_chunks = held_chunks, None
+            else:
+                pending = [chunk]
+            # Map: chunks are summarized concurrently (the scheduler bounds in-flight calls)
+            for pending_chunk in pending:
+                map_tasks.append(asyncio.create_task(summarize_chunk(len(map_tasks), pending_chunk)))
+
+        if not map_tasks:
+            raise ValueError("No text to summarize")
+        if total_chunks is None:
+            # Streamed chunks are counted once the chunker has finished
+            total_chunks = len(map_tasks)
+            if on_event:
+                await on_event({"event": "chunking_done", "chunks": total_chunks})
+
+        chunk_summaries = list(await asyncio.gather(*map_tasks))
+    except BaseException:
+        for task in map_tasks:
+            task.cancel()
+        # Wait for the cancelled calls to unwind so none outlives this summary
+        await asyncio.gather(*map_tasks, return_exceptions=True)
+        raise
+
+    # Reduce: merge the chunk summaries level by level into one summary
+    summary = await _reduce_summaries(chunk_summaries, system_prompt, max_tokens, temperature, on_event)
+    return summary, chunk_summaries
+
+async def summarize_chunk_stream(
+    chunks: AsyncIterator[Tuple[str, bool]],
+    custom_prompt: str = None,
+    on_event: Optional[EventCallback] = None
+) -> Tuple[str, List[str]]:
+    """
+    Summarize a document delivered incrementally as (chunk, is_last) pairs, e.g. from
+    pdf_service.iter_text_chunks. Returns the summary and the map-phase chunk summaries,
+    which are kept for grounded refinement. The caller is responsible for caching.
+    """
+    try:
+        system_prompt, max_tokens, temperature = _summary_settings(custom_prompt)
+        return await _summarize_chunk_stream(chunks, system_prompt, max_tokens, temperature, on_event=on_event)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error summarizing text with Azure OpenAI: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to summarize text: {str(e)}")
 
-async def summarize_text(text: str, custom_prompt: str = None) -> str:
+async def summarize_text(text: str, custom_prompt: str = None, on_event: Optional[EventCallback] = None) -> str:
     """
     Summarize text using Azure OpenAI
 
     Args:
         text: The text to summarize
         custom_prompt: Optional custom prompt to use instead of the standard prompt
+        on_event: Optional callback receiving chunk progress and summary token events
     """
     try:
-        # Check cache first
-        cache_key = _cache_key(text, custom_prompt)
-        if cache_key in summary_cache:
-            return summary_cache[cache_key]
-
-        # Use custom prompt if provided, otherwise use standard prompt
-        system_prompt = custom_prompt if custom_prompt else STANDARD_PROMPT
-
-        # Determine if this is a personalized request by checking for specific markers
-        is_personalized = custom_prompt and "### IMPORTANT: This user is specifically interested in:" in custom_prompt
-
-        # Adjust parameters based on whether this is a personalized request
-        max_tokens = 1500 if is_personalized else 1000  # Allow more tokens for personalized summaries
-        temperature = 0.5 if is_personalized else 0.7   # Lower temperature for more focused responses
-
-        # Check if text needs to be chunked (accounting for prompt tokens too)
-        # We'll use a conservative estimate for prompt tokens
-        estimated_prompt_tokens = 500  # Adjust based on your typical prompt size
-        chunks = chunk_text_by_tokens(text, max_tokens=6000 - estimated_prompt_tokens)
-
-        # If we have multiple chunks, process them recursively
-        if len(chunks) > 1:
-            logger.info(f"Document is large, splitting into {len(chunks)} chunks for processing")
-
-            # First, summarize each chunk
-            chunk_summaries = []
-            for i, chunk in enumerate(chunks):
-                logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-                chunk_prompt = f"{system_prompt}\n\nThis is part {i+1} of {len(chunks)} of a larger document. Focus on extracting the key information from this section."
-
-                # Use semaphore to limit concurrent API calls
-                async with api_semaphore:
-                    loop = asyncio.get_event_loop()
-                    response = await loop.run_in_executor(
-                        None,
-                        lambda: client.chat.completions.create(
-                            model=os.getenv("OPENAI_MODEL_NAME"),
-                            messages=[
-                                {"role": "system", "content": chunk_prompt},
-                                {"role": "user", "content": f"Here's the document section to analyze:\n\n{chunk}"}
-                            ],
-                            max_tokens=max_tokens,
-                            temperature=temperature
-                        )
-                    )
-
-                    chunk_summary = response.choices[0].message.content
-                    chunk_summaries.append(chunk_summary)
-
-            # Then, combine the summaries
-            combined_chunks = "\n\n".join([f"Section {i+1} Summary:\n{summary}" for i, summary in enumerate(chunk_summaries)])
-
-            # Create a final summary from the combined chunk summaries
-            final_prompt = f"{system_prompt}\n\nBelow are summaries of different sections of a document. Create a cohesive, complete summary that integrates all the information."
-
-            # Use semaphore to limit concurrent API calls
-            async with api_semaphore:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: client.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL_NAME"),
-                        messages=[
-                            {"role": "system", "content": final_prompt},
-                            {"role": "user", "content": f"Here are the section summaries to integrate:\n\n{combined_chunks}"}
-                        ],
-                        max_tokens=max_tokens,
-                        temperature=temperature
-                    )
-                )
-
-                summary = response.choices[0].message.content
-                # Cache the result
-                summary_cache[cache_key] = summary
-                return summary
-        else:
-            # For single chunks, process normally
-            # Use semaphore to limit concurrent API calls
-            async with api_semaphore:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: client.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL_NAME"),
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": f"Here's the document to analyze:\n\n{text}"}
-                        ],
-                        max_tokens=max_tokens,
-                        temperature=temperature
-                    )
-                )
+        system_prompt, max_tokens, temperature = _summary_settings(custom_prompt)
 
-                summary = response.choices[0].message.content
-                # Cache the result
-                summary_cache[cache_key] = summary
-                return summary
+        # Check cache first
+        cache_key = _cache_key(text, custom_prompt, OPENAI_CONFIG["deployment"], temperature, max_tokens)
+        cached_summary = summary_cache.get(cache_key)
+        if cached_summary is not None:
+            if on_event:
+                await on_event({"event": "summary_token", "text": cached_summary, "cached": True})
+            return cached_summary
+
+        # Join an identical summary already being generated; only its caller gets progress events
+        shared = cache_key in summary_flight
+        summary = await summary_flight.do(
+            cache_key,
+            lambda: _generate_summary(text, cache_key, system_prompt, max_tokens, temperature, on_event)
+        )
+        if shared and on_event:
+            await on_event({"event": "summary_token", "text": summary, "shared": True})
+        return summary
 
     except Exception as e:
         logger.error(f"Error summarizing text with Azure OpenAI: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to summarize text: {str(e)}")
 
-async def summarize_multiple_texts(texts: list[tuple[str, str]], custom_prompt: str = None) -> list[str]:
-    """
-    Summarize multiple texts concurrently using Azure OpenAI
-    """
-    tasks = []
-    for filename, text in texts:
-        tasks.append(summarize_text(text, custom_prompt))
-    return await asyncio.gather(*tasks)
+async def _generate_summary(
+    text: str,
+    cache_key: str,
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    on_event: Optional[EventCallback]
+) -> str:
+    """Summarize text that is not in the summary cache and cache the result"""
+    # Map outputs are shared by every prompt variant; with them only the reduce step runs
+    map_key = map_cache_key(text)
+    map_outputs = get_map_outputs(map_key)
+    if map_outputs is not None:
+        logger.info(f"Reusing {len(map_outputs['summaries'])} cached chunk summaries")
+        if on_event:
+            await on_event({"event": "chunking_done", "chunks": len(map_outputs["summaries"]), "cached": True})
+        summary = await _reduce_summaries(map_outputs["summaries"], system_prompt, max_tokens, temperature, on_event)
+        summary_cache.set(cache_key, summary)
+        return summary
+
+    # Documents that fit one direct call are not chunked; larger ones are mapped in chunks
+    with stage_timer("chunking"):
+        if _fits_direct_call(text, system_prompt, max_tokens):
+            chunks = [text]
+        else:
+            chunks = chunk_text_by_tokens(text, max_tokens=chunk_token_budget()) or [text]
+
+    # If we have multiple chunks, process them with a map/reduce pass
+    if len(chunks) > 1:
+        logger.info(f"Document is large, splitting into {len(chunks)} chunks for processing")
+        if on_event:
+            await on_event({"event": "chunking_done", "chunks": len(chunks)})
+
+    summary, chunk_summaries = await _summarize_chunk_stream(
+        _iterate_chunks(chunks),
+        system_prompt,
+        max_tokens,
+        temperature,
+        total_chunks=len(chunks),
+        on_event=on_event
+    )
+    if chunk_summaries:
+        # Chunks concatenate back to the text, so offsets are running lengths
+        offsets = list(itertools.accumulate(len(chunk) for chunk in chunks))
+        store_map_outputs(map_key, list(zip([0] + offsets[:-1], offsets)), chunk_summaries)
+
+    # Cache the result
+    summary_cache.set(cache_key, summary)
+    return summary
 
 FEEDBACK_PROMPTS = {
     "unclear": """You are an expert at improving document summaries. The previous summary was marked as unclear.
@@ -183,8 +600,112 @@ Taking into account the user's specific feedback, please improve the summary by:
 Please provide an enhanced summary that better meets the user's needs."""
 }
 
-async def refine_summary_with_feedback(text: str, original_summary: str, feedback_type: str, feedback_text: str = None) -> str:
-    """Refine the summary based on user feedback using Azure OpenAI"""
+# Large documents are refined from their section summaries plus the passages of
+# this many tokens that best match the feedback
+REFINE_PASSAGE_TOKENS = 1000
+REFINE_MAX_TOKENS = 1500
+
+# Okapi BM25 parameters and words ignored when matching feedback to passages
+BM25_K1 = 1.5
+BM25_B = 0.75
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with "
+    "from they will would there their what about which when your into than them then its also "
+    "been were shall may such other these those should".split()
+)
+
+def _terms(text: str) -> List[str]:
+    return [word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS]
+
+def _rank_by_relevance(passages: List[str], query: str) -> List[int]:
+    """Indices of passages ordered by BM25 score against the query, best first"""
+    query_terms = set(_terms(query))
+    passage_terms = [Counter(_terms(passage)) for passage in passages]
+    if not query_terms or not passages:
+        return list(range(len(passages)))
+
+    document_frequency = Counter(term for terms in passage_terms for term in terms.keys() & query_terms)
+    average_length = sum(sum(terms.values()) for terms in passage_terms) / len(passages) or 1
+
+    scores = []
+    for terms in passage_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term, 0)
+            if frequency:
+                idf = math.log(1 + (len(passages) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        scores.append(score)
+    return sorted(range(len(passages)), key=lambda index: scores[index], reverse=True)
+
+async def _refine_from_sections(
+    system_prompt: str,
+    original_summary: str,
+    query: str,
+    chunks: List[str],
+    chunk_summaries: Optional[List[str]]
+) -> str:
+    """
+    Refine a large document's summary in one bounded call: the reduce step is re-run
+    over the stored map-phase chunk summaries, together with the document passages
+    most relevant to the feedback so corrections can be checked against the source.
+    """
+    grounded_prompt = system_prompt + "\n\nThe document is too large to include in full. You are given summaries of all its sections and the passages most relevant to the feedback. Check the summary against them and correct anything they do not support."
+    input_budget = input_token_budget(
+        grounded_prompt,
+        f"Original summary:\n\n{original_summary}\n\nSection summaries:\n\n\n\nRelevant document passages:\n\n\n\nPlease provide an improved summary that addresses the feedback.",
+        REFINE_MAX_TOKENS
+    )
+
+    # Section summaries may use up to half the budget; larger sets are merged down first
+    sections = []
+    if chunk_summaries:
+        sections = await _merge_until_fits(chunk_summaries, STANDARD_PROMPT, input_budget // 2, 1000, 0.7)
+    remaining = input_budget - _section_tokens(sections)
+
+    # Fill the rest with the best-matching passages, presented in document order
+    passages = [
+        (chunk_index, passage)
+        for chunk_index, chunk in enumerate(chunks)
+        for passage in chunk_text_by_tokens(chunk, max_tokens=REFINE_PASSAGE_TOKENS)
+    ]
+    selected = []
+    for index in _rank_by_relevance([passage for _, passage in passages], query):
+        passage_tokens = count_tokens(passages[index][1]) + SECTION_HEADER_TOKENS
+        if passage_tokens <= remaining:
+            selected.append(index)
+            remaining -= passage_tokens
+    selected.sort()
+    logger.info(f"Refining from {len(sections)} section summaries and {len(selected)} of {len(passages)} passages")
+
+    excerpts = "\n\n".join(
+        f"Passage from section {passages[index][0] + 1}:\n{passages[index][1]}" for index in selected
+    )
+    return await _create_completion(
+        grounded_prompt,
+        f"Original summary:\n\n{original_summary}\n\nSection summaries:\n\n{_format_sections(sections)}\n\nRelevant document passages:\n\n{excerpts}\n\nPlease provide an improved summary that addresses the feedback.",
+        REFINE_MAX_TOKENS,
+        0.7,
+        kind="refine"
+    )
+
+async def refine_summary_with_feedback(
+    text: str,
+    original_summary: str,
+    feedback_type: str,
+    feedback_text: str = None,
+    chunks: Optional[List[str]] = None,
+    chunk_summaries: Optional[List[str]] = None
+) -> str:
+    """
+    Refine the summary based on user feedback using Azure OpenAI
+
+    Documents that fit the context window are sent in full. Larger ones are refined
+    from their chunks and map-phase chunk summaries (as kept by document_service);
+    chunks are recomputed from the text when not given.
+    """
     try:
         feedback_prompts = {
             "unclear": "The previous summary was unclear. Please provide a clearer, better structured summary that is easier to understand.",
@@ -202,127 +723,94 @@ async def refine_summary_with_feedback(text: str, original_summary: str, feedbac
 
         system_prompt += "\n\nPlease provide a revised summary that addresses these concerns while maintaining accuracy and clarity."
 
-        # Check if text needs to be chunked (accounting for prompt tokens and original summary)
-        estimated_prompt_tokens = 500 + len(tokenizer.encode(original_summary))
-        chunks = chunk_text_by_tokens(text, max_tokens=6000 - estimated_prompt_tokens)
-
-        # If we have multiple chunks, process them differently
-        if len(chunks) > 1:
-            logger.info(f"Document for refinement is large, using a different approach with {len(chunks)} chunks")
-
-            # For refinement of large documents, we'll use the original summary as a base
-            # and focus on improving it based on the feedback, rather than re-summarizing from scratch
-
-            # Use semaphore to limit concurrent API calls
-            async with api_semaphore:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: client.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL_NAME"),
-                        messages=[
-                            {"role": "system", "content": system_prompt + "\n\nThe original document is very large, so focus on improving the existing summary based on the feedback without requiring the full document text."},
-                            {"role": "user", "content": f"Original summary to improve:\n\n{original_summary}\n\nPlease provide an improved summary that addresses the feedback."}
-                        ],
-                        max_tokens=1500,  # Allow more tokens for refinement
-                        temperature=0.7
-                    )
-                )
+        # Check whether the full document fits next to the measured prompt and original summary
+        document_tokens = count_tokens(text)
+        input_budget = input_token_budget(
+            system_prompt,
+            f"Original document:\n\n\n\nOriginal summary:\n\n{original_summary}\n\nPlease provide an improved summary that addresses the feedback.",
+            1000
+        )
 
-                refined_summary = response.choices[0].message.content
-                logger.info(f"Generated refined summary for feedback type: {feedback_type} (large document approach)")
-                return refined_summary
+        # If the document does not fit, process it differently
+        if document_tokens > input_budget:
+            logger.info(f"Document for refinement is large ({document_tokens} tokens, budget {input_budget}), using a different approach")
+
+            # For refinement of large documents, re-run the reduce step over the section
+            # summaries, grounded in the passages matching the feedback (or the summary)
+            if chunks is None:
+                chunks = chunk_text_by_tokens(text, max_tokens=chunk_token_budget())
+            refined_summary = await _refine_from_sections(
+                system_prompt,
+                original_summary,
+                feedback_text or original_summary,
+                chunks,
+                chunk_summaries
+            )
+            logger.info(f"Generated refined summary for feedback type: {feedback_type} (large document approach)")
+            return refined_summary
         else:
             # For smaller documents, use the original approach
-            # Use semaphore to limit concurrent API calls
-            async with api_semaphore:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: client.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL_NAME"),
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": f"Original document:\n\n{text}\n\nOriginal summary:\n\n{original_summary}\n\nPlease provide an improved summary that addresses the feedback."}
-                        ],
-                        max_tokens=1000,
-                        temperature=0.7
-                    )
-                )
-
-                refined_summary = response.choices[0].message.content
-                logger.info(f"Generated refined summary for feedback type: {feedback_type}")
-                return refined_summary
+            refined_summary = await _create_completion(
+                system_prompt,
+                f"Original document:\n\n{text}\n\nOriginal summary:\n\n{original_summary}\n\nPlease provide an improved summary that addresses the feedback.",
+                1000,
+                0.7,
+                kind="refine"
+            )
+            logger.info(f"Generated refined summary for feedback type: {feedback_type}")
+            return refined_summary
 
     except Exception as e:
         logger.error(f"Error refining summary with Azure OpenAI: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to refine summary: {str(e)}")
 
-async def generate_personalized_summary(
-    text: str,
+def build_personalized_prompt(
     reading_level: Optional[str] = None,
     interests: Optional[List[str]] = None,
     age_group: Optional[str] = None
-) -> str:
-    """
-    Generate a personalized summary based on provided personalization parameters
-
-    Args:
-        text: The text to summarize
-        reading_level: Optional reading level (basic, intermediate, advanced)
-        interests: Optional list of interests
-        age_group: Optional age group
-    """
-    try:
-        # If no personalization parameters provided, return standard summary
-        if not any([reading_level, interests]):
-            return await summarize_text(text)
-
-        # Create a personalized prompt based on the reading level
-        base_prompt = PERSONALIZED_PROMPTS.get(
-            reading_level if reading_level else "intermediate",
-            PERSONALIZED_PROMPTS["intermediate"]
-        )
-
-        # Build a more focused prompt for user interests
-        interest_sections = []
-        interest_names = []
-
-        if interests:
-            for interest in interests:
-                if interest in INTEREST_FOCUSED_PROMPTS:
-                    interest_sections.append(INTEREST_FOCUSED_PROMPTS[interest])
-                    # Convert snake_case to readable format
-                    interest_names.append(interest.replace('_', ' ').title())
-
-        # Combine all prompts with stronger emphasis on interests
-        combined_prompt = base_prompt
-
-        # Add a personalized introduction based on interests
-        if interest_names:
-            combined_prompt += f"\n\n### IMPORTANT: This user is specifically interested in: {', '.join(interest_names)}."
-            combined_prompt += "\nYou MUST prioritize these topics in your summary and provide detailed information about them."
-            combined_prompt += "\nMake sure each of these interest areas is addressed with its own section in the summary."
-
-            # Add the specific instructions for each interest
-            if interest_sections:
-                combined_prompt += "\n\n### For each interest area, follow these specific instructions:\n" + "\n".join(interest_sections)
-
-        # Add age group context if provided
-        if age_group:
-            combined_prompt += f"\n\n### This summary is for someone in the {age_group} age group. Adjust your explanation accordingly."
-
-        # Add final instruction to ensure personalization
-        combined_prompt += "\n\n### FINAL INSTRUCTION: Review your summary before submitting to ensure you've adequately addressed ALL the user's specified interests. If any interest area isn't thoroughly covered, expand that section."
-
-        # Add instruction for large documents
-        combined_prompt += "\n\n### If the document is large and has been split into sections, make sure to create a cohesive summary that covers all important aspects from all sections."
-
-        # Generate the personalized summary using the enhanced summarize_text function
-        # which now handles large documents automatically
-        return await summarize_text(text, combined_prompt)
-
-    except Exception as e:
-        logger.error(f"Error generating personalized summary: {e}")
-        # Fallback to standard summary
-        return await summarize_text(text)
\ No newline at end of file
+) -> Optional[str]:
+    """Build the system prompt for a personalized summary, or None when no personalization applies"""
+    if not any([reading_level, interests]):
+        return None
+
+    # Create a personalized prompt based on the reading level
+    base_prompt = PERSONALIZED_PROMPTS.get(
+        reading_level if reading_level else "intermediate",
+        PERSONALIZED_PROMPTS["intermediate"]
+    )
+
+    # Build a more focused prompt for user interests
+    interest_sections = []
+    interest_names = []
+
+    if interests:
+        for interest in interests:
+            if interest in INTEREST_FOCUSED_PROMPTS:
+                interest_sections.append(INTEREST_FOCUSED_PROMPTS[interest])
+                # Convert snake_case to readable format
+                interest_names.append(interest.replace('_', ' ').title())
+
+    # Combine all prompts with stronger emphasis on interests
+    combined_prompt = base_prompt
+
+    # Add a personalized introduction based on interests
+    if interest_names:
+        combined_prompt += f"\n\n### IMPORTANT: This user is specifically interested in: {', '.join(interest_names)}."
+        combined_prompt += "\nYou MUST prioritize these topics in your summary and provide detailed information about them."
+        combined_prompt += "\nMake sure each of these interest areas is addressed with its own section in the summary."
+
+        # Add the specific instructions for each interest
+        if interest_sections:
+            combined_prompt += "\n\n### For each interest area, follow these specific instructions:\n" + "\n".join(interest_sections)
+
+    # Add age group context if provided
+    if age_group:
+        combined_prompt += f"\n\n### This summary is for someone in the {age_group} age group. Adjust your explanation accordingly."
+
+    # Add final instruction to ensure personalization
+    combined_prompt += "\n\n### FINAL INSTRUCTION: Review your summary before submitting to ensure you've adequately addressed ALL the user's specified interests. If any interest area isn't thoroughly covered, expand that section."
+
+    # Add instruction for large documents
+    combined_prompt += "\n\n### If the document is large and has been split into sections, make sure to create a cohesive summary that covers all important aspects from all sections."
+
+    return combined_prompt
@@ -1,142 +1,348 @@
-from fastapi import HTTPException
+import aiofiles
 from PyPDF2 import PdfReader
 import logging
-from io import BytesIO
-from functools import lru_cache
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from aiohttp import ClientSession
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import re
-import tiktoken
+from typing import AsyncIterator, List, Optional, Tuple
+from config import PDF_CONFIG
+from cache_service import MemoryLRUCache, TieredCache
+from model_service import get_tokenizer
+from timing_service import observe_stage, stage_timer
 
 logger = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=4)  # Limit concurrent PDF processing
 
-# Initialize tokenizer for GPT models
-tokenizer = tiktoken.get_encoding("cl100k_base")  # This works for most GPT models
+# Executor for CPU-bound PDF parsing, created on first use. In "process" mode
+# large PDFs are also split into page ranges parsed on separate workers.
+executor: Optional[Executor] = None
 
-# Maximum tokens per chunk (leaving room for the prompt and completion)
-MAX_CHUNK_TOKENS = 6000  # Adjust based on your model's context window
-
-@lru_cache(maxsize=100)
-def _extract_text_from_buffer(content: bytes | str) -> str:
-    """Extract text from PDF bytes or string with caching"""
-    try:
-        if isinstance(content, str):
-            buffer = BytesIO(content.encode('utf-8'))
+def get_executor() -> Executor:
+    """Get or create the PDF extraction executor configured in PDF_CONFIG"""
+    global executor
+    if executor is None:
+        if PDF_CONFIG["executor"] == "process":
+            # Forking a process that already runs threads (event loop, thread pools)
+            # can copy held locks into the children; start workers from a clean server
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            executor = ProcessPoolExecutor(
+                max_workers=PDF_CONFIG["max_workers"],
+                mp_context=multiprocessing.get_context(method)
+            )
         else:
-            buffer = BytesIO(content)
+            executor = ThreadPoolExecutor(max_workers=PDF_CONFIG["max_workers"])
+        logger.info(f"Created PDF {PDF_CONFIG['executor']} executor with {PDF_CONFIG['max_workers']} workers")
+    return executor
+
+def shutdown_executor():
+    """Shut down the PDF extraction executor"""
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
 
-        reader = PdfReader(buffer)
-        text = []
+# Extracted text keyed by the SHA-256 digest of the PDF, bounded by a memory budget
+extraction_cache = TieredCache(MemoryLRUCache(
+    max_entries=PDF_CONFIG["extraction_cache_entries"],
+    max_bytes=PDF_CONFIG["extraction_cache_bytes"]
+))
+
+# Default chunk size for callers that do not pass a budget. Summarization computes
+# its budget from the model's context window (see model_service.input_token_budget).
+MAX_CHUNK_TOKENS = 6000
+
+def _extract_text_from_path(path: str) -> str:
+    """Extract text from a PDF file on disk; pages are read lazily from the open file"""
+    try:
+        with open(path, "rb") as stream:
+            reader = PdfReader(stream)
+            text = []
 
-        for page in reader.pages:
-            text.append(page.extract_text())
+            for page in reader.pages:
+                text.append(page.extract_text())
 
-        return "\n".join(text)
+            return "\n".join(text)
     except Exception as e:
         logger.error(f"Error in PDF text extraction: {e}")
         raise
 
-async def download_file(url: str) -> bytes:
-    """Download file from URL"""
-    try:
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                return await response.read()
-    except Exception as e:
-        logger.error(f"Error downloading file: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
+def _count_pages(path: str) -> int:
+    """Count the pages of a PDF without extracting any text"""
+    with open(path, "rb") as stream:
+        return len(PdfReader(stream).pages)
+
+def _extract_page_range(path: str, start: int, end: int) -> str:
+    """Extract text from pages [start, end) of a PDF; runs inside a worker process"""
+    with open(path, "rb") as stream:
+        reader = PdfReader(stream)
+        return "\n".join(reader.pages[index].extract_text() for index in range(start, end))
+
+def _page_ranges(page_count: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    """Split a page count into consecutive [start, end) ranges of at most pages_per_task pages"""
+    return [
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+
+async def _extract_text_in_processes(path: str) -> str:
+    """Extract text on the process pool, fanning large PDFs out by page range"""
+    loop = asyncio.get_event_loop()
+    pool = get_executor()
+
+    page_count = await loop.run_in_executor(pool, _count_pages, path)
+    ranges = _page_ranges(page_count, PDF_CONFIG["pages_per_task"])
+    if len(ranges) > 1:
+        logger.info(f"Extracting {page_count} pages in {len(ranges)} page ranges")
+
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(pool, _extract_page_range, path, start, end)
+        for start, end in ranges
+    ))
+    # Pages are joined with newlines, same as _extract_text_from_path
+    return "\n".join(parts)
+
+async def iter_pdf_text(path: str) -> AsyncIterator[str]:
+    """
+    Yield the text of a PDF on disk in page order, one page range at a time, so
+    downstream chunking can start before the whole document is parsed. Joining the
+    yielded blocks with newlines gives the same text as a full extraction.
+    """
+    loop = asyncio.get_event_loop()
+    pool = get_executor()
+
+    # Only time spent waiting on the parser counts, not time the consumer holds a block
+    started = time.perf_counter()
+    page_count = await loop.run_in_executor(pool, _count_pages, path)
+    ranges = _page_ranges(page_count, PDF_CONFIG["pages_per_task"])
+    elapsed = time.perf_counter() - started
+
+    if PDF_CONFIG["executor"] == "process":
+        # Parse every range in parallel but hand them out in order
+        futures = [loop.run_in_executor(pool, _extract_page_range, path, start, end) for start, end in ranges]
+        try:
+            for future in futures:
+                started = time.perf_counter()
+                block = await future
+                elapsed += time.perf_counter() - started
+                yield block
+        finally:
+            for future in futures:
+                future.cancel()
+    else:
+        for start, end in ranges:
+            started = time.perf_counter()
+            block = await loop.run_in_executor(pool, _extract_page_range, path, start, end)
+            elapsed += time.perf_counter() - started
+            yield block
+
+    observe_stage("extraction", elapsed)
+
+# Chunk boundaries, matched on the UTF-8 bytes of the text. Chunks end right after
+# a paragraph break if possible, otherwise after a sentence.
+PARAGRAPH_BOUNDARY = re.compile(rb'\n[ \t]*\n\s*')
+SENTENCE_BOUNDARY = re.compile(rb'[.!?]["\')\]]*\s+')
+
+# Content-defined chunking: a chunk ends at the first anchor after filling CDC_MIN_FILL
+# of the token budget; anchors are on average CDC_ANCHOR_SPACING of the budget apart
+CDC_MIN_FILL = 0.5
+CDC_ANCHOR_SPACING = 0.25
+
+# Texts longer than this many characters are split on paragraph breaks and encoded in parallel
+BATCH_ENCODE_SEGMENT_CHARACTERS = 256 * 1024
+
+def _encode_tokens(text: str, batch_encode: bool = False) -> List[int]:
+    """Tokenize text once; optionally encode paragraph-aligned segments in parallel"""
+    tokenizer = get_tokenizer()
+    if not batch_encode or len(text) <= BATCH_ENCODE_SEGMENT_CHARACTERS:
+        return tokenizer.encode_ordinary(text)
 
-def chunk_text_by_tokens(text, max_tokens=MAX_CHUNK_TOKENS):
+    segments = []
+    start = 0
+    while start < len(text):
+        end = text.find("\n\n", start + BATCH_ENCODE_SEGMENT_CHARACTERS)
+        end = len(text) if end == -1 else end + 2
+        segments.append(text[start:end])
+        start = end
+    return [token for encoded in tokenizer.encode_ordinary_batch(segments) for token in encoded]
+
+def _last_boundary(boundaries: List[int], low: int, high: int) -> Optional[int]:
+    """Largest boundary offset b with low < b <= high, if any"""
+    index = bisect.bisect_right(boundaries, high) - 1
+    if index >= 0 and boundaries[index] > low:
+        return boundaries[index]
+    return None
+
+def _content_anchors(data: bytes, boundaries: List[int], token_ends: List[int], spacing_tokens: float) -> List[int]:
+    """
+    Paragraph and sentence ends chosen by content: a boundary is an anchor when the
+    hash of the whitespace-normalized text since the previous boundary falls below a
+    threshold proportional to that text's tokens. Whether a boundary is an anchor
+    depends only on the text just before it, so anchors stay put when earlier text
+    changes.
+    """
+    anchors = []
+    previous = 0
+    for boundary in boundaries:
+        tokens = bisect.bisect_right(token_ends, boundary) - bisect.bisect_right(token_ends, previous)
+        digest = hashlib.blake2b(b" ".join(data[previous:boundary].split()), digest_size=8).digest()
+        if int.from_bytes(digest, "big") < min(1.0, tokens / spacing_tokens) * 2 ** 64:
+            anchors.append(boundary)
+        previous = boundary
+    return anchors
+
+def chunk_text_by_tokens(text, max_tokens=MAX_CHUNK_TOKENS, batch_encode=False):
     """
     Split text into chunks that don't exceed max_tokens
     Returns a list of text chunks
+
+    The text is tokenized once. Chunk boundaries are content-defined: each chunk ends
+    at the first anchor (see _content_anchors) past CDC_MIN_FILL of the budget, so a
+    section shared by several documents is cut the same way in all of them and its
+    map summary can be reused. Without an anchor in range, the chunk is cut at the
+    last paragraph break (else sentence end, else token boundary) within the budget.
+    Whitespace is preserved, so joining the chunks gives back the original text.
     """
     if not text:
         return []
 
-    # Get token count
-    tokens = tokenizer.encode(text)
-    token_count = len(tokens)
+    tokens = _encode_tokens(text, batch_encode)
 
     # If text is small enough, return it as is
-    if token_count <= max_tokens:
+    if len(tokens) <= max_tokens:
         return [text]
 
-    # Otherwise, split into chunks
+    data = text.encode("utf-8")
+    token_ends = list(itertools.accumulate(len(token) for token in get_tokenizer().decode_tokens_bytes(tokens)))
+    paragraph_ends = [match.end() for match in PARAGRAPH_BOUNDARY.finditer(data)]
+    sentence_ends = [match.end() for match in SENTENCE_BOUNDARY.finditer(data)]
+    anchors = _content_anchors(
+        data, sorted(set(paragraph_ends) | set(sentence_ends)), token_ends, max_tokens * CDC_ANCHOR_SPACING
+    )
+    min_tokens = max(1, int(max_tokens * CDC_MIN_FILL))
+
     chunks = []
-    current_chunk = []
-    current_chunk_tokens = 0
-
-    # Split by paragraphs first (better context preservation)
-    paragraphs = text.split('\n\n')
-
-    for paragraph in paragraphs:
-        paragraph_tokens = tokenizer.encode(paragraph)
-        paragraph_token_count = len(paragraph_tokens)
-
-        # If a single paragraph is too large, split it by sentences
-        if paragraph_token_count > max_tokens:
-            sentences = re.split(r'(?<=[.!?])\s+', paragraph)
-            for sentence in sentences:
-                sentence_tokens = tokenizer.encode(sentence)
-                sentence_token_count = len(sentence_tokens)
-
-                # If adding this sentence would exceed the limit, start a new chunk
-                if current_chunk_tokens + sentence_token_count > max_tokens:
-                    if current_chunk:  # Only append if there's content
-                        chunks.append('\n\n'.join(current_chunk))
-                    current_chunk = [sentence]
-                    current_chunk_tokens = sentence_token_count
-                else:
-                    current_chunk.append(sentence)
-                    current_chunk_tokens += sentence_token_count
+    start_token = 0
+    start_byte = 0
+    while start_token < len(tokens):
+        limit_token = start_token + max_tokens
+        if limit_token >= len(tokens):
+            chunks.append(data[start_byte:].decode("utf-8"))
+            break
+
+        limit_byte = token_ends[limit_token - 1]
+        min_byte = token_ends[start_token + min_tokens - 1]
+        anchor_index = bisect.bisect_left(anchors, min_byte)
+        if anchor_index < len(anchors) and anchors[anchor_index] <= limit_byte:
+            cut = anchors[anchor_index]
         else:
-            # If adding this paragraph would exceed the limit, start a new chunk
-            if current_chunk_tokens + paragraph_token_count > max_tokens:
-                if current_chunk:  # Only append if there's content
-                    chunks.append('\n\n'.join(current_chunk))
-                current_chunk = [paragraph]
-                current_chunk_tokens = paragraph_token_count
-            else:
-                current_chunk.append(paragraph)
-                current_chunk_tokens += paragraph_token_count
-
-    # Add the last chunk if it has content
-    if current_chunk:
-        chunks.append('\n\n'.join(current_chunk))
+            cut = _last_boundary(paragraph_ends, start_byte, limit_byte) \
+                or _last_boundary(sentence_ends, start_byte, limit_byte) \
+                or limit_byte
+
+        # A token may end inside a multi-byte character; move the cut to a character start
+        while cut > start_byte and cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        if cut <= start_byte:
+            cut = limit_byte
+            while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+                cut += 1
+
+        chunks.append(data[start_byte:cut].decode("utf-8"))
+        start_byte = cut
+        # Tokens ending at or before the cut belong to this chunk
+        start_token = bisect.bisect_right(token_ends, cut)
 
     return chunks
 
-async def extract_text_from_pdf(file) -> str:
-    """Extract text from a PDF file"""
+async def iter_text_chunks(blocks: AsyncIterator[str], max_tokens: int = MAX_CHUNK_TOKENS) -> AsyncIterator[Tuple[str, bool]]:
+    """
+    Incrementally chunk text arriving in blocks (joined with newlines). A chunk is
+    yielded as soon as its token budget fills, paired with a flag telling whether it
+    is the last chunk of the document. Whitespace-only documents yield nothing.
+    """
+    tokenizer = get_tokenizer()
+    buffer_parts: List[str] = []
+    buffer_tokens = 0
+    # Tokenizing time across all blocks, recorded as one chunking stage
+    elapsed = 0.0
+
+    async for block in blocks:
+        started = time.perf_counter()
+        buffer_parts.append(block)
+        buffer_tokens += len(tokenizer.encode_ordinary(block))
+        if buffer_tokens <= max_tokens:
+            elapsed += time.perf_counter() - started
+            continue
+
+        chunks = chunk_text_by_tokens("\n".join(buffer_parts), max_tokens)
+        # Keep the trailing chunk open; it may still grow with the next block
+        buffer_parts = [chunks[-1]]
+        buffer_tokens = len(tokenizer.encode_ordinary(chunks[-1]))
+        elapsed += time.perf_counter() - started
+        for chunk in chunks[:-1]:
+            yield chunk, False
+
+    remaining = "\n".join(buffer_parts)
+    started = time.perf_counter()
+    chunks = chunk_text_by_tokens(remaining, max_tokens) if remaining.strip() else []
+    observe_stage("chunking", elapsed + time.perf_counter() - started)
+    for i, chunk in enumerate(chunks):
+        yield chunk, i == len(chunks) - 1
+
+async def spool_upload(file) -> Tuple[str, str, int]:
+    """
+    Stream an upload into a temporary file in fixed-size blocks while computing its
+    SHA-256 digest. Returns (temp file path, hex digest, size in bytes); the caller
+    removes the file. A named file lets worker processes open it by path.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    descriptor, path = tempfile.mkstemp(prefix="policygpt-", suffix=".pdf", dir=PDF_CONFIG["spool_dir"])
+    os.close(descriptor)
     try:
-        # Read file content directly from the uploaded file
-        content = await file.read()
+        async with aiofiles.open(path, "wb") as spool:
+            while True:
+                block = await file.read(PDF_CONFIG["read_block_size"])
+                if not block:
+                    break
+                if isinstance(block, str):
+                    block = block.encode("utf-8")
+                digest.update(block)
+                await spool.write(block)
+                size += len(block)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest(), size
 
-        if not content:
-            raise ValueError("Empty file content")
+async def extract_text_from_path(path: str, digest: Optional[str] = None) -> str:
+    """
+    Extract text from a PDF file on disk, using the digest-keyed extraction cache
+    when the file's SHA-256 digest is known
+    """
+    if digest:
+        cached_text = extraction_cache.get(digest)
+        if cached_text is not None:
+            logger.info("Extracted text found in cache")
+            return cached_text
 
-        # Run CPU-intensive PDF processing in thread pool
-        loop = asyncio.get_event_loop()
-        try:
-            text = await loop.run_in_executor(
-                executor,
-                _extract_text_from_buffer,
-                content
-            )
-            if not text.strip():
-                raise ValueError("No text extracted from PDF")
+    # Run CPU-intensive PDF processing in the configured thread or process pool
+    loop = asyncio.get_event_loop()
+    with stage_timer("extraction"):
+        if PDF_CONFIG["executor"] == "process":
+            text = await _extract_text_in_processes(path)
+        else:
+            text = await loop.run_in_executor(get_executor(), _extract_text_from_path, path)
 
-            return text
-        except Exception as e:
-            raise ValueError(f"Failed to process PDF content: {str(e)}")
+    if not text.strip():
+        raise ValueError("No text extracted from PDF")
 
-    except Exception as e:
-        logger.error(f"Error extracting text from PDF: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to extract text from PDF: {str(e)}"
-        )
\ No newline at end of file
+    if digest:
+        extraction_cache.set(digest, text)
+    return text
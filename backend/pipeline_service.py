@@ -0,0 +1,158 @@
+from fastapi import HTTPException
+import contextlib
+import logging
+import os
+from typing import AsyncIterator, List, Optional, Tuple
+from config import PROCESSING_CONFIG
+from pdf_service import spool_upload, extract_text_from_path, iter_pdf_text, iter_text_chunks, extraction_cache
+from cache_service import SingleFlight
+from openai_service import (
+    summarize_text, summarize_chunk_stream, summary_cache, summary_cache_key,
+    chunk_token_budget, map_cache_key, get_map_outputs, store_map_outputs, EventCallback
+)
+
+logger = logging.getLogger(__name__)
+
+# Concurrent uploads of the same PDF with the same prompt are processed once
+document_flight = SingleFlight("document")
+
+def _document_cache_key(digest: str, custom_prompt: Optional[str]) -> str:
+    """Summary cache key for a PDF identified by its SHA-256 digest, usable before extraction"""
+    return summary_cache_key(f"pdf-sha256:{digest}", custom_prompt)
+
+def _document_map_key(digest: str) -> str:
+    """Map-output cache key for a PDF identified by its SHA-256 digest"""
+    return map_cache_key(f"pdf-sha256:{digest}")
+
+async def extract_and_summarize(
+    file,
+    custom_prompt: Optional[str] = None,
+    on_event: Optional[EventCallback] = None
+) -> Tuple[str, str, Optional[List[Tuple[int, int]]], Optional[List[str]]]:
+    """
+    Extract text from an uploaded PDF and summarize it. Returns (text, summary,
+    chunk spans, chunk summaries): the (start, end) character offsets of the chunks
+    that were summarized and their map-phase summaries, both None when the document
+    was summarized with a single direct call.
+
+    When nothing is cached, extraction, chunking and summarization are pipelined:
+    pages are parsed in ranges, chunks are emitted as soon as their token budget
+    fills, and each chunk's map call starts while later pages are still being parsed.
+
+    An identical upload already in flight is joined instead of processed again; only
+    the first caller receives progress events, the others get the finished summary.
+    """
+    path, digest, size = await spool_upload(file)
+    key = _document_cache_key(digest, custom_prompt)
+    shared = key in document_flight
+    try:
+        # The shared call owns (and removes) the spooled file of the caller that started it
+        result = await document_flight.do(
+            key,
+            lambda: _extract_and_summarize(path, digest, size, custom_prompt, on_event)
+        )
+    finally:
+        if shared or key not in document_flight:
+            _remove(path)
+
+    if shared and on_event:
+        await on_event({"event": "summary_token", "text": result[1], "shared": True})
+    return result
+
+def _remove(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+async def _extract_and_summarize(
+    path: str,
+    digest: str,
+    size: int,
+    custom_prompt: Optional[str],
+    on_event: Optional[EventCallback]
+) -> Tuple[str, str, Optional[List[Tuple[int, int]]], Optional[List[str]]]:
+    """extract_and_summarize for a spooled upload; removes the spooled file when done"""
+    try:
+        if not size:
+            raise HTTPException(status_code=500, detail="Failed to extract text from PDF: Empty file content")
+
+        document_key = _document_cache_key(digest, custom_prompt)
+        cached_summary = summary_cache.get(document_key)
+        cached_text = extraction_cache.get(digest)
+        # Another prompt variant already ran the map pass; only the reduce step is left
+        cached_map = get_map_outputs(_document_map_key(digest)) is not None
+
+        if (
+            cached_summary is not None or cached_text is not None or cached_map
+            or not PROCESSING_CONFIG["pipeline_summarization"]
+        ):
+            # Cached documents skip straight to the (cached) stages
+            try:
+                text = cached_text if cached_text is not None else await extract_text_from_path(path, digest)
+            except Exception as e:
+                logger.error(f"Error extracting text from PDF: {e}")
+                raise HTTPException(status_code=500, detail=f"Failed to extract text from PDF: {str(e)}")
+            if on_event:
+                await on_event({"event": "extraction_done", "characters": len(text)})
+
+            if cached_summary is not None:
+                if on_event:
+                    await on_event({"event": "summary_token", "text": cached_summary, "cached": True})
+                summary = cached_summary
+            else:
+                summary = await summarize_text(text, custom_prompt, on_event=on_event)
+                summary_cache.set(document_key, summary)
+
+            map_outputs = get_map_outputs(map_cache_key(text))
+            if map_outputs is None:
+                return text, summary, None, None
+            return text, summary, [tuple(span) for span in map_outputs["spans"]], map_outputs["summaries"]
+
+        text_blocks = []
+        chunk_spans: List[Tuple[int, int]] = []
+
+        async def blocks() -> AsyncIterator[str]:
+            try:
+                async for block in iter_pdf_text(path):
+                    text_blocks.append(block)
+                    yield block
+            except Exception as e:
+                logger.error(f"Error extracting text from PDF: {e}")
+                raise HTTPException(status_code=500, detail=f"Failed to extract text from PDF: {str(e)}")
+            if on_event:
+                await on_event({"event": "extraction_done", "characters": len("\n".join(text_blocks))})
+
+        async def chunks_with_spans() -> AsyncIterator[Tuple[str, bool]]:
+            # Chunks concatenate back to the joined text, so offsets are running lengths
+            offset = 0
+            text_chunks = iter_text_chunks(blocks(), max_tokens=chunk_token_budget())
+            try:
+                async for chunk, is_last in text_chunks:
+                    chunk_spans.append((offset, offset + len(chunk)))
+                    offset += len(chunk)
+                    yield chunk, is_last
+            finally:
+                await text_chunks.aclose()
+
+        chunks = chunks_with_spans()
+        try:
+            summary, chunk_summaries = await summarize_chunk_stream(chunks, custom_prompt, on_event=on_event)
+        except HTTPException:
+            if not "\n".join(text_blocks).strip():
+                raise HTTPException(status_code=500, detail="Failed to extract text from PDF: No text extracted from PDF")
+            raise
+        finally:
+            await chunks.aclose()
+
+        text = "\n".join(text_blocks)
+
+        extraction_cache.set(digest, text)
+        summary_cache.set(summary_cache_key(text, custom_prompt), summary)
+        summary_cache.set(document_key, summary)
+        if not chunk_summaries:
+            return text, summary, None, None
+
+        store_map_outputs(map_cache_key(text), chunk_spans, chunk_summaries)
+        store_map_outputs(_document_map_key(digest), chunk_spans, chunk_summaries)
+        return text, summary, chunk_spans, chunk_summaries
+    finally:
+        _remove(path)
@@ -0,0 +1,220 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+from config import OPENAI_CONFIG
+from metrics_service import LLM_SEMAPHORE_WAITING, LLM_IN_FLIGHT, LLM_SEMAPHORE_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes for Azure OpenAI calls; lower values are admitted first
+LANES = {"interactive": 0, "bulk": 1}
+
+# Lane of the work being done: feedback and single-file uploads are interactive,
+# multi-file uploads and background jobs are bulk. Tasks inherit it when created.
+current_lane: contextvars.ContextVar[str] = contextvars.ContextVar("llm_lane", default="interactive")
+
+@contextmanager
+def llm_lane(lane: str) -> Iterator[None]:
+    """Schedule Azure OpenAI calls made inside the block in the given lane"""
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane: {lane}")
+    token = current_lane.set(lane)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+class TokenBucket:
+    """Refills capacity_per_minute units evenly over each minute, holding at most a minute's worth"""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = capacity_per_minute
+        self.available = float(capacity_per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (amounts above capacity wait for a full bucket)"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing * 60 / self.capacity)
+
+    def consume(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+class LocalBudget:
+    """
+    Tokens-per-minute and requests-per-minute budget of this process. A limit of 0
+    disables that bucket. The scheduler only talks to a budget through reserve(),
+    release() and pause(), so a budget shared between processes can replace it
+    (see set_budget and coordinator_service).
+    """
+
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.buckets: List[Tuple[TokenBucket, bool]] = []
+        if tokens_per_minute:
+            self.buckets.append((TokenBucket(tokens_per_minute), True))
+        if requests_per_minute:
+            self.buckets.append((TokenBucket(requests_per_minute), False))
+        self.paused_until = 0.0
+
+    async def reserve(self, tokens: int) -> float:
+        """
+        Take tokens and one request from the budget and return 0, or return the
+        seconds to wait before trying again without taking anything
+        """
+        return self.try_reserve(tokens)
+
+    async def release(self):
+        """Called when a call admitted by reserve() finishes; buckets refill over time instead"""
+
+    async def pause(self, seconds: float):
+        """Admit nothing for the given time, e.g. after a 429 with Retry-After"""
+        self.hold(seconds)
+
+    def try_reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        wait = max(
+            [self.paused_until - now]
+            + [bucket.wait_time(tokens if metered else 1, now) for bucket, metered in self.buckets]
+        )
+        if wait > 0:
+            return wait
+        for bucket, metered in self.buckets:
+            bucket.consume(tokens if metered else 1)
+        return 0.0
+
+    def hold(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class LLMScheduler:
+    """
+    Admits Azure OpenAI calls in priority order (lane, then arrival) while keeping
+    at most max_concurrent calls in flight and staying within the budget. Only the
+    head of the queue draws from the budget, so a large bulk request waiting for
+    tokens cannot be overtaken by later bulk requests, but interactive requests
+    that arrive meanwhile go ahead of it. The budget may be in another process, so
+    it is consulted without holding the lock; one reservation runs at a time.
+    """
+
+    def __init__(self, max_concurrent: int, budget):
+        self.max_concurrent = max_concurrent
+        self.budget = budget
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = asyncio.Condition()
+        self._reserving = False
+
+    async def _reserve_unlocked(self, tokens: int) -> float:
+        """Call budget.reserve with the lock released, so releases and arrivals are not blocked meanwhile"""
+        self._reserving = True
+        self._condition.release()
+        delay = None
+        try:
+            delay = await self.budget.reserve(tokens)
+            return delay
+        finally:
+            # Take the lock back even if cancelled, as Condition.wait does
+            cancelled = False
+            while True:
+                try:
+                    await self._condition.acquire()
+                    break
+                except asyncio.CancelledError:
+                    cancelled = True
+            self._reserving = False
+            self._condition.notify_all()
+            if cancelled:
+                if delay is not None and delay <= 0:
+                    # The call will not be made; hand back the slot it reserved
+                    await self.budget.release()
+                raise asyncio.CancelledError
+
+    async def acquire(self, tokens: int, lane: Optional[str] = None):
+        """Wait until a call estimated at tokens may be sent"""
+        entry = (LANES[lane or current_lane.get()], next(self._sequence))
+        queued_at = time.perf_counter()
+        LLM_SEMAPHORE_WAITING.inc()
+        try:
+            async with self._condition:
+                heapq.heappush(self._waiters, entry)
+                try:
+                    while True:
+                        delay = None
+                        if (
+                            self._waiters[0] == entry and not self._reserving
+                            and self.in_flight < self.max_concurrent
+                        ):
+                            # No other call can be admitted while this reservation runs,
+                            # so the slot is still free when it returns
+                            delay = await self._reserve_unlocked(tokens)
+                            if delay <= 0:
+                                break
+                        try:
+                            await asyncio.wait_for(self._condition.wait(), delay)
+                        except asyncio.TimeoutError:
+                            pass
+                except BaseException:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._condition.notify_all()
+                    raise
+
+                # A call that arrived during the reservation may now be at the head
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self.in_flight += 1
+                # The next waiter may be admissible too
+                self._condition.notify_all()
+        finally:
+            LLM_SEMAPHORE_WAITING.dec()
+        LLM_SEMAPHORE_WAIT.observe(time.perf_counter() - queued_at)
+        LLM_IN_FLIGHT.inc()
+
+    async def release(self):
+        """Free the slot of a call that finished"""
+        LLM_IN_FLIGHT.dec()
+        await self.budget.release()
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def throttle(self, seconds: float):
+        """Hold back every lane after the service rate limited a call"""
+        await self.budget.pause(seconds)
+
+scheduler = LLMScheduler(
+    OPENAI_CONFIG["max_concurrent_calls"],
+    LocalBudget(OPENAI_CONFIG["tokens_per_minute"], OPENAI_CONFIG["requests_per_minute"])
+)
+
+def set_budget(budget):
+    """Replace the scheduler's budget, e.g. with one shared by several worker processes"""
+    scheduler.budget = budget
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Seconds to wait before retrying: the Retry-After (or retry-after-ms) header when
+    the service sent one, else exponential backoff from OPENAI_CONFIG["retry_base_delay"]
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return min(float(value) * scale, OPENAI_CONFIG["retry_max_delay"])
+        except ValueError:
+            # HTTP-date values are not used by Azure OpenAI; fall back to backoff
+            break
+    return min(OPENAI_CONFIG["retry_base_delay"] * 2 ** attempt, OPENAI_CONFIG["retry_max_delay"])
@@ -1,5 +1,9 @@
 import uvicorn
 import logging
+import os
+import shutil
+from config import SERVER_CONFIG
+from coordinator_service import start_coordinator
 
 # Configure logging
 logging.basicConfig(
@@ -9,11 +13,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
-    logger.info("Starting PDF Processing API server...")
-    uvicorn.run(
-        "main:app",
-        host="127.0.0.1",
-        port=8002,  # Changed port again to avoid conflict
-        log_level="info",
-        reload=False  # Disable reload for production use
-    )
\ No newline at end of file
+    workers = SERVER_CONFIG["workers"]
+    coordinator = None
+    if workers > 1:
+        # Workers share one Azure OpenAI concurrency and rate budget through the coordinator
+        coordinator = start_coordinator()
+        # Workers write their metrics to a shared directory, emptied of a previous run's values
+        metrics_dir = os.path.abspath(SERVER_CONFIG["metrics_dir"])
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    logger.info(f"Starting PDF Processing API server with {workers} worker(s)...")
+    try:
+        uvicorn.run(
+            "main:app",
+            host=SERVER_CONFIG["host"],
+            port=SERVER_CONFIG["port"],
+            workers=workers,
+            log_level="info",
+            reload=False  # Disable reload for production use
+        )
+    finally:
+        if coordinator is not None:
+            coordinator.shutdown()
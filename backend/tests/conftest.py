@@ -0,0 +1,83 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app modules read their configuration at import time; point them at throwaway
+# state and at endpoints that are never contacted (tests replace the upstream calls)
+_state_dir = tempfile.mkdtemp(prefix="policygpt-tests-")
+os.environ.update(
+    OPENAI_API_KEY="test",
+    OPENAI_API_BASE="https://openai.invalid",
+    OPENAI_MODEL_NAME="gpt-4o",
+    AZURE_TRANSLATOR_KEY="test",
+    AZURE_TRANSLATOR_ENDPOINT="https://translator.invalid",
+    AZURE_TRANSLATOR_REGION="test",
+    CACHE_DB_PATH="",
+    JOB_DB_PATH=os.path.join(_state_dir, "jobs.db"),
+    JOB_STORAGE_DIR=os.path.join(_state_dir, "jobs"),
+    PROFILING_ENABLED="false",
+    PROFILING_OUTPUT_DIR=os.path.join(_state_dir, "profiles"),
+    WARMUP_ON_STARTUP="false",
+    SERVER_WORKERS="1"
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit_service
+from openai_service import summary_cache, map_cache, chunk_cache
+from translator_service import translation_cache
+from pdf_service import extraction_cache
+from document_service import document_store
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """Empty caches with zeroed counters, and a scheduler whose lock is not bound to an earlier test's event loop"""
+    for cache in (summary_cache, map_cache, chunk_cache, translation_cache, extraction_cache, document_store):
+        cache.clear()
+        for counter in ("memory_hits", "disk_hits", "misses"):
+            monkeypatch.setattr(cache, counter, 0)
+    monkeypatch.setattr(rate_limit_service.scheduler, "_condition", asyncio.Condition())
+    monkeypatch.setattr(rate_limit_service.scheduler, "_waiters", [])
+    monkeypatch.setattr(rate_limit_service.scheduler, "in_flight", 0)
+
+class FakeLLM:
+    """Stands in for openai_service._create_completion and records every call"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        # Words appended to every output, to make outputs take up tokens
+        self.padding = 0
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+
+    def kinds(self):
+        return [kind for kind, _ in self.calls]
+
+    async def __call__(self, system_prompt, user_content, max_tokens, temperature, on_token=None, kind="summary"):
+        self.calls.append((kind, user_content))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        content = f"{kind} output {len(self.calls)}" + " detail" * self.padding
+        if on_token is not None:
+            await on_token(content)
+        return content
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    import openai_service
+    llm = FakeLLM(delay=0.01)
+    monkeypatch.setattr(openai_service, "_create_completion", llm)
+    return llm
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Cap document tokens per request so small test documents are split into several chunks"""
+    import openai_service
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "max_chunk_tokens", 400)
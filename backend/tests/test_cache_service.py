@@ -0,0 +1,99 @@
+import time
+
+import cache_service
+from cache_service import MemoryLRUCache, SQLiteCache, TieredCache, create_cache, make_cache_key
+
+def test_cache_key_covers_every_part():
+    key = make_cache_key("summary", "gpt-4o", 0.7, 1000, "", "text")
+
+    assert key == make_cache_key("summary", "gpt-4o", 0.7, 1000, "", "text")
+    assert key != make_cache_key("summary", "gpt-4o", 0.5, 1000, "", "text")
+    assert key != make_cache_key("summary", "gpt-4o", 0.7, 1000, "prompt", "text")
+
+def test_memory_tier_evicts_least_recently_used_entries():
+    cache = MemoryLRUCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+    assert cache.evictions == 1
+
+def test_memory_tier_expires_entries_after_ttl(monkeypatch):
+    cache = MemoryLRUCache(ttl_seconds=60)
+    cache.set("a", "1")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_disk_tier_survives_a_restart_and_is_bounded(tmp_path):
+    path = str(tmp_path / "cache.db")
+    disk = SQLiteCache(path, "summary_cache", max_entries=3)
+    for i in range(5):
+        disk.set(f"key-{i}", f"value-{i}")
+    disk.close()
+
+    reopened = SQLiteCache(path, "summary_cache", max_entries=3)
+    assert len(reopened) == 3
+    assert reopened.get("key-4") == "value-4"
+    assert reopened.get("key-0") is None
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"), "summary_cache")
+    disk.set("key", "summary")
+    cache = TieredCache(MemoryLRUCache(), disk)
+
+    assert cache.get("key") == "summary"
+    assert cache.get("key") == "summary"
+    assert cache.get("other") is None
+
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == round(2 / 3, 4)
+    assert stats["disk_entries"] == 1
+
+def test_memory_tier_is_bounded_by_utf8_bytes():
+    cache = MemoryLRUCache(max_bytes=20)
+    # Eleven characters, but 22 bytes in UTF-8
+    cache.set("value", "ü" * 11)
+    assert cache.get("value") is None
+    assert cache.size == 0
+
+    cache.set("a", "ü" * 5)
+    cache.set("b", "ü" * 5)
+    assert cache.size == 20
+    cache.set("c", "x")
+    assert cache.get("a") is None
+    assert cache.size == 11
+
+def test_stores_without_a_memory_tier_see_each_others_updates(tmp_path, monkeypatch):
+    monkeypatch.setitem(cache_service.CACHE_CONFIG, "db_path", str(tmp_path / "cache.db"))
+    # Two worker processes holding the same document store
+    first = create_cache("document", memory_tier=False)
+    second = create_cache("document", memory_tier=False)
+
+    first.set("doc", "original summary")
+    assert second.get("doc") == "original summary"
+    second.set("doc", "refined summary")
+    assert first.get("doc") == "refined summary"
+    assert first.memory is None
+    assert first.stats()["memory_entries"] == 0
+
+    # A memory tier would have kept serving the first worker's copy
+    cached = create_cache("document")
+    cached.get("doc")
+    second.set("doc", "refined again")
+    assert cached.get("doc") == "refined summary"
+
+def test_memory_tier_is_kept_without_a_persistent_tier(monkeypatch):
+    monkeypatch.setitem(cache_service.CACHE_CONFIG, "db_path", "")
+    store = create_cache("document", memory_tier=False)
+
+    store.set("doc", "summary")
+    assert store.get("doc") == "summary"
+    assert store.disk is None
@@ -0,0 +1,33 @@
+import asyncio
+
+import openai_service
+from benchmarks.chunking_benchmark import synthetic_policy
+from pdf_service import chunk_text_by_tokens
+
+# Standard terms a carrier ships in every policy, between policy-specific pages
+SHARED_TERMS = synthetic_policy(20, seed=7)
+
+def policy(holder, seed):
+    return (
+        f"Policy schedule for {holder}.\n\n" + synthetic_policy(2, seed=seed)
+        + "\n\n" + SHARED_TERMS
+        + f"\n\nEndorsements agreed with {holder}.\n\n" + synthetic_policy(1, seed=seed + 1)
+    )
+
+def test_documents_sharing_sections_reuse_chunk_summaries(fake_llm, monkeypatch):
+    # Default map chunk size on a model whose context window is smaller than the documents
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "model", "gpt-4")
+    first, second = policy("Asha Rao", seed=20), policy("Ravi Menon", seed=30)
+    second_chunks = chunk_text_by_tokens(second, max_tokens=openai_service.chunk_token_budget())
+    assert len(second_chunks) > 4
+
+    asyncio.run(openai_service.summarize_text(first))
+    calls_before = fake_llm.kinds().count("map")
+    asyncio.run(openai_service.summarize_text(second))
+    second_map_calls = fake_llm.kinds().count("map") - calls_before
+
+    # Chunks inside the shared terms are cut identically in both documents
+    shared_chunks = set(chunk_text_by_tokens(first, max_tokens=openai_service.chunk_token_budget())) & set(second_chunks)
+    assert len(shared_chunks) >= 2
+    assert second_map_calls == len(second_chunks) - len(shared_chunks)
+    assert openai_service.chunk_cache.stats()["hits"] >= len(shared_chunks)
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from coordinator_service import SLOT_POLL_SECONDS, SharedBudget
+
+def test_slots_are_shared_by_all_workers():
+    budget = SharedBudget(max_concurrent=2, tokens_per_minute=0, requests_per_minute=0)
+    worker = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert budget.reserve(os.getpid(), 10) == 0.0
+        assert budget.reserve(worker.pid, 10) == 0.0
+        # Both holders are alive, so nothing is reclaimed
+        assert budget.reserve(os.getppid(), 10) == SLOT_POLL_SECONDS
+
+        budget.release(os.getpid())
+        assert budget.reserve(os.getppid(), 10) == 0.0
+        assert budget.leases == {worker.pid: 1, os.getppid(): 1}
+    finally:
+        worker.kill()
+        worker.wait()
+
+def test_rate_limits_and_pauses_apply_to_every_worker():
+    budget = SharedBudget(max_concurrent=10, tokens_per_minute=1000, requests_per_minute=0)
+
+    assert budget.reserve(os.getpid(), 800) == 0.0
+    assert budget.reserve(os.getppid(), 800) > 0
+    budget.pause(5)
+    assert budget.reserve(os.getppid(), 1) >= 4
+
+def test_slots_of_exited_workers_are_reclaimed():
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    budget = SharedBudget(max_concurrent=2, tokens_per_minute=0, requests_per_minute=0)
+    budget.reserve(exited.pid, 10)
+    budget.reserve(exited.pid, 10)
+
+    assert budget.reserve(os.getpid(), 10) == 0.0
+    assert exited.pid not in budget.leases
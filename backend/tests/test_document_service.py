@@ -0,0 +1,79 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from document_service import save_document, get_document, get_document_chunks, update_document
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+@pytest.fixture
+def refinements(monkeypatch):
+    """Replace refinement with a fake that records what it was given"""
+    calls = []
+
+    async def refine_summary_with_feedback(original_text, original_summary, feedback_type, feedback_text,
+                                           chunks=None, chunk_summaries=None):
+        calls.append({
+            "text": original_text,
+            "summary": original_summary,
+            "chunks": chunks,
+            "chunk_summaries": chunk_summaries
+        })
+        return f"refined {len(calls)}"
+
+    monkeypatch.setattr(main, "refine_summary_with_feedback", refine_summary_with_feedback)
+    return calls
+
+def test_documents_keep_their_text_chunks_and_summaries():
+    text = "First section. Second section."
+    document_id = save_document("policy.pdf", text, "summary", [(0, 15), (15, len(text))], ["one", "two"])
+
+    document = get_document(document_id)
+    assert document["filename"] == "policy.pdf"
+    assert document["summaries"] == {"original": "summary"}
+    assert get_document_chunks(document) == ["First section. ", "Second section."]
+
+    assert update_document(document_id, summaries={"original": "better"})
+    assert get_document(document_id)["summaries"] == {"original": "better"}
+    assert get_document("missing") is None
+    assert not update_document("missing", summaries={})
+
+def test_feedback_refines_the_stored_document_by_id(client, refinements):
+    text = "Section A covers hospital stays. Section B covers dental care."
+    document_id = save_document("policy.pdf", text, "first summary", [(0, 33), (33, len(text))], ["a", "b"])
+
+    form = {"summary_id": "s1", "feedback_type": "unclear", "feedback_text": "simpler", "document_id": document_id}
+    first = client.post("/feedback", data=form)
+    second = client.post("/feedback", data=form)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json()["summaries"]["original"] == "refined 1"
+    assert refinements[0] == {
+        "text": text,
+        "summary": "first summary",
+        "chunks": ["Section A covers hospital stays. ", "Section B covers dental care."],
+        "chunk_summaries": ["a", "b"]
+    }
+    # Later feedback builds on the previous refinement
+    assert refinements[1]["summary"] == "refined 1"
+    assert get_document(document_id)["summaries"] == {"original": "refined 2"}
+
+def test_feedback_for_an_unknown_document_asks_for_a_new_upload(client, refinements):
+    response = client.post("/feedback", data={"summary_id": "s1", "feedback_type": "unclear", "document_id": "gone"})
+
+    assert response.status_code == 404
+    assert "upload it again" in response.json()["detail"]
+    assert refinements == []
+
+def test_feedback_still_accepts_the_full_text(client, refinements):
+    response = client.post("/feedback", data={
+        "summary_id": "s1",
+        "feedback_type": "inaccurate",
+        "original_text": "Full text",
+        "original_summary": "Old summary"
+    })
+
+    assert response.json()["summaries"]["original"] == "refined 1"
+    assert refinements[0]["text"] == "Full text" and refinements[0]["chunks"] is None
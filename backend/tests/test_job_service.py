@@ -0,0 +1,171 @@
+import asyncio
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from starlette.datastructures import UploadFile
+
+import job_service
+
+@pytest.fixture
+def job_config(tmp_path, monkeypatch):
+    monkeypatch.setitem(job_service.JOB_CONFIG, "db_path", str(tmp_path / "jobs.db"))
+    monkeypatch.setitem(job_service.JOB_CONFIG, "storage_dir", str(tmp_path / "files"))
+    return tmp_path
+
+def uploads(*names):
+    return [UploadFile(file=io.BytesIO(f"content of {name}".encode()), filename=name) for name in names]
+
+async def wait_for_status(job_id, *statuses):
+    for _ in range(200):
+        job = job_service.get_job(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stayed {job['status']}")
+
+def test_job_files_are_processed_in_the_background(job_config):
+    processed = []
+
+    async def processor(params, path, filename):
+        with open(path, "rb") as stored:
+            processed.append((params["custom_prompt"], stored.read()))
+        return {"filename": filename, "summary": f"summary of {filename}"}
+
+    async def run():
+        await job_service.start_workers(processor)
+        try:
+            job_id = await job_service.submit_job(uploads("a.pdf", "b.pdf"), {"custom_prompt": "prompt"})
+            assert job_service.get_job(job_id)["progress"] == {"completed_files": 0, "total_files": 2}
+            return job_id, await wait_for_status(job_id, job_service.COMPLETED, job_service.FAILED)
+        finally:
+            await job_service.stop_workers()
+
+    job_id, job = asyncio.run(run())
+
+    assert job["status"] == job_service.COMPLETED
+    assert job["progress"] == {"completed_files": 2, "total_files": 2}
+    assert [result["summary"] for result in job["results"]] == ["summary of a.pdf", "summary of b.pdf"]
+    assert sorted(processed) == [("prompt", b"content of a.pdf"), ("prompt", b"content of b.pdf")]
+    # Stored uploads are removed once the job has finished
+    assert not os.path.exists(os.path.join(job_config, "files", job_id))
+
+def test_failed_file_fails_the_job(job_config):
+    async def processor(params, path, filename):
+        raise RuntimeError("extraction failed")
+
+    async def run():
+        await job_service.start_workers(processor)
+        try:
+            job_id = await job_service.submit_job(uploads("a.pdf"), {})
+            return await wait_for_status(job_id, job_service.COMPLETED, job_service.FAILED)
+        finally:
+            await job_service.stop_workers()
+
+    job = asyncio.run(run())
+
+    assert job["status"] == job_service.FAILED
+    assert job["error"] == "extraction failed"
+
+def test_interrupted_job_resumes_after_a_restart_without_redoing_finished_files(job_config):
+    processed = []
+
+    async def run():
+        blocker = asyncio.Event()
+
+        async def slow_processor(params, path, filename):
+            if filename == "b.pdf":
+                await blocker.wait()
+            return {"filename": filename}
+
+        await job_service.start_workers(slow_processor)
+        job_id = await job_service.submit_job(uploads("a.pdf", "b.pdf"), {})
+        for _ in range(200):
+            if job_service.get_job(job_id)["progress"]["completed_files"] == 1:
+                break
+            await asyncio.sleep(0.01)
+        # Shut down while b.pdf is still being processed
+        await job_service.stop_workers()
+
+        async def processor(params, path, filename):
+            processed.append(filename)
+            return {"filename": filename}
+
+        await job_service.start_workers(processor)
+        try:
+            return await wait_for_status(job_id, job_service.COMPLETED, job_service.FAILED)
+        finally:
+            await job_service.stop_workers()
+
+    job = asyncio.run(run())
+
+    assert job["status"] == job_service.COMPLETED
+    assert processed == ["b.pdf"]
+    assert [result["filename"] for result in job["results"]] == ["a.pdf", "b.pdf"]
+
+def test_only_jobs_of_exited_workers_are_taken_over(job_config):
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    running = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    store = job_service.JobStore(str(job_config / "jobs.db"))
+    try:
+        owners = {"orphaned": exited.pid, "busy": running.pid, "legacy": None, "own": os.getpid()}
+        for job_id, owner in owners.items():
+            store.create(job_id, {}, [])
+            store._conn.execute("UPDATE jobs SET owner = ? WHERE id = ?", (owner, job_id))
+        store.create("done", {}, [])
+        store.set_status("done", job_service.COMPLETED)
+        store._conn.execute("UPDATE jobs SET owner = ? WHERE id = 'done'", (exited.pid,))
+
+        assert store.claim_unfinished(os.getpid()) == ["orphaned", "legacy", "own"]
+        # Another starting worker finds nothing left to take over
+        assert store.claim_unfinished(os.getpid() + 1) == []
+    finally:
+        running.kill()
+        running.wait()
+        store.close()
+
+def test_a_worker_resumes_the_jobs_of_a_worker_that_died(job_config):
+    store = job_service.JobStore(str(job_config / "jobs.db"))
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    os.makedirs(job_config / "files" / "job", exist_ok=True)
+    path = str(job_config / "files" / "job" / "0.upload")
+    with open(path, "wb") as stored:
+        stored.write(b"content")
+    store.create("job", {}, [{"filename": "a.pdf", "path": path}])
+    store.set_status("job", job_service.RUNNING)
+    store._conn.execute("UPDATE jobs SET owner = ?", (exited.pid,))
+    store.close()
+
+    async def processor(params, path, filename):
+        return {"filename": filename}
+
+    async def run():
+        await job_service.start_workers(processor)
+        try:
+            return await wait_for_status("job", job_service.COMPLETED, job_service.FAILED)
+        finally:
+            await job_service.stop_workers()
+
+    assert asyncio.run(run())["status"] == job_service.COMPLETED
+
+def test_job_stores_from_before_owners_are_upgraded(job_config):
+    path = str(job_config / "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, "
+        "files TEXT NOT NULL, results TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    connection.execute("INSERT INTO jobs VALUES ('old', 'queued', '{}', '[]', '[]', NULL, 1, 1)")
+    connection.commit()
+    connection.close()
+
+    store = job_service.JobStore(path)
+    try:
+        assert store.claim_unfinished(os.getpid()) == ["old"]
+    finally:
+        store.close()
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+import openai_service
+import translator_service
+from benchmarks.load_benchmark import StubServers, build_corpus, free_port, percentile
+
+def stub_args(**overrides):
+    args = dict(
+        seed=1, latency=0.0, prompt_token_latency=0.0, completion_token_latency=0.0, completion_tokens=12,
+        tpm=0, error_rate=0.0, retry_after=0.05, translator_latency=0.0, translator_character_latency=0.0
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """Run the benchmark's Azure stand-ins and point the services at them"""
+    def serve(args, scenario):
+        async def run():
+            servers = StubServers(args)
+            url = await servers.start(free_port())
+            monkeypatch.setitem(openai_service.OPENAI_CONFIG, "azure_endpoint", url)
+            monkeypatch.setitem(openai_service.OPENAI_CONFIG, "retry_base_delay", 0.01)
+            monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "endpoint", url)
+            monkeypatch.setattr(openai_service, "client", None)
+            try:
+                return await scenario(), servers.counts
+            finally:
+                await openai_service.close_client()
+                await translator_service.cleanup()
+                await servers.stop()
+        return asyncio.run(run())
+    return serve
+
+def test_percentile_uses_the_nearest_rank():
+    values = [5, 1, 4, 2, 3, 10, 9, 8, 7, 6]
+
+    assert percentile(values, 0.5) == 5
+    assert percentile(values, 0.95) == 10
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+def test_corpus_has_distinct_readable_pdfs_of_the_given_sizes():
+    corpus = build_corpus([1, 3], documents=3, seed=5)
+
+    assert [name for name, _ in corpus] == ["policy-0-1p.pdf", "policy-1-3p.pdf", "policy-2-1p.pdf"]
+    pages = [PdfReader(io.BytesIO(pdf)).pages for _, pdf in corpus]
+    assert [len(document) for document in pages] == [1, 3, 1]
+    assert "Page 1 of 3" in pages[1][0].extract_text()
+    assert corpus[0][1] != corpus[2][1]
+
+def test_stub_serves_plain_and_streamed_completions_and_translations(stubs):
+    deltas = []
+
+    async def on_token(delta):
+        deltas.append(delta)
+
+    async def scenario():
+        plain = await openai_service._create_completion("system", "summarize this", 100, 0.3)
+        streamed = await openai_service._create_completion("system", "summarize this", 100, 0.3, on_token=on_token)
+        translated = await translator_service.translate_texts(["Hello."], ["hi", "ta"])
+        return plain, streamed, translated
+
+    (plain, streamed, translated), counts = stubs(stub_args(), scenario)
+
+    assert len(plain.split()) == len(streamed.split()) == 12
+    assert "".join(deltas) == streamed
+    assert translated == {"hi": ["[hi] Hello."], "ta": ["[ta] Hello."]}
+    assert counts["chat_completions"] == 2 and counts["chat_completions_streamed"] == 1
+    assert counts["translator_requests"] == 1 and counts["translator_characters"] == 12
+
+def test_stub_rate_limits_and_the_client_retries(stubs):
+    async def scenario():
+        return await openai_service._create_completion("system", "summarize this", 100, 0.3)
+
+    content, counts = stubs(stub_args(error_rate=0.6, seed=3), scenario)
+
+    assert content.startswith("Summary of")
+    assert counts["chat_rate_limited"] >= 1
+    assert counts["chat_completions"] == 1
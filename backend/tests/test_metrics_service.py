@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import main
+from openai_service import summary_cache
+from timing_service import stage_timer
+
+def test_metrics_endpoint_exposes_stage_latency_and_cache_counters():
+    with stage_timer("chunking"):
+        pass
+    summary_cache.set("key", "value")
+    summary_cache.get("key")
+    summary_cache.get("missing")
+
+    response = TestClient(main.app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'policygpt_stage_duration_seconds_count{stage="chunking"}' in body
+    for cache in ("summary", "map", "chunk", "translation", "extraction", "document"):
+        assert f'policygpt_cache_entries{{cache="{cache}",tier="memory"}}' in body
+    assert REGISTRY.get_sample_value("policygpt_cache_hits_total", {"cache": "summary", "tier": "memory"}) == 1
+    assert REGISTRY.get_sample_value("policygpt_cache_misses_total", {"cache": "summary"}) == 1
+    assert REGISTRY.get_sample_value("policygpt_cache_memory_size", {"cache": "summary"}) == len("value")
+
+WORKER = """
+import metrics_service
+metrics_service.TRANSLATOR_CHARACTERS.inc(100)
+metrics_service.LLM_IN_FLIGHT.inc()
+"""
+
+SCRAPE = """
+from prometheus_client import generate_latest
+import metrics_service
+print(generate_latest(metrics_service.metrics_registry()).decode())
+"""
+
+def test_metrics_of_all_workers_are_aggregated(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+
+    def run(code):
+        return subprocess.run(
+            [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+        ).stdout
+
+    # Two worker processes record metrics, one of them shuts down cleanly, a third serves the scrape
+    run(WORKER + "metrics_service.mark_process_dead()\n")
+    run(WORKER)
+    body = run(SCRAPE)
+
+    assert "policygpt_translator_characters_total 200.0" in body
+    # Live gauges leave out the worker that shut down
+    assert "policygpt_llm_in_flight 1.0" in body
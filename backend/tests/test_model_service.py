@@ -0,0 +1,56 @@
+import pytest
+
+import model_service
+from config import MODEL_REGISTRY, DEFAULT_MODEL_PROFILE
+from model_service import count_prompt_tokens, get_model_profile, input_token_budget, output_token_limit
+
+@pytest.fixture
+def model(monkeypatch):
+    def use(name, max_chunk_tokens=None):
+        monkeypatch.setitem(model_service.OPENAI_CONFIG, "model", name)
+        monkeypatch.setitem(model_service.OPENAI_CONFIG, "max_chunk_tokens", max_chunk_tokens)
+    return use
+
+def test_profiles_are_found_by_name_then_longest_prefix():
+    assert get_model_profile("gpt-4-32k") is MODEL_REGISTRY["gpt-4-32k"]
+    # Versioned deployments match the longest registered prefix
+    assert get_model_profile("gpt-4o-mini-2024-07-18") is MODEL_REGISTRY["gpt-4o-mini"]
+    assert get_model_profile("gpt-4-0613") is MODEL_REGISTRY["gpt-4"]
+    assert get_model_profile("my-custom-deployment") is DEFAULT_MODEL_PROFILE
+
+def test_gpt_35_turbo_defaults_to_the_4k_window_of_its_older_versions():
+    assert get_model_profile("gpt-35-turbo")["context_window"] == 4096
+    assert get_model_profile("gpt-35-turbo-0613")["context_window"] == 4096
+    assert get_model_profile("gpt-35-turbo-0125")["context_window"] == 16385
+    assert get_model_profile("gpt-35-turbo-16k")["context_window"] == 16385
+
+def test_configured_limits_override_the_registry(model, monkeypatch):
+    model("gpt-35-turbo")
+    monkeypatch.setitem(model_service.OPENAI_CONFIG, "context_window", 16385)
+
+    profile = get_model_profile()
+
+    assert profile["context_window"] == 16385
+    assert profile["encoding"] == "cl100k_base"
+    assert MODEL_REGISTRY["gpt-35-turbo"]["context_window"] == 4096
+
+def test_budget_is_what_the_context_window_leaves_for_text(model):
+    model("gpt-4")
+
+    budget = input_token_budget("Summarize.", "Text:\n", 500)
+
+    expected = 8192 - 500 - count_prompt_tokens("Summarize.", "Text:\n") - model_service.SAFETY_MARGIN_TOKENS
+    assert budget == expected
+    assert input_token_budget("Summarize.", "Text:\n", 2000) == expected - 1500
+
+def test_output_and_configured_chunk_limits_apply(model):
+    model("gpt-4o", max_chunk_tokens=3000)
+
+    assert output_token_limit(100000) == 16384
+    assert input_token_budget("Summarize.", "Text:\n", 500) == 3000
+
+def test_a_prompt_that_fills_the_context_window_is_rejected(model):
+    model("gpt-4")
+
+    with pytest.raises(ValueError):
+        input_token_budget("word " * 9000, "Text:\n", 500)
@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import openai_service
+from prometheus_client import REGISTRY
+
+class FakeCompletions:
+    """chat.completions of the Azure OpenAI client; each call pops the next scripted outcome"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if request["stream"]:
+            return self._stream(outcome)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+        )
+
+    async def _stream(self, text):
+        # Azure sends a first chunk without choices carrying content filter results
+        yield SimpleNamespace(choices=[])
+        for word in text.split(" "):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+@pytest.fixture
+def completions(monkeypatch):
+    def install(*outcomes):
+        fake = FakeCompletions(outcomes)
+        monkeypatch.setattr(openai_service, "client", SimpleNamespace(chat=SimpleNamespace(completions=fake)))
+        return fake
+    return install
+
+def test_completion_awaits_the_shared_async_client(completions):
+    fake = completions("The policy covers fire.")
+
+    content = asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3))
+
+    assert content == "The policy covers fire."
+    request = fake.requests[0]
+    assert request["messages"] == [{"role": "system", "content": "system"}, {"role": "user", "content": "user text"}]
+    assert (request["max_tokens"], request["temperature"], request["stream"]) == (500, 0.3, False)
+
+def test_completion_outcome_and_usage_are_counted(completions):
+    completions("Theft is covered.")
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before = {
+        "requests": sample("policygpt_llm_requests_total", kind="map", outcome="success"),
+        "prompt": sample("policygpt_llm_tokens_total", kind="map", type="prompt"),
+        "completion": sample("policygpt_llm_tokens_total", kind="map", type="completion")
+    }
+
+    asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3, kind="map"))
+
+    assert sample("policygpt_llm_requests_total", kind="map", outcome="success") == before["requests"] + 1
+    assert sample("policygpt_llm_tokens_total", kind="map", type="prompt") == before["prompt"] + 10
+    assert sample("policygpt_llm_tokens_total", kind="map", type="completion") == before["completion"] + 5
+
+def test_streamed_completion_forwards_each_delta(completions):
+    completions("Flood damage is excluded.")
+    deltas = []
+
+    async def on_token(delta):
+        deltas.append(delta)
+
+    content = asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3, on_token=on_token))
+
+    assert deltas == ["Flood ", "damage ", "is ", "excluded. "]
+    assert content == "".join(deltas)
+
+def test_client_is_created_once_and_closed_on_shutdown(monkeypatch):
+    monkeypatch.setattr(openai_service, "client", None)
+
+    async def use_client():
+        first = openai_service.get_client()
+        assert openai_service.get_client() is first
+        await openai_service.close_client()
+        assert openai_service.client is None
+
+    asyncio.run(use_client())
+
+def status_error(error_class, status):
+    request = httpx.Request("POST", "https://openai.invalid/chat/completions")
+    return error_class(f"status {status}", response=httpx.Response(status, request=request), body=None)
+
+@pytest.mark.parametrize("error", [
+    lambda: status_error(openai.InternalServerError, 503),
+    lambda: status_error(openai.APIStatusError, 408),
+    lambda: status_error(openai.APIStatusError, 409),
+    lambda: openai.APITimeoutError(httpx.Request("POST", "https://openai.invalid/chat/completions")),
+])
+def test_transient_errors_are_retried_after_a_backoff(completions, monkeypatch, error):
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "retry_base_delay", 0.001)
+    fake = completions(error(), error(), "Recovered.")
+
+    content = asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3))
+
+    assert content == "Recovered."
+    assert len(fake.requests) == 3
+
+def test_client_errors_and_exhausted_retries_are_raised(completions, monkeypatch):
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "retry_base_delay", 0.001)
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "max_retries", 1)
+
+    fake = completions(status_error(openai.BadRequestError, 400), "unused")
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3))
+    assert len(fake.requests) == 1
+
+    fake = completions(status_error(openai.InternalServerError, 500), status_error(openai.InternalServerError, 502))
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(openai_service._create_completion("system", "user text", 500, 0.3))
+    assert len(fake.requests) == 2
+    assert openai_service.scheduler.in_flight == 0
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+import pdf_service
+from benchmarks.chunking_benchmark import run_case, synthetic_policy
+from benchmarks.load_benchmark import make_pdf
+from model_service import count_tokens
+
+def page_lines(page):
+    return [f"Page {page + 1} clause {line}: the insurer pays hospital costs." for line in range(5)]
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "policy.pdf"
+    path.write_bytes(make_pdf([page_lines(page) for page in range(7)]))
+    return str(path)
+
+@pytest.fixture
+def executor(monkeypatch):
+    """Select the extraction executor mode for a test and shut its pool down afterwards"""
+    def use(mode, pages_per_task=2):
+        pdf_service.shutdown_executor()
+        monkeypatch.setitem(pdf_service.PDF_CONFIG, "executor", mode)
+        monkeypatch.setitem(pdf_service.PDF_CONFIG, "max_workers", 2)
+        monkeypatch.setitem(pdf_service.PDF_CONFIG, "pages_per_task", pages_per_task)
+    yield use
+    pdf_service.shutdown_executor()
+
+def test_page_ranges_cover_every_page_once():
+    assert pdf_service._page_ranges(7, 3) == [(0, 3), (3, 6), (6, 7)]
+    assert pdf_service._page_ranges(6, 3) == [(0, 3), (3, 6)]
+    assert pdf_service._page_ranges(0, 3) == []
+
+def test_process_pool_extraction_matches_sequential_extraction(pdf_path, executor):
+    executor("thread")
+    sequential = asyncio.run(pdf_service.extract_text_from_path(pdf_path))
+    executor("process")
+    parallel = asyncio.run(pdf_service.extract_text_from_path(pdf_path))
+
+    assert parallel == sequential
+    assert "Page 7 clause 4" in parallel
+
+def test_process_pool_workers_are_not_forked(executor):
+    executor("process")
+
+    assert pdf_service.get_executor()._mp_context.get_start_method() in ("forkserver", "spawn")
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_page_range_blocks_join_to_the_full_text(pdf_path, executor, mode):
+    executor(mode)
+
+    async def collect():
+        return [block async for block in pdf_service.iter_pdf_text(pdf_path)]
+
+    blocks = asyncio.run(collect())
+
+    assert len(blocks) == 4
+    assert "\n".join(blocks) == pdf_service._extract_text_from_path(pdf_path)
+
+class ChunkedUpload:
+    """Upload whose read() returns at most block_size bytes and records the requested sizes"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.reads = []
+
+    async def read(self, size=-1):
+        self.reads.append(size)
+        block, self.content = self.content[:size], self.content[size:]
+        return block
+
+def test_uploads_are_spooled_in_blocks_with_their_digest(monkeypatch):
+    monkeypatch.setitem(pdf_service.PDF_CONFIG, "read_block_size", 1000)
+    content = bytes(range(256)) * 20
+    upload = ChunkedUpload(content)
+
+    path, digest, size = asyncio.run(pdf_service.spool_upload(upload))
+    try:
+        with open(path, "rb") as spooled:
+            assert spooled.read() == content
+    finally:
+        os.unlink(path)
+
+    assert size == len(content)
+    assert digest == hashlib.sha256(content).hexdigest()
+    assert set(upload.reads) == {1000}
+
+def test_extraction_is_cached_by_file_digest(pdf_path, executor, monkeypatch):
+    executor("thread")
+    parses = []
+    extract = pdf_service._extract_text_from_path
+    monkeypatch.setattr(pdf_service, "_extract_text_from_path", lambda path: parses.append(path) or extract(path))
+    digest = hashlib.sha256(open(pdf_path, "rb").read()).hexdigest()
+
+    first = asyncio.run(pdf_service.extract_text_from_path(pdf_path, digest))
+    second = asyncio.run(pdf_service.extract_text_from_path(pdf_path, digest))
+
+    assert first == second
+    assert len(parses) == 1
+    assert pdf_service.extraction_cache.get(digest) == first
+
+@pytest.mark.parametrize("max_tokens", [50, 300, 2000])
+def test_chunks_fit_the_budget_and_reassemble_to_the_text(max_tokens):
+    text = synthetic_policy(8, seed=5) + "\n\nPrämie für Ärzte — Selbstbehalt € 500."
+
+    chunks = pdf_service.chunk_text_by_tokens(text, max_tokens)
+
+    assert "".join(chunks) == text
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks)
+
+def test_batch_encoding_splits_long_texts_on_paragraph_breaks(monkeypatch):
+    text = synthetic_policy(8, seed=6)
+    monkeypatch.setattr(pdf_service, "BATCH_ENCODE_SEGMENT_CHARACTERS", 2000)
+    batches = []
+    tokenizer = pdf_service.get_tokenizer()
+    encode_batch = tokenizer.encode_ordinary_batch
+    monkeypatch.setattr(tokenizer, "encode_ordinary_batch", lambda texts: batches.append(texts) or encode_batch(texts))
+
+    tokens = pdf_service._encode_tokens(text, batch_encode=True)
+    chunks = pdf_service.chunk_text_by_tokens(text, 300, batch_encode=True)
+
+    segments = batches[0]
+    assert len(segments) > 1 and "".join(segments) == text
+    assert all(segment.endswith("\n\n") for segment in segments[:-1])
+    assert b"".join(tokenizer.decode_tokens_bytes(tokens)) == text.encode("utf-8")
+    assert "".join(chunks) == text
+
+def test_chunking_benchmark_reports_throughput():
+    result = run_case(synthetic_policy(4), max_tokens=300, batch_encode=False, repeats=1)
+
+    assert result["chunks"] > 1
+    assert result["seconds"] > 0
@@ -0,0 +1,69 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+
+import pdf_service
+import pipeline_service
+from benchmarks.chunking_benchmark import synthetic_policy
+from benchmarks.load_benchmark import make_pdf
+
+@pytest.fixture
+def policy_pdf(monkeypatch):
+    """A multi-page policy PDF, parsed one page per task so text arrives in several blocks"""
+    pdf_service.shutdown_executor()
+    monkeypatch.setitem(pdf_service.PDF_CONFIG, "executor", "thread")
+    monkeypatch.setitem(pdf_service.PDF_CONFIG, "pages_per_task", 1)
+    lines = synthetic_policy(6, seed=3).split("\n")
+    yield make_pdf([lines[i:i + 45] for i in range(0, len(lines), 45)])
+    pdf_service.shutdown_executor()
+
+def run_pipeline(pdf, custom_prompt=None, events=None):
+    async def on_event(event):
+        events.append(event)
+    upload = UploadFile(filename="policy.pdf", file=io.BytesIO(pdf))
+    return asyncio.run(pipeline_service.extract_and_summarize(
+        upload, custom_prompt, on_event=on_event if events is not None else None
+    ))
+
+def test_map_calls_start_before_extraction_finishes(policy_pdf, fake_llm, small_chunks, monkeypatch):
+    map_calls_at = {}
+    original_extraction = pdf_service.iter_pdf_text
+
+    async def observed_blocks(path):
+        async for block in original_extraction(path):
+            yield block
+        map_calls_at["extraction_end"] = fake_llm.kinds().count("map")
+
+    monkeypatch.setattr(pipeline_service, "iter_pdf_text", observed_blocks)
+    events = []
+    text, summary, spans, chunk_summaries = run_pipeline(policy_pdf, events=events)
+
+    # Earlier chunks were already being summarized while later pages were parsed
+    assert map_calls_at["extraction_end"] > 0
+    assert len(chunk_summaries) == fake_llm.kinds().count("map") > map_calls_at["extraction_end"]
+    assert fake_llm.kinds()[-1] == "reduce"
+    # The chunk spans tile the extracted text
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(end == start for (_, end), (start, _) in zip(spans, spans[1:]))
+    assert [event["event"] for event in events].count("extraction_done") == 1
+
+def test_pipelined_text_matches_a_full_extraction(policy_pdf, fake_llm, small_chunks, tmp_path):
+    path = tmp_path / "policy.pdf"
+    path.write_bytes(policy_pdf)
+
+    text, _, _, _ = run_pipeline(policy_pdf)
+
+    assert text == pdf_service._extract_text_from_path(str(path))
+
+def test_repeated_upload_is_served_from_the_caches(policy_pdf, fake_llm, small_chunks):
+    first = run_pipeline(policy_pdf)
+    calls = len(fake_llm.calls)
+
+    events = []
+    second = run_pipeline(policy_pdf, events=events)
+
+    assert second[:2] == first[:2]
+    assert len(fake_llm.calls) == calls
+    assert events[-1] == {"event": "summary_token", "text": first[1], "cached": True}
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from rate_limit_service import LLMScheduler, LocalBudget
+
+class GatedBudget:
+    """Budget whose reservations block until opened, recording the lock state meanwhile"""
+
+    def __init__(self, scheduler_ref):
+        self.scheduler_ref = scheduler_ref
+        self.gate = asyncio.Event()
+        self.locked_during_reserve = []
+        self.released = 0
+
+    async def reserve(self, tokens):
+        self.locked_during_reserve.append(self.scheduler_ref[0]._condition.locked())
+        await self.gate.wait()
+        return 0.0
+
+    async def release(self):
+        self.released += 1
+
+    async def pause(self, seconds):
+        pass
+
+def test_budget_is_reserved_without_holding_the_lock():
+    async def run():
+        holder = []
+        budget = GatedBudget(holder)
+        scheduler = LLMScheduler(2, budget)
+        holder.append(scheduler)
+        scheduler.in_flight = 1
+
+        pending = asyncio.create_task(scheduler.acquire(10))
+        await asyncio.sleep(0.01)
+        # A finishing call is not blocked by the slow reservation
+        await asyncio.wait_for(scheduler.release(), 0.1)
+        assert scheduler.in_flight == 0
+        budget.gate.set()
+        await pending
+        return budget, scheduler
+
+    budget, scheduler = asyncio.run(run())
+    assert budget.locked_during_reserve == [False]
+    assert scheduler.in_flight == 1 and scheduler._waiters == []
+
+def test_concurrency_cap_holds_across_lanes():
+    async def run():
+        scheduler = LLMScheduler(2, LocalBudget(0, 0))
+        state = {"active": 0, "peak": 0}
+
+        async def call(lane):
+            await scheduler.acquire(10, lane)
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+            await scheduler.release()
+
+        await asyncio.gather(*(call("bulk" if i % 2 else "interactive") for i in range(8)))
+        return state, scheduler
+
+    state, scheduler = asyncio.run(run())
+    assert state["peak"] == 2
+    assert scheduler.in_flight == 0
+
+def test_interactive_calls_go_ahead_of_bulk_calls_waiting_for_tokens():
+    async def run():
+        # 60000 tokens per minute refill at 1000 tokens per second
+        scheduler = LLMScheduler(4, LocalBudget(60000, 0))
+        await scheduler.acquire(60000, "bulk")
+        order = []
+
+        async def call(name, tokens, lane):
+            await scheduler.acquire(tokens, lane)
+            order.append(name)
+
+        started = time.monotonic()
+        bulk = asyncio.create_task(call("bulk", 100, "bulk"))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(call("interactive", 20, "interactive"))
+        await asyncio.gather(bulk, interactive)
+        return order, time.monotonic() - started
+
+    order, elapsed = asyncio.run(run())
+    assert order == ["interactive", "bulk"]
+    # The bulk call waited for its 100 tokens to refill
+    assert elapsed >= 0.09
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import openai_service
+from openai_service import _rank_by_relevance, refine_summary_with_feedback
+
+TOPICS = ["fire", "theft", "storm", "glass", "liability", "travel", "dental", "vision", "legal", "pets"]
+
+def section(topic, index):
+    return (
+        f"Clause {index}. Cover for {topic} claims is subject to the schedule. "
+        f"The insured must report {topic} incidents within thirty days of discovery.\n\n"
+    )
+
+def test_passages_are_ranked_by_bm25_relevance():
+    passages = [
+        "The premium is payable monthly by direct debit.",
+        "Flood damage to the basement is excluded unless flood cover is bought.",
+        "Damage caused by pets is excluded.",
+    ]
+
+    ranking = _rank_by_relevance(passages, "Is flood damage excluded?")
+
+    assert ranking[0] == 1
+    assert ranking[1] == 2
+    # Without query terms the original order is kept
+    assert _rank_by_relevance(passages, "is it?") == [0, 1, 2]
+
+def test_small_documents_are_refined_in_full(fake_llm):
+    refined = asyncio.run(refine_summary_with_feedback("Short policy text.", "Old summary", "unclear", "Simpler"))
+
+    assert refined == "refine output 1"
+    assert len(fake_llm.calls) == 1
+    assert "Original document:\n\nShort policy text." in fake_llm.calls[0][1]
+
+def test_large_documents_are_refined_from_section_summaries_and_relevant_passages(fake_llm, monkeypatch):
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "max_chunk_tokens", 300)
+    chunks = [section(topic, index) for index, topic in enumerate(TOPICS * 2)]
+    chunks[13] = "Clause 13. Flood damage is excluded unless the flood endorsement is purchased.\n\n"
+    chunk_summaries = ["Fire and theft are covered.", "Storm cover applies.", "Flood is excluded.", "Pets are not covered."]
+
+    asyncio.run(refine_summary_with_feedback(
+        "".join(chunks), "Old summary", "inaccurate", "The flood exclusion is missing",
+        chunks=chunks, chunk_summaries=chunk_summaries
+    ))
+
+    # One bounded call: the stored summaries are reused, no map pass is re-run
+    assert fake_llm.kinds() == ["refine"]
+    content = fake_llm.calls[0][1]
+    assert "Flood is excluded." in content and "Pets are not covered." in content
+    assert "Passage from section 14:\nClause 13. Flood damage is excluded" in content
+    assert content.count("Passage from section") < len(chunks)
+    assert openai_service.count_tokens(content) <= 300 + openai_service.count_tokens(
+        "Original summary:\n\nOld summary\n\nSection summaries:\n\n\n\nRelevant document passages:\n\n\n\n"
+        "Please provide an improved summary that addresses the feedback."
+    )
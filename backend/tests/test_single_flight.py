@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import openai_service
+import translator_service
+from benchmarks.chunking_benchmark import synthetic_policy
+from cache_service import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def run():
+        flight = SingleFlight("test")
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        assert "key" not in flight
+        # Finished calls are not remembered
+        return results + [await flight.do("key", work)]
+
+    assert asyncio.run(run()) == ["result"] * 6
+    assert len(calls) == 2
+
+def test_errors_reach_every_caller():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert [str(error) for error in errors] == ["upstream failed", "upstream failed"]
+
+def test_call_is_cancelled_only_when_its_last_caller_goes_away():
+    async def run():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+        cancelled = []
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "done"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await started.wait()
+        first.cancel()
+        assert await second == "done"
+        assert cancelled == []
+
+        third = asyncio.create_task(flight.do("other", work))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+        assert cancelled == [True]
+        assert "other" not in flight
+
+    asyncio.run(run())
+
+def test_identical_summaries_and_translations_in_flight_are_made_once(fake_llm, small_chunks, monkeypatch):
+    translations = []
+
+    async def post_translation_request(texts, languages):
+        translations.append(texts)
+        await asyncio.sleep(0.01)
+        return [{language: f"[{language}] {text}" for language in languages} for text in texts]
+
+    monkeypatch.setattr(translator_service, "_post_translation_request", post_translation_request)
+    text = synthetic_policy(3, seed=12)
+
+    async def run():
+        summaries = await asyncio.gather(*(openai_service.summarize_text(text) for _ in range(3)))
+        translated = await asyncio.gather(*(translator_service.translate_text("Covered.", "hi") for _ in range(3)))
+        return summaries, translated
+
+    summaries, translated = asyncio.run(run())
+    assert len(set(summaries)) == 1
+    assert fake_llm.kinds().count("reduce") == 1
+    assert len(set(translated)) == 1
+    assert len(translations) == 1
@@ -0,0 +1,138 @@
+import asyncio
+
+import openai_service
+from benchmarks.chunking_benchmark import synthetic_policy
+from model_service import count_tokens
+from pdf_service import chunk_text_by_tokens
+
+def test_groups_fill_the_budget_and_never_leave_a_lone_summary():
+    summaries = [f"Clause {i}: " + " ".join(["deductible"] * 30) for i in range(10)]
+    budget = 3 * openai_service._section_tokens(summaries[:1])
+
+    assert openai_service._group_summaries_by_tokens(summaries[:9], budget) == [summaries[0:3], summaries[3:6], summaries[6:9]]
+    # The tenth summary would be alone in a fourth group, so it joins the third
+    assert openai_service._group_summaries_by_tokens(summaries, budget) == [summaries[0:3], summaries[3:6], summaries[6:10]]
+    # Groups hold at least two summaries even when two exceed the budget
+    assert openai_service._group_summaries_by_tokens(summaries[:4], 1) == [summaries[0:2], summaries[2:4]]
+
+def test_reduce_tree_merges_level_by_level_until_one_call_fits(fake_llm):
+    summaries = [f"Section {i}: " + " ".join(["coverage detail"] * 40) for i in range(16)]
+    fake_llm.padding = 60
+    events = []
+
+    async def on_event(event):
+        events.append(event)
+
+    merged = asyncio.run(openai_service._merge_until_fits(
+        summaries, "prompt", input_budget=400, max_tokens=1000, temperature=0.7, on_event=on_event
+    ))
+
+    levels = [event for event in events if event["event"] == "reduce_level"]
+    assert len(levels) >= 2
+    assert [event["level"] for event in levels] == list(range(1, len(levels) + 1))
+    # Every level shrinks the list and the result fits the final call
+    assert all(later["groups"] < earlier["groups"] for earlier, later in zip(levels, levels[1:]))
+    assert openai_service._section_tokens(merged) <= 400
+    assert set(fake_llm.kinds()) == {"reduce"}
+
+def test_map_calls_run_concurrently_and_feed_one_final_reduce(fake_llm, small_chunks):
+    text = synthetic_policy(4, seed=3)
+    chunks = chunk_text_by_tokens(text, max_tokens=openai_service.chunk_token_budget())
+    assert len(chunks) > 3
+
+    summary = asyncio.run(openai_service.summarize_text(text))
+
+    assert fake_llm.kinds().count("map") == len(chunks)
+    assert fake_llm.peak > 1
+    assert fake_llm.kinds()[-1] == "reduce"
+    assert summary == f"reduce output {len(fake_llm.calls)}"
+
+def test_a_failed_map_call_cancels_and_awaits_the_others(small_chunks, monkeypatch):
+    unwound = []
+
+    async def create_completion(system_prompt, user_content, max_tokens, temperature, on_token=None, kind="summary"):
+        if "first" in user_content:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("map failed")
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            unwound.append(user_content)
+
+    monkeypatch.setattr(openai_service, "_create_completion", create_completion)
+
+    async def chunks():
+        # Together the chunks are too large for one direct call
+        for name in ("first", "second", "third"):
+            yield f"{name} chunk " + "clause " * 300, name == "third"
+
+    async def run():
+        try:
+            await openai_service._summarize_chunk_stream(chunks(), "prompt", 1000, 0.7)
+        except RuntimeError:
+            # The other calls have finished unwinding by the time the error surfaces
+            return len(unwound)
+
+    assert asyncio.run(run()) == 2
+
+def test_summary_is_cached_per_text_and_prompt(fake_llm, small_chunks):
+    text = synthetic_policy(1, seed=4)[:1000]
+    assert count_tokens(text) < 400
+
+    first = asyncio.run(openai_service.summarize_text(text))
+    calls = len(fake_llm.calls)
+    assert asyncio.run(openai_service.summarize_text(text)) == first
+    assert len(fake_llm.calls) == calls
+
+    asyncio.run(openai_service.summarize_text(text, custom_prompt="Summarize for a claims adjuster."))
+    assert len(fake_llm.calls) == calls + 1
+
+def test_map_chunks_are_never_smaller_than_the_baseline_chunk(monkeypatch):
+    assert openai_service.chunk_token_budget() == openai_service.MIN_MAP_CHUNK_TOKENS == 5500
+    monkeypatch.setitem(openai_service.PROCESSING_CONFIG, "map_chunk_max_tokens", 4000)
+    assert openai_service.chunk_token_budget() == 5500
+
+    # Larger chunks are capped by the model budget
+    monkeypatch.setitem(openai_service.OPENAI_CONFIG, "model", "gpt-4")
+    monkeypatch.setitem(openai_service.PROCESSING_CONFIG, "map_chunk_max_tokens", 100000)
+    assert openai_service.chunk_token_budget() == openai_service.input_token_budget(
+        openai_service.MAP_SYSTEM_PROMPT, openai_service.MAP_USER_TEMPLATE, openai_service.MAP_MAX_TOKENS
+    ) < 8192
+
+def test_documents_that_fit_the_summary_budget_are_summarized_in_one_direct_call(fake_llm):
+    # Larger than a map chunk, but well within the default model's context window
+    text = synthetic_policy(8, seed=9)
+    assert count_tokens(text) > 2 * openai_service.chunk_token_budget()
+
+    summary = asyncio.run(openai_service.summarize_text(text))
+
+    assert fake_llm.kinds() == ["summary"]
+    assert fake_llm.calls[0][1] == openai_service.DIRECT_USER_TEMPLATE + text
+    assert summary == "summary output 1"
+
+def test_streamed_chunks_that_fit_the_summary_budget_are_summarized_in_one_direct_call(fake_llm):
+    chunks = [f"Section {n}. " + "clause " * 3000 for n in range(3)]
+
+    async def stream():
+        for i, chunk in enumerate(chunks):
+            yield chunk, i == len(chunks) - 1
+
+    summary, chunk_summaries = asyncio.run(openai_service.summarize_chunk_stream(stream()))
+
+    assert fake_llm.kinds() == ["summary"]
+    assert fake_llm.calls[0][1] == openai_service.DIRECT_USER_TEMPLATE + "".join(chunks)
+    assert (summary, chunk_summaries) == ("summary output 1", [])
+
+def test_prompt_variants_reuse_the_map_pass(fake_llm, small_chunks):
+    text = synthetic_policy(4, seed=10)
+
+    asyncio.run(openai_service.summarize_text(text))
+    map_calls = fake_llm.kinds().count("map")
+    assert map_calls > 1
+
+    for interests in ("hospital cover", "claims process"):
+        asyncio.run(openai_service.summarize_text(text, custom_prompt=f"Focus on {interests}."))
+
+    # Only the reduce step runs again for each variant
+    assert fake_llm.kinds().count("map") == map_calls
+    assert fake_llm.kinds().count("reduce") >= 3
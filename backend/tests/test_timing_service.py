@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import timing_service
+import translator_service
+from timing_service import RequestTimings, current_timings, stage_timer, timing_labels
+
+@pytest.fixture
+def client(monkeypatch):
+    async def post_translation_request(texts, languages):
+        with stage_timer("translator_request"):
+            await asyncio.sleep(0.01)
+        return [{language: f"[{language}] {text}" for language in languages} for text in texts]
+
+    monkeypatch.setattr(translator_service, "_post_translation_request", post_translation_request)
+    return TestClient(main.app)
+
+def test_stages_from_concurrent_tasks_are_collected_with_their_labels():
+    timings = RequestTimings()
+
+    async def map_chunk(chunk):
+        with timing_labels(chunk=chunk), stage_timer("llm_map"):
+            await asyncio.sleep(0.01)
+
+    async def serve():
+        current_timings.set(timings)
+        with timing_labels(file="a.pdf"):
+            await asyncio.gather(map_chunk(1), map_chunk(2))
+        with stage_timer("llm_reduce"):
+            pass
+
+    asyncio.run(serve())
+
+    assert sorted((entry["stage"], entry.get("file"), entry.get("chunk")) for entry in timings.entries) == [
+        ("llm_map", "a.pdf", 1), ("llm_map", "a.pdf", 2), ("llm_reduce", None, None)
+    ]
+    totals = timings.totals()
+    assert totals["llm_map"]["count"] == 2 and totals["llm_map"]["duration_ms"] >= 20
+    header = timings.server_timing()
+    assert header.startswith('llm_map;dur=') and 'desc="2x"' in header and ", total;dur=" in header
+
+def test_timed_endpoints_report_server_timing_and_metadata(client):
+    response = client.post("/translate", data={"text": "Hello", "target_language": "de"})
+
+    assert response.status_code == 200
+    header = response.headers["Server-Timing"]
+    assert "translation;dur=" in header and "translator_request;dur=" in header
+    stages = response.json()["metadata"]["timings"]["stages"]
+    assert set(stages) == {"translation", "translator_request"}
+    assert "Server-Timing" not in client.get("/languages").headers
+
+def test_profiling_is_opt_in(client, monkeypatch, tmp_path):
+    form = {"text": "Hello", "target_language": "de"}
+    assert "X-Profile-Id" not in client.post("/translate", data=form, headers={"X-Profile": "1"}).headers
+
+    monkeypatch.setitem(timing_service.PROFILING_CONFIG, "enabled", True)
+    monkeypatch.setitem(timing_service.PROFILING_CONFIG, "sample_rate", 0.0)
+    monkeypatch.setitem(timing_service.PROFILING_CONFIG, "output_dir", str(tmp_path))
+    monkeypatch.setitem(timing_service.PROFILING_CONFIG, "max_files", 1)
+
+    assert "X-Profile-Id" not in client.post("/translate", data=form).headers
+    first = client.post("/translate", data=form, headers={"X-Profile": "1"}).headers["X-Profile-Id"]
+    second = client.post("/translate", data=form, headers={"X-Profile": "1"}).headers["X-Profile-Id"]
+
+    assert first != second
+    # Only the newest profile is kept
+    assert os.listdir(tmp_path) == [f"{second}.prof"]
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+import translator_service
+
+@pytest.fixture
+def translator(monkeypatch):
+    """Fake Translator requests; records the (texts, languages) of every request"""
+    requests = []
+
+    async def post_translation_request(texts, languages):
+        requests.append((list(texts), list(languages)))
+        return [{language: f"[{language}] {text}" for language in languages} for text in texts]
+
+    monkeypatch.setattr(translator_service, "_post_translation_request", post_translation_request)
+    return requests
+
+def test_translations_are_cached_and_counted(translator):
+    first = asyncio.run(translator_service.translate_text("The premium is due monthly.", "hi"))
+    second = asyncio.run(translator_service.translate_text("The premium is due monthly.", "hi"))
+
+    assert first == second == "[hi] The premium is due monthly."
+    assert len(translator) == 1
+    stats = translator_service.translation_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["memory_size"] == len(first.encode("utf-8"))
+
+def test_several_texts_and_languages_share_one_request(translator):
+    results = asyncio.run(translator_service.translate_texts(["Summary one.", "Summary two."], ["hi", "ta", "te"]))
+
+    assert translator == [(["Summary one.", "Summary two."], ["hi", "ta", "te"])]
+    assert results["ta"] == ["[ta] Summary one.", "[ta] Summary two."]
+
+def test_batches_respect_the_element_and_character_limits(monkeypatch):
+    monkeypatch.setattr(translator_service, "MAX_ELEMENTS_PER_REQUEST", 3)
+    monkeypatch.setattr(translator_service, "MAX_CHARACTERS_PER_REQUEST", 100)
+    texts = ["x" * length for length in (10, 40, 5, 5, 5, 30, 20)]
+    languages = ["hi", "ta", "te"]
+
+    batches = translator_service._pack_batches(texts, languages)
+
+    pairs = [(index, language) for indices, batch_languages in batches for index in indices for language in batch_languages]
+    assert sorted(pairs) == sorted((index, language) for index in range(len(texts)) for language in languages)
+    for indices, batch_languages in batches:
+        assert len(indices) <= 3
+        assert sum(len(texts[index]) for index in indices) * len(batch_languages) <= 100
+
+def test_request_asks_for_every_language_and_maps_the_response(monkeypatch):
+    from aiohttp import web
+
+    received = {}
+
+    async def translate(request):
+        received["to"] = request.query.getall("to")
+        received["body"] = await request.json()
+        return web.json_response([
+            {"translations": [{"to": language, "text": f"{language}:{item['text']}"} for language in received["to"]]}
+            for item in received["body"]
+        ])
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/translate", translate)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "endpoint", f"http://127.0.0.1:{port}")
+        try:
+            return await translator_service._post_translation_request(["Claim form", "Deductible"], ["hi", "ta"])
+        finally:
+            await translator_service.reset_session()
+            await runner.cleanup()
+
+    translated = asyncio.run(run())
+
+    assert received["to"] == ["hi", "ta"]
+    assert received["body"] == [{"text": "Claim form"}, {"text": "Deductible"}]
+    assert translated == [{"hi": "hi:Claim form", "ta": "ta:Claim form"}, {"hi": "hi:Deductible", "ta": "ta:Deductible"}]
+
+def reassemble(leading, segments, trailing):
+    return leading + "".join(segment + separator for segment, separator in segments) + trailing
+
+@pytest.mark.parametrize("text", [
+    "x. \n\n y",
+    "First clause applies. \n\nSecond clause applies.  \n\n\nThird clause.",
+    "  Leading and trailing whitespace.  \n",
+    "A very long sentence without any punctuation that must be cut on word boundaries somewhere",
+])
+def test_segments_reassemble_to_the_original_text(text):
+    for max_characters in range(2, len(text) + 2):
+        leading, segments, trailing = translator_service._segment_text(text, max_characters)
+
+        assert reassemble(leading, segments, trailing) == text, max_characters
+        assert all(0 < len(segment) <= max_characters for segment, _ in segments)
+
+def test_long_paragraphs_ending_in_sentences_keep_their_breaks():
+    paragraphs = [
+        " ".join(f"Clause {p}.{s} covers hospital treatment for the insured." for s in range(6))
+        for p in range(5)
+    ]
+    text = " \n\n".join(paragraphs) + "\n"
+
+    for max_characters in range(60, 200, 7):
+        leading, segments, trailing = translator_service._segment_text(text, max_characters)
+
+        assert reassemble(leading, segments, trailing) == text, max_characters
+        assert sum(separator.count("\n\n") for _, separator in segments) == 4
+
+def test_translated_segments_are_reassembled_with_the_original_spacing(translator, monkeypatch):
+    monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "max_segment_characters", 30)
+    text = "The policy covers fire. \n\nFlood damage is excluded. Claims need a form."
+
+    translated = asyncio.run(translator_service.translate_text(text, "hi"))
+
+    assert translated == "[hi] The policy covers fire. \n\n[hi] Flood damage is excluded. [hi] Claims need a form."
+    # One request per segment, none larger than the segment size
+    assert sorted(texts for texts, _ in translator) == [
+        ["Claims need a form."], ["Flood damage is excluded."], ["The policy covers fire. "]
+    ]
+
+def test_segment_requests_are_sent_concurrently(monkeypatch):
+    monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "max_segment_characters", 30)
+    in_flight = {"now": 0, "peak": 0}
+
+    async def post_translation_request(texts, languages):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+        return [{language: text for language in languages} for text in texts]
+
+    monkeypatch.setattr(translator_service, "_post_translation_request", post_translation_request)
+    text = " ".join(f"Clause {n} covers fire." for n in range(4))
+
+    asyncio.run(translator_service.translate_text(text, "hi"))
+
+    assert in_flight["peak"] == 4
+
+def test_a_failed_segment_request_only_resends_that_segment(monkeypatch):
+    from aiohttp import web
+
+    monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "max_segment_characters", 30)
+    monkeypatch.setattr(translator_service, "RETRY_DELAY_SECONDS", 0)
+    bodies = []
+
+    async def translate(request):
+        body = await request.json()
+        bodies.append([item["text"] for item in body])
+        if body == [{"text": "Flood damage is excluded."}] and bodies.count(bodies[-1]) == 1:
+            return web.Response(status=500)
+        return web.json_response([
+            {"translations": [{"to": "hi", "text": f"hi:{item['text']}"}]} for item in body
+        ])
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/translate", translate)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setitem(translator_service.TRANSLATOR_CONFIG, "endpoint", f"http://127.0.0.1:{port}")
+        try:
+            return await translator_service.translate_text(
+                "The policy covers fire. Flood damage is excluded. Claims need a form.", "hi"
+            )
+        finally:
+            await translator_service.reset_session()
+            await runner.cleanup()
+
+    translated = asyncio.run(run())
+
+    assert translated == "hi:The policy covers fire. hi:Flood damage is excluded. hi:Claims need a form."
+    assert len(bodies) == 4
+    assert bodies.count(["Flood damage is excluded."]) == 2
+    assert bodies.count(["The policy covers fire."]) == bodies.count(["Claims need a form."]) == 1
@@ -0,0 +1,163 @@
+import asyncio
+import gc
+import io
+import json
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.chunking_benchmark import synthetic_policy
+from benchmarks.load_benchmark import make_pdf
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Replace extraction and summarization with a slow fake that records concurrency"""
+    state = {"active": 0, "peak": 0}
+
+    async def extract_and_summarize(file, custom_prompt=None, on_event=None):
+        content = await file.read()
+        if b"broken" in content:
+            raise RuntimeError("cannot parse")
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            state["active"] -= 1
+        return content.decode(), f"summary of {file.filename}", None, None
+
+    monkeypatch.setattr(main, "extract_and_summarize", extract_and_summarize)
+    return state
+
+def upload(client, files, path="/upload"):
+    return client.post(path, files=[("files", (name, content, "application/pdf")) for name, content in files])
+
+def test_upload_processes_files_concurrently_up_to_the_limit(client, fake_pipeline, monkeypatch):
+    monkeypatch.setitem(main.PROCESSING_CONFIG, "max_concurrent_files", 2)
+    files = [(f"policy-{i}.pdf", f"text {i}".encode()) for i in range(5)]
+
+    response = upload(client, files)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["filename"] for result in results] == [name for name, _ in files]
+    assert [result["summaries"]["original"] for result in results] == [f"summary of {name}" for name, _ in files]
+    assert fake_pipeline["peak"] == 2
+
+def test_upload_isolates_errors_per_file(client, fake_pipeline):
+    files = [("a.pdf", b"text a"), ("notes.txt", b"text"), ("b.pdf", b"broken"), ("c.pdf", b"text c")]
+
+    results = upload(client, files).json()["results"]
+
+    assert results[0]["summaries"]["original"] == "summary of a.pdf"
+    assert results[1]["error"] == "Only PDF files are supported"
+    assert results[2]["error"] == "cannot parse"
+    assert results[3]["summaries"]["original"] == "summary of c.pdf"
+
+def stream_events(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_stream_reports_pipelined_chunking_and_summary(client, fake_llm, small_chunks):
+    pages = synthetic_policy(6, seed=8).split("\n")
+    pdf = make_pdf([pages[i:i + 45] for i in range(0, len(pages), 45)])
+
+    events = stream_events(upload(client, [("policy.pdf", pdf)], path="/upload/stream"))
+
+    names = [event["event"] for event in events]
+    assert names[-2:] == ["file_done", "complete"]
+    chunking = [event for event in events if event["event"] == "chunking_done"]
+    chunk_done = [event for event in events if event["event"] == "chunk_done"]
+    assert len(chunking) == 1
+    assert chunking[0]["chunks"] == len(chunk_done) == fake_llm.kinds().count("map") > 1
+    assert sorted(event["completed"] for event in chunk_done) == list(range(1, len(chunk_done) + 1))
+    assert names.index("extraction_done") < names.index("summary_done")
+    assert events[-2]["result"]["documentId"]
+
+def test_stream_cancels_and_awaits_work_when_the_client_goes_away(monkeypatch):
+    started = asyncio.Event()
+    cancelled = []
+
+    async def extract_and_summarize(file, custom_prompt=None, on_event=None):
+        await on_event({"event": "extraction_done", "characters": 0})
+        started.set()
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(file.filename)
+            raise
+
+    monkeypatch.setattr(main, "extract_and_summarize", extract_and_summarize)
+
+    async def disconnect():
+        files = [UploadFile(file=io.BytesIO(b"%PDF"), filename=f"{name}.pdf") for name in ("a", "b")]
+        response = await main.upload_files_stream(
+            files=files, target_language=None, target_languages=None, custom_prompt=None,
+            reading_level=None, interests=None, age_group=None
+        )
+        body = response.body_iterator
+        first = json.loads(await body.__anext__())
+        await started.wait()
+        await body.aclose()
+        return first
+
+    loop = asyncio.new_event_loop()
+    unretrieved = []
+    loop.set_exception_handler(lambda _, context: unretrieved.append(context))
+    try:
+        first = loop.run_until_complete(disconnect())
+        # Let finished tasks be collected, so a never-retrieved exception would be reported
+        gc.collect()
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+    assert first["event"] == "extraction_done"
+    assert sorted(cancelled) == ["a.pdf", "b.pdf"]
+    assert unretrieved == []
+
+def test_failed_personalization_falls_back_to_a_standard_summary(client, monkeypatch):
+    prompts = []
+
+    async def extract_and_summarize(file, custom_prompt=None, on_event=None):
+        content = await file.read()
+        prompts.append(custom_prompt)
+        if custom_prompt is not None:
+            raise RuntimeError("personalized reduce failed")
+        return content.decode(), "standard summary", None, None
+
+    monkeypatch.setattr(main, "extract_and_summarize", extract_and_summarize)
+
+    response = client.post(
+        "/upload",
+        files=[("files", ("policy.pdf", b"text", "application/pdf"))],
+        data={"reading_level": "basic", "interests": "dental"}
+    )
+
+    result = response.json()["results"][0]
+    assert result["summaries"]["original"] == "standard summary"
+    assert result["personalized"] is False
+    assert prompts[0] is not None and prompts[1:] == [None]
+
+def test_extraction_errors_are_not_retried_without_personalization(client, monkeypatch):
+    calls = []
+
+    async def extract_and_summarize(file, custom_prompt=None, on_event=None):
+        calls.append(custom_prompt)
+        raise main.HTTPException(status_code=500, detail="Failed to extract text from PDF: Empty file content")
+
+    monkeypatch.setattr(main, "extract_and_summarize", extract_and_summarize)
+
+    response = client.post(
+        "/upload",
+        files=[("files", ("policy.pdf", b"", "application/pdf"))],
+        data={"reading_level": "basic"}
+    )
+
+    assert "Failed to extract text" in response.json()["results"][0]["error"]
+    assert len(calls) == 1
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import model_service
+import warmup_service
+
+@pytest.fixture
+def warmup(monkeypatch):
+    """Fake warm-up steps that record their order; set fail to make the client step raise"""
+    steps = []
+    behaviour = {"fail": False}
+
+    def get_tokenizer():
+        steps.append("tokenizer")
+
+    def get_client():
+        steps.append("openai_client")
+        if behaviour["fail"]:
+            raise RuntimeError("no endpoint configured")
+
+    async def get_session():
+        steps.append("translator_session")
+
+    monkeypatch.setattr(warmup_service, "get_tokenizer", get_tokenizer)
+    monkeypatch.setattr(warmup_service, "get_client", get_client)
+    monkeypatch.setattr(warmup_service, "get_session", get_session)
+    monkeypatch.setattr(warmup_service, "state", warmup_service.WARMING)
+    monkeypatch.setattr(warmup_service, "error", None)
+    monkeypatch.setattr(warmup_service, "timings", {})
+    monkeypatch.setattr(warmup_service, "_task", None)
+    return steps, behaviour
+
+def test_vendored_encoding_is_copied_into_the_tiktoken_cache(tmp_path, monkeypatch):
+    vendored = tmp_path / "encodings"
+    vendored.mkdir()
+    (vendored / "o200k_base.tiktoken").write_bytes(b"bpe ranks")
+    monkeypatch.setitem(model_service.TOKENIZER_CONFIG, "encoding_dir", str(vendored))
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path / "cache"))
+
+    model_service._seed_encoding_cache("o200k_base")
+
+    url = model_service.ENCODING_URL.format(name="o200k_base")
+    cached = tmp_path / "cache" / hashlib.sha1(url.encode()).hexdigest()
+    assert cached.read_bytes() == b"bpe ranks"
+    assert os.listdir(tmp_path / "cache") == [cached.name]
+
+def test_warm_up_prepares_every_client_and_records_timings(warmup):
+    steps, _ = warmup
+
+    asyncio.run(warmup_service.warm_up())
+
+    assert steps == ["tokenizer", "openai_client", "translator_session"]
+    status = warmup_service.readiness()
+    assert status["status"] == warmup_service.READY and status["error"] is None
+    assert {"tokenizer", "openai_client", "translator_session"} <= set(status["startup_seconds"])
+
+def test_failed_warm_up_is_reported_and_retried(warmup, monkeypatch):
+    steps, behaviour = warmup
+    monkeypatch.setitem(warmup_service.WARMUP_CONFIG, "enabled", True)
+    behaviour["fail"] = True
+
+    async def run():
+        warmup_service.start_warm_up()
+        await warmup_service._task
+        failed = warmup_service.readiness()
+        behaviour["fail"] = False
+        warmup_service.start_warm_up()
+        await warmup_service._task
+        return failed
+
+    failed = asyncio.run(run())
+
+    assert failed["status"] == warmup_service.FAILED
+    assert failed["error"] == "no endpoint configured"
+    assert warmup_service.state == warmup_service.READY
+    assert steps == ["tokenizer", "openai_client", "tokenizer", "openai_client", "translator_session"]
+
+def test_ready_endpoint_reports_503_until_warm(warmup, monkeypatch):
+    client = TestClient(main.app)
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == warmup_service.WARMING
+
+    # With warm-up disabled the process is ready at once
+    monkeypatch.setitem(warmup_service.WARMUP_CONFIG, "enabled", False)
+    warmup_service.start_warm_up()
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == warmup_service.READY
+    assert client.get("/").json() == {"status": "healthy"}
+
+def test_importing_the_app_creates_no_clients_and_loads_no_tokenizer():
+    # A fresh interpreter, as a worker process starts
+    check = (
+        "import main, model_service, openai_service, translator_service;"
+        "assert openai_service.client is None;"
+        "assert translator_service.session is None;"
+        "assert model_service.get_encoding.cache_info().currsize == 0"
+    )
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", check], cwd=backend, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,130 @@
+import cProfile
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from config import PROFILING_CONFIG
+from metrics_service import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+class RequestTimings:
+    """Stage durations recorded while serving one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.entries: List[Dict[str, Any]] = []
+
+    def add(self, stage: str, seconds: float, labels: Dict[str, Any]):
+        self.entries.append({"stage": stage, "duration_ms": round(seconds * 1000, 2), **labels})
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Summed duration and count per stage; concurrent calls overlap, so sums can exceed wall time"""
+        totals: Dict[str, Dict[str, float]] = {}
+        for entry in self.entries:
+            total = totals.setdefault(entry["stage"], {"duration_ms": 0.0, "count": 0})
+            total["duration_ms"] = round(total["duration_ms"] + entry["duration_ms"], 2)
+            total["count"] += 1
+        return totals
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def summary(self) -> Dict[str, Any]:
+        """The timings block returned in response metadata"""
+        return {"total_ms": self.elapsed_ms(), "stages": self.totals(), "entries": self.entries}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value with one metric per stage plus the total"""
+        metrics = [
+            f'{stage};dur={total["duration_ms"]};desc="{int(total["count"])}x"'
+            for stage, total in self.totals().items()
+        ]
+        metrics.append(f"total;dur={self.elapsed_ms()}")
+        return ", ".join(metrics)
+
+# Timings of the request being served, and labels (file, chunk) attached to its entries.
+# Tasks copy the context when created, so entries from fan-out tasks land in the same
+# RequestTimings while labels set inside a task stay local to it.
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("current_timings", default=None)
+current_labels: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("current_labels", default={})
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage duration in the latency histogram and the current request's timings"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds, current_labels.get())
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one occurrence of a stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+@contextmanager
+def timing_labels(**labels: Any) -> Iterator[None]:
+    """Attach labels such as file=... or chunk=... to stages timed inside the block"""
+    token = current_labels.set({**current_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        current_labels.reset(token)
+
+# cProfile hooks the whole interpreter, so only one request is profiled at a time
+profile_lock = threading.Lock()
+
+def should_profile(requested: bool) -> bool:
+    """Whether to profile a request: opt-in only, explicitly requested or sampled"""
+    if not PROFILING_CONFIG["enabled"]:
+        return False
+    return requested or random.random() < PROFILING_CONFIG["sample_rate"]
+
+def start_profile() -> Optional[cProfile.Profile]:
+    """Start a profiler, or return None if another request is already being profiled"""
+    if not profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except Exception as e:
+        profile_lock.release()
+        logger.warning(f"Could not start profiler: {e}")
+        return None
+    return profiler
+
+def finish_profile(profiler: cProfile.Profile, path: str) -> str:
+    """
+    Stop the profiler and write its stats under PROFILING_CONFIG["output_dir"];
+    returns the profile id. The event loop is shared, so the stats also include
+    other requests served concurrently; executor threads and processes are not
+    included.
+    """
+    try:
+        profiler.disable()
+    finally:
+        profile_lock.release()
+
+    output_dir = PROFILING_CONFIG["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    profile_id = f"{int(time.time())}-{path.strip('/').replace('/', '_') or 'root'}-{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(os.path.join(output_dir, f"{profile_id}.prof"))
+
+    # Keep only the newest profiles
+    profiles = sorted(
+        (entry for entry in os.scandir(output_dir) if entry.name.endswith(".prof")),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in profiles[:-PROFILING_CONFIG["max_files"]]:
+        os.unlink(entry.path)
+
+    logger.info(f"Saved profile {profile_id} for {path}")
+    return profile_id
@@ -3,10 +3,12 @@ import logging
 import uuid
 import aiohttp
 from config import TRANSLATOR_CONFIG
-from functools import lru_cache
-import hashlib
 import asyncio
-from typing import Optional
+import re
+from typing import Dict, List, Optional
+from cache_service import create_cache, make_cache_key, SingleFlight
+from metrics_service import TRANSLATOR_REQUESTS, TRANSLATOR_CHARACTERS
+from timing_service import stage_timer
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +35,7 @@ async def get_session():
             try:
                 session = aiohttp.ClientSession(
                     connector=aiohttp.TCPConnector(
-                        limit=10,
+                        limit=TRANSLATOR_CONFIG["max_connections"],
                         ttl_dns_cache=300,
                         force_close=False,
                         enable_cleanup_closed=True
@@ -45,60 +47,104 @@ async def get_session():
                 raise
     return session
 
-@lru_cache(maxsize=1000)
 def _cache_key(text: str, target_language: str) -> str:
     """Create a cache key for translation"""
-    return hashlib.md5(f"{text}:{target_language}".encode()).hexdigest()
+    return make_cache_key("translation", target_language, text)
 
-translation_cache = {}
+# Bounded translation cache (in-memory LRU in front of a persistent SQLite tier)
+translation_cache = create_cache("translation")
 
-async def translate_text(text: str, target_language: str) -> str:
-    """Translate text using Azure Translator with caching"""
-    max_retries = 3
-    retry_delay = 1  # seconds
+# Identical translation requests made concurrently share one set of Translator calls
+translation_flight = SingleFlight("translation")
 
-    try:
-        logger.info(f"Translation requested for language: {target_language}")
+# Azure Translator v3 limits per request: array elements, and characters
+# counted across all target languages
+MAX_ELEMENTS_PER_REQUEST = 1000
+MAX_CHARACTERS_PER_REQUEST = 50000
 
-        # Check cache first
-        cache_key = _cache_key(text, target_language)
-        if cache_key in translation_cache:
-            logger.info("Translation found in cache")
-            return translation_cache[cache_key]
+# Attempts per request; only the segments of the failed request are resent
+MAX_RETRIES = 3
+RETRY_DELAY_SECONDS = 1
 
-        subscription_key = TRANSLATOR_CONFIG["subscription_key"]
-        endpoint = TRANSLATOR_CONFIG["endpoint"]
-        location = TRANSLATOR_CONFIG["location"]
+# Boundaries used to segment long texts, keeping the separators for reassembly
+PARAGRAPH_BOUNDARY = re.compile(r'(\n\s*\n)')
+SENTENCE_BOUNDARY = re.compile(r'((?<=[.!?])\s+)')
 
-        if not all([subscription_key, endpoint, location]):
-            logger.error("Azure Translator credentials not configured")
-            raise ValueError("Azure Translator credentials not configured")
+def _pack_batches(
+    texts: List[str],
+    languages: List[str],
+    max_text_characters: int = MAX_CHARACTERS_PER_REQUEST
+) -> List[tuple[List[int], List[str]]]:
+    """
+    Pack text indices and target languages into request batches that respect the
+    service's element and character limits. Each request carries at most
+    max_text_characters of source text, so the segments of a long text go out as
+    several requests that are sent concurrently and retried independently.
+    Returns (text_indices, languages) pairs.
+    """
+    batches = []
 
-        path = '/translate'
-        constructed_url = endpoint + path
+    # Split the languages when the longest text cannot go to all of them in one request
+    longest = max((len(text) for text in texts), default=0)
+    languages_per_request = max(1, min(len(languages), MAX_CHARACTERS_PER_REQUEST // max(longest, 1)))
+    language_groups = [
+        languages[i:i + languages_per_request]
+        for i in range(0, len(languages), languages_per_request)
+    ]
 
-        params = {
-            'api-version': '3.0',
-            'from': 'en',
-            'to': target_language
-        }
+    for language_group in language_groups:
+        current_indices = []
+        current_characters = 0
+        for index, text in enumerate(texts):
+            if current_indices and (
+                len(current_indices) >= MAX_ELEMENTS_PER_REQUEST
+                or (current_characters + len(text)) * len(language_group) > MAX_CHARACTERS_PER_REQUEST
+                or current_characters + len(text) > max_text_characters
+            ):
+                batches.append((current_indices, language_group))
+                current_indices = []
+                current_characters = 0
+            current_indices.append(index)
+            current_characters += len(text)
+        if current_indices:
+            batches.append((current_indices, language_group))
 
-        headers = {
-            'Ocp-Apim-Subscription-Key': subscription_key,
-            'Ocp-Apim-Subscription-Region': location,
-            'Content-type': 'application/json',
-            'X-ClientTraceId': str(uuid.uuid4())
-        }
+    return batches
 
-        body = [{
-            'text': text
-        }]
+async def _post_translation_request(texts: List[str], languages: List[str]) -> List[Dict[str, str]]:
+    """
+    Send one Translator request for several texts and target languages.
+    Returns, for each input text, a mapping of language code to translated text.
+    """
+    subscription_key = TRANSLATOR_CONFIG["subscription_key"]
+    endpoint = TRANSLATOR_CONFIG["endpoint"]
+    location = TRANSLATOR_CONFIG["location"]
 
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Sending translation request to Azure for language: {target_language} (attempt {attempt+1}/{max_retries})")
-                session = await get_session()
+    if not all([subscription_key, endpoint, location]):
+        logger.error("Azure Translator credentials not configured")
+        raise ValueError("Azure Translator credentials not configured")
+
+    path = '/translate'
+    constructed_url = endpoint + path
+
+    # Repeated 'to' parameters request every language in the same round trip
+    params = [('api-version', '3.0'), ('from', 'en')] + [('to', language) for language in languages]
+
+    headers = {
+        'Ocp-Apim-Subscription-Key': subscription_key,
+        'Ocp-Apim-Subscription-Region': location,
+        'Content-type': 'application/json',
+        'X-ClientTraceId': str(uuid.uuid4())
+    }
+
+    body = [{'text': text} for text in texts]
 
+    for attempt in range(MAX_RETRIES):
+        try:
+            logger.info(f"Sending translation request to Azure: {len(texts)} texts to {', '.join(languages)} (attempt {attempt+1}/{MAX_RETRIES})")
+            session = await get_session()
+
+            with stage_timer("translator_request"):
                 async with session.post(
                     constructed_url,
                     params=params,
@@ -109,33 +155,183 @@ async def translate_text(text: str, target_language: str) -> str:
                 ) as response:
                     response.raise_for_status()
                     result = await response.json()
-                    logger.info(f"Received response from Azure: {result}")
-
-                    if result and len(result) > 0:
-                        translations = result[0].get('translations', [])
-                        if translations and len(translations) > 0:
-                            translated_text = translations[0].get('text', '')
-                            if translated_text:
-                                # Cache the result
-                                translation_cache[cache_key] = translated_text
-                                logger.info("Translation successful and cached")
-                                return translated_text
-                            else:
-                                logger.error("Empty translation received")
-                                raise ValueError("Empty translation received from Azure")
-
-                    logger.error("No translation found in the response")
-                    raise ValueError("No translation found in the response")
-
-            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as e:
-                logger.warning(f"Connection error on attempt {attempt+1}/{max_retries}: {e}")
-                if attempt < max_retries - 1:
-                    # Reset session before retry
-                    await reset_session()
-                    await asyncio.sleep(retry_delay * (attempt + 1))  # Exponential backoff
+            TRANSLATOR_REQUESTS.labels("success").inc()
+            TRANSLATOR_CHARACTERS.inc(sum(len(text) for text in texts) * len(languages))
+
+            if not result or len(result) != len(texts):
+                logger.error("No translation found in the response")
+                raise ValueError("No translation found in the response")
+
+            translated = []
+            for item in result:
+                by_language = {
+                    translation.get('to'): translation.get('text', '')
+                    for translation in item.get('translations', [])
+                }
+                missing = [language for language in languages if not by_language.get(language)]
+                if missing:
+                    logger.error(f"Empty translation received for: {', '.join(missing)}")
+                    raise ValueError("Empty translation received from Azure")
+                translated.append(by_language)
+            return translated
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as e:
+            TRANSLATOR_REQUESTS.labels("error").inc()
+            logger.warning(f"Connection error on attempt {attempt+1}/{MAX_RETRIES}: {e}")
+            if attempt < MAX_RETRIES - 1:
+                # The pooled session is shared by concurrent segment requests, so it is
+                # not reset here; get_session recreates it if it has been closed
+                await asyncio.sleep(RETRY_DELAY_SECONDS * (attempt + 1))  # Exponential backoff
+            else:
+                # Last attempt failed
+                raise
+
+def _split_units(text: str, boundary: re.Pattern) -> List[tuple[str, str]]:
+    """Split text on a boundary pattern into (content, trailing separator) pairs"""
+    parts = boundary.split(text)
+    return [(parts[i], parts[i + 1] if i + 1 < len(parts) else "") for i in range(0, len(parts), 2)]
+
+def _segment_text(text: str, max_characters: int) -> tuple[str, List[tuple[str, str]], str]:
+    """
+    Split text into segments of at most max_characters on paragraph, then sentence,
+    then word boundaries. Returns (leading whitespace, [(segment, separator)], trailing
+    whitespace) so the translated segments can be reassembled with the original spacing.
+    """
+    body = text.strip()
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()):] if body else ""
+
+    units = []
+    for paragraph, paragraph_separator in _split_units(body, PARAGRAPH_BOUNDARY):
+        if len(paragraph) <= max_characters:
+            units.append((paragraph, paragraph_separator))
+            continue
+
+        sentences = _split_units(paragraph, SENTENCE_BOUNDARY)
+        last_sentence, last_separator = sentences[-1]
+        sentences[-1] = (last_sentence, last_separator + paragraph_separator)
+        for sentence, sentence_separator in sentences:
+            # Fall back to word boundaries (or a hard cut) for very long sentences
+            while len(sentence) > max_characters:
+                cut = sentence.rfind(" ", 0, max_characters)
+                if cut <= 0:
+                    units.append((sentence[:max_characters], ""))
+                    sentence = sentence[max_characters:]
                 else:
-                    # Last attempt failed
-                    raise
+                    units.append((sentence[:cut], " "))
+                    sentence = sentence[cut + 1:]
+            units.append((sentence, sentence_separator))
+
+    # Merge consecutive units back together up to the segment size
+    segments = []
+    current, current_separator = "", ""
+    for unit, separator in units:
+        if not unit:
+            # Empty units (e.g. after a paragraph's final sentence) only carry whitespace;
+            # keep it after the preceding text instead of replacing that text's separator
+            if current:
+                current_separator += separator
+            elif segments:
+                segments[-1] = (segments[-1][0], segments[-1][1] + separator)
+            continue
+        if current and len(current) + len(current_separator) + len(unit) > max_characters:
+            segments.append((current, current_separator))
+            current, current_separator = unit, separator
+        else:
+            current = current + current_separator + unit if current else unit
+            current_separator = separator
+    if current:
+        segments.append((current, current_separator))
+
+    return leading, segments, trailing
+
+async def _translate_segments(segments: List[str], target_languages: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Translate unique segments, consulting the cache first. Batches are sent concurrently;
+    successful batches are cached even when another batch fails, so a retry only
+    resends the segments that did not come back.
+    """
+    translated: Dict[str, Dict[str, str]] = {language: {} for language in target_languages}
+
+    # Check cache first and group the misses by the set of languages they still need
+    pending: Dict[tuple, List[str]] = {}
+    for segment in segments:
+        missing_languages = []
+        for language in target_languages:
+            cached_translation = translation_cache.get(_cache_key(segment, language))
+            if cached_translation is not None:
+                translated[language][segment] = cached_translation
+            else:
+                missing_languages.append(language)
+        if missing_languages:
+            pending.setdefault(tuple(missing_languages), []).append(segment)
+
+    if not pending:
+        logger.info("All translations found in cache")
+        return translated
+
+    # Requests of about one segment each, so they run concurrently over the pooled
+    # session and a failure only resends the segments of that request
+    max_characters = TRANSLATOR_CONFIG["max_segment_characters"]
+    requests = []
+    for languages, group_segments in pending.items():
+        for batch_positions, batch_languages in _pack_batches(group_segments, list(languages), max_characters):
+            requests.append(([group_segments[position] for position in batch_positions], batch_languages))
+
+    responses = await asyncio.gather(
+        *(_post_translation_request(batch_segments, languages) for batch_segments, languages in requests),
+        return_exceptions=True
+    )
+
+    errors = []
+    for (batch_segments, languages), response in zip(requests, responses):
+        if isinstance(response, BaseException):
+            errors.append(response)
+            continue
+        for segment, by_language in zip(batch_segments, response):
+            for language in languages:
+                translated[language][segment] = by_language[language]
+                # Cache the result
+                translation_cache.set(_cache_key(segment, language), by_language[language])
+
+    if errors:
+        logger.error(f"{len(errors)} of {len(requests)} translation requests failed")
+        raise errors[0]
+
+    logger.info(f"Translation successful and cached ({len(requests)} requests)")
+    return translated
+
+async def translate_texts(texts: List[str], target_languages: List[str]) -> Dict[str, List[str]]:
+    """
+    Translate several texts into several languages using Azure Translator with caching.
+
+    Long texts are split into segments below the service limits; cache lookups run
+    first and only the missing segments are sent, in requests of at most
+    max_segment_characters each, translated concurrently and reassembled in order. Returns a mapping of language code to
+    translations in input order.
+    """
+    try:
+        logger.info(f"Translation requested for {len(texts)} texts to: {', '.join(target_languages)}")
+
+        max_characters = TRANSLATOR_CONFIG["max_segment_characters"]
+        segmented = [_segment_text(text, max_characters) for text in texts]
+        unique_segments = list(dict.fromkeys(
+            segment for _, segments, _ in segmented for segment, _ in segments
+        ))
+
+        with stage_timer("translation"):
+            translated = await translation_flight.do(
+                make_cache_key("translate", unique_segments, target_languages),
+                lambda: _translate_segments(unique_segments, target_languages)
+            )
+
+        return {
+            language: [
+                leading + "".join(translated[language][segment] + separator for segment, separator in segments) + trailing
+                for leading, segments, trailing in segmented
+            ]
+            for language in target_languages
+        }
 
     except Exception as e:
         logger.error(f"Error translating text: {e}")
@@ -144,6 +340,11 @@ async def translate_text(text: str, target_language: str) -> str:
             detail=f"Failed to translate text: {str(e)}"
         )
 
+async def translate_text(text: str, target_language: str) -> str:
+    """Translate text using Azure Translator with caching"""
+    results = await translate_texts([text], [target_language])
+    return results[target_language][0]
+
 async def cleanup():
     """Cleanup resources"""
     try:
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from config import WARMUP_CONFIG
+from model_service import get_tokenizer
+from openai_service import get_client
+from translator_service import get_session
+from metrics_service import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Warm-up states reported by GET /ready
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+state = WARMING
+error: Optional[str] = None
+# Seconds per startup phase, see metrics_service.STARTUP_SECONDS
+timings: Dict[str, float] = {}
+
+# perf_counter() when main.py started importing the app; set by record_import
+_import_started: Optional[float] = None
+_task: Optional[asyncio.Task] = None
+
+def record_import(started: float):
+    """Record when the app started importing and how long the import took"""
+    global _import_started
+    _import_started = started
+    _record("import", time.perf_counter() - started)
+
+def _record(phase: str, seconds: float):
+    timings[phase] = round(seconds, 4)
+    STARTUP_SECONDS.labels(phase=phase).set(seconds)
+
+def _mark_ready():
+    global state, error
+    state, error = READY, None
+    if _import_started is not None:
+        _record("ready", time.perf_counter() - _import_started)
+    logger.info(f"Ready to serve requests; startup timings: {timings}")
+
+async def warm_up():
+    """
+    Load the tokenizer and create the Azure OpenAI client and the Translator session,
+    so the first request does not pay for them. Nothing here calls the Azure services;
+    only the tokenizer may need a download when no vendored or cached file exists.
+    """
+    global state, error
+    state, error = WARMING, None
+    try:
+        started = time.perf_counter()
+        # Parsing the BPE file takes a while; keep the event loop free meanwhile
+        await asyncio.to_thread(get_tokenizer)
+        _record("tokenizer", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        get_client()
+        _record("openai_client", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await get_session()
+        _record("translator_session", time.perf_counter() - started)
+    except Exception as e:
+        state, error = FAILED, str(e)
+        logger.error(f"Warm-up failed: {e}")
+        return
+    _mark_ready()
+
+def start_warm_up():
+    """
+    Run the warm-up in the background, or mark the process ready at once when it is
+    disabled (clients and tokenizer are then created by the first request using them).
+    Also retries a warm-up that failed.
+    """
+    global _task
+    if not WARMUP_CONFIG["enabled"]:
+        _mark_ready()
+        return
+    if _task is None or (_task.done() and state == FAILED):
+        _task = asyncio.create_task(warm_up())
+
+def readiness() -> Dict[str, Any]:
+    """Warm-up state, error and startup timings for GET /ready"""
+    return {"status": state, "error": error, "startup_seconds": dict(timings)}
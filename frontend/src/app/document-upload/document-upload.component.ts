@@ -15,7 +15,7 @@ interface DocumentResult {
     original: string;
     [key: string]: string;
   };
-  originalText?: string;
+  documentId?: string;
   personalized?: boolean;
   error?: string;
 }
@@ -224,7 +224,6 @@ export class DocumentUploadComponent implements OnInit {
 
             this.results = response.results.map(result => ({
               ...result,
-              originalText: result.originalText || '',
               personalized: isPersonalized
             }));
           }
@@ -317,7 +316,7 @@ export class DocumentUploadComponent implements OnInit {
       feedbackType
     };
 
-    // Only send original text and summary for unclear/inaccurate feedback
+    // Only ask the server to refine the stored document for unclear/inaccurate feedback
     const needsRefinement = feedbackType === 'unclear' || feedbackType === 'inaccurate';
 
     // Check if we need to include target language for translation
@@ -326,8 +325,7 @@ export class DocumentUploadComponent implements OnInit {
     this.uploadService.submitFeedback({
       summary_id: result.filename,
       feedback_type: feedbackType,
-      original_text: needsRefinement ? result.originalText : undefined,
-      original_summary: needsRefinement ? result.summaries.original : undefined,
+      document_id: needsRefinement ? result.documentId : undefined,
       feedback_text: feedbackText || undefined,
       target_language: targetLanguage
     }).subscribe({
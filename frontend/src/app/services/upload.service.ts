@@ -27,7 +27,7 @@ interface UploadResponse {
       original: string;
       [key: string]: string;
     };
-    originalText?: string;
+    documentId?: string;
     personalized?: boolean;
     error?: string;
   }>;
@@ -81,8 +81,7 @@ export class UploadService {
   submitFeedback(feedback: {
     summary_id: string;
     feedback_type: string;
-    original_text?: string;
-    original_summary?: string;
+    document_id?: string;
     feedback_text?: string;
     target_language?: string;
   }): Observable<any> {
@@ -90,12 +89,9 @@ export class UploadService {
     formData.append('summary_id', feedback.summary_id);
     formData.append('feedback_type', feedback.feedback_type);
 
-    // Add original text and summary if available for refinement
-    if (feedback.original_text) {
-      formData.append('original_text', feedback.original_text);
-    }
-    if (feedback.original_summary) {
-      formData.append('original_summary', feedback.original_summary);
+    // The server keeps the document text and latest summary; send only its id
+    if (feedback.document_id) {
+      formData.append('document_id', feedback.document_id);
     }
     if (feedback.feedback_text) {
       formData.append('feedback_text', feedback.feedback_text);